@@ -0,0 +1,122 @@
+"""
+benchmark_phi_scrubber.py
+
+Times utils/phi_scrubber.py against the implementation it replaced, on long
+transcripts and on short realtime segments, and checks that scrubbing from several
+threads at once gives consistent results.
+
+Run from the repository root:
+
+    python scripts/benchmark_phi_scrubber.py
+
+The equivalence of incremental and full scrubs is covered by the client tests in
+src/FreeScribe.client/tests/test_phi_scrubber.py.
+"""
+
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import scrubadub
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "FreeScribe.client"))
+
+from utils.phi_scrubber import IncrementalScrubber, get_phi_scrubber
+
+
+def legacy_scrub(text):
+    # The implementation phi_scrubber.py replaced
+    cleaned_message = scrubadub.clean(text)
+    scrub_patterns = [
+        (re.compile(r'\b\d{10}\b'), '{{OHIP}}'),
+        (re.compile(r'\b(\d{4})-(\d{3})-(\d{3})(?:[- ]?[A-Za-z]{2})?\b'), '{{OHIP}}'),
+        (re.compile(r'\b[ABCEGHJ-NPRSTVXY]\d[ABCEGHJ-NPRSTV-Z][ -]?\d[ABCEGHJ-NPRSTV-Z]\d\b', re.IGNORECASE), '{{POSTAL_CODE}}'),
+        (re.compile(r'\b\d+ [A-Z][a-z]+ (Street|St|Avenue|Ave|Road|Rd|Drive|Dr)\b', re.IGNORECASE), '{{ADDRESS}}'),
+    ]
+    for regex, replacement in scrub_patterns:
+        cleaned_message = regex.sub(replacement, cleaned_message)
+    return cleaned_message
+
+
+def make_transcript(minutes):
+    """
+    Build a synthetic transcript of roughly ``minutes`` of speech with PHI in it.
+
+    :param minutes: Length of the visit, at about 150 words per minute.
+    :type minutes: float
+    :rtype: str
+    """
+    sentences = [
+        "The patient reports a dry cough for the last two weeks and mild fever at night.",
+        "Her OHIP number is 1234567890 and she lives at 42 Maple Street in Ottawa.",
+        "You can reach her at 613-555-0199 or by email at jane.doe@example.com.",
+        "She has no known drug allergies and takes metformin 500 mg twice a day.",
+        "The postal code on file is K1A 0B1, the card reads 1234-567-890-AB.",
+        "Blood pressure was 128 over 82, heart rate 76, oxygen saturation 98 percent.",
+    ]
+    words_per_sentence = sum(len(s.split()) for s in sentences) / len(sentences)
+    count = int(minutes * 150 / words_per_sentence)
+    return " ".join(sentences[i % len(sentences)] for i in range(count))
+
+
+def run_benchmark(minutes=(5, 15, 30), repeat=5, threads=4):
+    """
+    Time the scrubber against the previous implementation and print the results.
+
+    :param minutes: Transcript lengths to test, in minutes of speech.
+    :type minutes: tuple[int]
+    :param repeat: Runs per transcript, the fastest is reported.
+    :type repeat: int
+    :param threads: Threads scrubbing concurrently in the thread-safety check.
+    :type threads: int
+    """
+    scrubber = get_phi_scrubber()
+
+    def best_of(fn, text):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    print(f"{'minutes':>8} {'chars':>8} {'previous':>10} {'current':>10} {'speedup':>8} {'spans':>6}")
+    for length in minutes:
+        text = make_transcript(length)
+        legacy = best_of(legacy_scrub, text)
+        current = best_of(scrubber.clean, text)
+        spans = len(scrubber.scrub(text).spans)
+        print(f"{length:>8} {len(text):>8} {legacy * 1000:>8.1f}ms {current * 1000:>8.1f}ms {legacy / current:>7.1f}x {spans:>6}")
+
+    # Realtime segments are short, there the per call set up of the previous implementation dominates
+    segments = [make_transcript(0.1)] * 100
+    legacy = best_of(lambda texts: [legacy_scrub(t) for t in texts], segments)
+    current = best_of(lambda texts: [scrubber.clean(t) for t in texts], segments)
+    print(f"100 short segments: previous {legacy * 1000:.1f}ms, current {current * 1000:.1f}ms, {legacy / current:.1f}x")
+
+    # What is left to do when a realtime recording stops
+    text = make_transcript(minutes[-1])
+    incremental = IncrementalScrubber(scrubber)
+    start = time.perf_counter()
+    for i in range(0, len(text), 120):
+        incremental.add_text(text[i:i + 120] + "\n")
+    spread = time.perf_counter() - start
+    full = best_of(lambda t: scrubber.scrub(t.strip()), incremental.text)
+    at_stop = best_of(lambda t: incremental.result(t), incremental.text)
+    print(f"{minutes[-1]} minute recording: full scrub at stop {full * 1000:.1f}ms, "
+          f"incremental {at_stop * 1000:.1f}ms at stop after {spread * 1000:.1f}ms spread over the recording")
+
+    text = make_transcript(minutes[0])
+    expected = scrubber.clean(text)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(scrubber.clean, [text] * threads * 4))
+    consistent = all(r == expected for r in results)
+    print(f"Concurrent scrubbing on {threads} threads: {'consistent' if consistent else 'INCONSISTENT'}")
+    return consistent
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_benchmark() else 1)
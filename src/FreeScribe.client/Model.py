@@ -1,15 +1,31 @@
 try:
     from llama_cpp import Llama
+    from llama_cpp.llama_cache import LlamaRAMCache, LlamaDiskCache
     LLAMA_AVAILABLE = True
 except ImportError:
     Llama = None
+    LlamaRAMCache = None
+    LlamaDiskCache = None
     LLAMA_AVAILABLE = False
 
 import os
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, Iterator
 import threading
 from UI.LoadingWindow import LoadingWindow
 import tkinter.messagebox as messagebox
+from utils.file_utils import get_resource_path
+from utils.speculative_decoding import SPECULATIVE_OFF, SPECULATIVE_MODES, create_draft_model
+from utils.token_budget import TokenCounter
+from utils.cancellation import OperationCancelledError
+from utils.model_registry import ModelRegistry, ResidentModelPool, parse_model_routes
+from utils.llama_tuner import KV_CACHE_TYPES, LlamaProfileStore, LlamaTuner, default_thread_count, profile_key
+
+PROMPT_CACHE_RAM = "RAM"
+PROMPT_CACHE_DISK = "Disk"
+PROMPT_CACHE_OFF = "Off"
+PROMPT_CACHE_MODES = [PROMPT_CACHE_RAM, PROMPT_CACHE_DISK, PROMPT_CACHE_OFF]
+PROMPT_CACHE_DIR = "llama_prompt_cache"
 
 class Model:
     """
@@ -39,7 +55,15 @@ class Model:
         tensor_split: Optional[list] = None,  # For multi-GPU setup
         n_batch: int = 512,    # Batch size for inference
         n_threads: Optional[int] = None,  # CPU threads when needed
-        seed: int = 1337
+        n_threads_batch: Optional[int] = None,  # CPU threads for prompt evaluation
+        flash_attn: bool = False,
+        kv_cache: str = "f16",
+        use_mmap: bool = True,
+        use_mlock: bool = False,
+        seed: int = 1337,
+        speculative_mode: str = SPECULATIVE_OFF,
+        draft_tokens: int = 10,
+        draft_model_path: Optional[str] = None
     ):
         """
         Initializes the GGUF model with GPU acceleration.
@@ -51,8 +75,16 @@ class Model:
             main_gpu: Main GPU device index
             tensor_split: List of GPU memory splits for multi-GPU setup
             n_batch: Batch size for inference
-            n_threads: Number of CPU threads
+            n_threads: Number of CPU threads for generation, defaults to the physical cores
+            n_threads_batch: Number of CPU threads for prompt evaluation, defaults to all cores
+            flash_attn: Use flash attention
+            kv_cache: KV cache type, ``f16`` or ``q8_0`` (needs flash attention)
+            use_mmap: Memory map the model file
+            use_mlock: Lock the model in RAM so it is never swapped out
             seed: Random seed for reproducibility
+            speculative_mode: ``Off``, ``Prompt Lookup`` or ``Draft Model``
+            draft_tokens: Number of tokens drafted per speculative decoding round
+            draft_model_path: Path to the draft GGUF for the ``Draft Model`` mode
         """
         if not LLAMA_AVAILABLE:
             raise ImportError("llama-cpp-python is not installed. Cannot use Local LLM. Please use remote API mode or install llama-cpp-python.")
@@ -60,6 +92,19 @@ class Model:
         try:
             # Set environment variables for GPU
             os.environ["CUDA_VISIBLE_DEVICES"] = str(main_gpu)
+
+            # os.cpu_count() includes hyperthreads, which slow down generation
+            n_threads = n_threads or default_thread_count()
+            n_threads_batch = n_threads_batch or os.cpu_count()
+
+            # Drafted tokens are verified by the main model in a single batch
+            self.draft_model = create_draft_model(
+                speculative_mode,
+                num_pred_tokens=draft_tokens,
+                draft_model_path=draft_model_path,
+                context_size=context_size,
+                n_threads=n_threads,
+            )
             
             # Initialize model with GPU settings
             self.model = Llama(
@@ -67,18 +112,37 @@ class Model:
                 n_ctx=context_size,
                 n_gpu_layers=gpu_layers,
                 n_batch=n_batch,
-                n_threads=n_threads or os.cpu_count(),
+                n_threads=n_threads,
+                n_threads_batch=n_threads_batch,
+                flash_attn=flash_attn,
+                type_k=KV_CACHE_TYPES[kv_cache],
+                type_v=KV_CACHE_TYPES[kv_cache],
+                use_mmap=use_mmap,
+                use_mlock=use_mlock,
                 seed=seed,
                 tensor_split=tensor_split,
                 chat_format=chat_template,
+                draft_model=self.draft_model,
             )
         
+            # llama.cpp contexts are not safe for concurrent generation
+            self.lock = threading.Lock()
+            self.last_stats = None
+            self.token_counter = TokenCounter("llama.cpp", self.count_tokens, exact=True)
+
             # Store configuration
             self.config = {
+                "model_path": model_path,
                 "gpu_layers": gpu_layers,
                 "main_gpu": main_gpu,
                 "context_size": context_size,
-                "n_batch": n_batch
+                "n_batch": n_batch,
+                "n_threads": n_threads,
+                "n_threads_batch": n_threads_batch,
+                "flash_attn": flash_attn,
+                "kv_cache": kv_cache,
+                "speculative_mode": speculative_mode if self.draft_model else SPECULATIVE_OFF,
+                "draft_tokens": draft_tokens,
             }
         except Exception as e:
             self.model = None
@@ -90,7 +154,8 @@ class Model:
         max_tokens: int = 50,
         temperature: float = 0.1,
         top_p: float = 0.95,
-        repeat_penalty: float = 1.1
+        repeat_penalty: float = 1.1,
+        cancel_event: Optional[threading.Event] = None
     ) -> str:
         """
         Generates a response using GPU-accelerated inference.
@@ -101,36 +166,192 @@ class Model:
             temperature: Sampling temperature (higher = more random)
             top_p: Top-p sampling threshold
             repeat_penalty: Penalty for repeating tokens
+            cancel_event: Optional event, generation stops between tokens once it is set
             
         Returns:
             Generated text response
         """
         try:
-            # Generate response using the model
+            return "".join(self.generate_response_stream(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                repeat_penalty=repeat_penalty,
+                cancel_event=cancel_event,
+            ))
+        except Exception as e:
+            print(f"GPU inference error ({e.__class__.__name__}): {str(e)}")
+            return f"({e.__class__.__name__}): {str(e)}"
+
+    def generate_response_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 50,
+        temperature: float = 0.1,
+        top_p: float = 0.95,
+        repeat_penalty: float = 1.1,
+        cancel_event: Optional[threading.Event] = None,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        Generates a response and yields the text as each token is produced.
+
+        Timing for the call is stored in ``last_stats`` once the generator finishes.
+
+        Args:
+            prompt: Input text prompt
+            max_tokens: Maximum number of tokens to generate
+            temperature: Sampling temperature (higher = more random)
+            top_p: Top-p sampling threshold
+            repeat_penalty: Penalty for repeating tokens
+            cancel_event: Optional event, generation stops between tokens once it is set
+            response_format: Optional ``{"type": "json_object", "schema": ...}``, sampling is
+                constrained by a grammar built from the schema
 
-            # Message template for chat completion
-            messages = [
-                {"role": "user", 
-                "content": prompt}
-            ]
+        Yields:
+            Text fragments of the response
 
-            response = self.model.create_chat_completion(
+        Raises:
+            Exception: Any inference error from llama.cpp
+        """
+        # Message template for chat completion
+        messages = [
+            {"role": "user", 
+            "content": prompt}
+        ]
+
+        with self.lock:
+            self._check_loaded()
+            start_time = time.perf_counter()
+            first_token_time = None
+            token_count = 0
+            cancelled = False
+            if self.draft_model is not None:
+                self.draft_model.reset()
+
+            stream = self.model.create_chat_completion(
                 messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=top_p,
                 repeat_penalty=repeat_penalty,
+                response_format=response_format,
+                stream=True,
             )
 
-            # reset the model tokens
-            self.model.reset()
-            return response["choices"][0]["message"]["content"]
-            
-        except Exception as e:
-            print(f"GPU inference error ({e.__class__.__name__}): {str(e)}")
-            return f"({e.__class__.__name__}): {str(e)}"
+            try:
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        cancelled = True
+                        break
+
+                    content = chunk["choices"][0]["delta"].get("content")
+                    if not content:
+                        continue
+
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    # llama.cpp emits roughly one chunk per sampled token
+                    token_count += 1
+                    yield content
+            finally:
+                # Closing the generator stops llama.cpp from sampling further tokens.
+                # The context is deliberately not reset: the next call only evaluates
+                # the tokens after the prefix it shares with this one.
+                stream.close()
+
+                self._record_stats(start_time, first_token_time, token_count, cancelled)
+
+    def _record_stats(self, start_time, first_token_time, token_count, cancelled):
+        """Store and log timing and speculative decoding information for the last generation."""
+        end_time = time.perf_counter()
+        time_to_first_token = (first_token_time - start_time) if first_token_time else None
+        generation_time = (end_time - first_token_time) if first_token_time else 0.0
+        tokens_per_second = (token_count / generation_time) if generation_time > 0 else None
+
+        self.last_stats = {
+            "tokens": token_count,
+            "time_to_first_token": time_to_first_token,
+            "tokens_per_second": tokens_per_second,
+            "total_time": end_time - start_time,
+            "cancelled": cancelled,
+            "draft_acceptance": None,
+        }
+
+        draft_text = ""
+        if self.draft_model is not None:
+            acceptance = self.draft_model.acceptance_rate(token_count)
+            self.last_stats["draft_acceptance"] = acceptance
+            self.last_stats["drafted_tokens"] = self.draft_model.drafted
+            if acceptance is not None:
+                draft_text = f", {acceptance:.0%} of {self.draft_model.drafted} drafted tokens accepted"
+
+        ttft_text = f"{time_to_first_token:.2f}s" if time_to_first_token is not None else "n/a"
+        tps_text = f"{tokens_per_second:.1f}" if tokens_per_second is not None else "n/a"
+        status = " (cancelled)" if cancelled else ""
+        print(f"Local model: {token_count} tokens in {end_time - start_time:.1f}s, "
+              f"time to first token {ttft_text}, {tps_text} tokens/s{draft_text}{status}")
+
+    def warm_up(self):
+        """
+        Runs a one token generation.
+
+        The first generation pages the weights into memory and allocates the compute
+        buffers, which adds seconds to the first request. Doing it right after loading
+        moves that cost off the first note.
+        """
+        start_time = time.perf_counter()
+        with self.lock:
+            self._check_loaded()
+            self.model.create_chat_completion(
+                [{"role": "user", "content": "Hello"}],
+                max_tokens=1,
+                temperature=0.0,
+            )
+        print(f"Local model warmed up in {time.perf_counter() - start_time:.1f}s")
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Counts the tokens of a text with the model's tokenizer.
+
+        Args:
+            text: The text to measure
+
+        Returns:
+            Number of tokens, without the BOS token
+        """
+        return len(self.model.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def set_prompt_cache(self, mode: str = PROMPT_CACHE_RAM, size_mb: int = 1024, cache_dir: Optional[str] = None):
+        """
+        Configures the prompt prefix cache.
+
+        llama.cpp already reuses the KV state for the prefix shared with the previous
+        call. The prompt cache keeps the state of several earlier prompts, so
+        alternating between prompt templates (note, facts list, lab analysis, HL7)
+        still only evaluates the variable part of each prompt. Entries are evicted
+        least recently used first once the cache exceeds its size.
+
+        Args:
+            mode: ``RAM``, ``Disk`` or ``Off``
+            size_mb: Maximum cache size in megabytes
+            cache_dir: Directory for the disk cache
+        """
+        capacity_bytes = max(0, int(size_mb)) * 1024 * 1024
+
+        with self.lock:
+            if mode == PROMPT_CACHE_OFF or capacity_bytes == 0:
+                self.model.set_cache(None)
+                print("Prompt cache disabled.")
+            elif mode == PROMPT_CACHE_DISK:
+                cache_dir = cache_dir or get_resource_path(PROMPT_CACHE_DIR)
+                self.model.set_cache(LlamaDiskCache(cache_dir=cache_dir, capacity_bytes=capacity_bytes))
+                print(f"Prompt cache on disk at {cache_dir} ({size_mb} MB).")
+            else:
+                self.model.set_cache(LlamaRAMCache(capacity_bytes=capacity_bytes))
+                print(f"Prompt cache in RAM ({size_mb} MB).")
 
-    
     def get_gpu_info(self) -> Dict[str, Any]:
         """
         Returns information about the current GPU configuration.
@@ -145,9 +366,22 @@ class Model:
     def close(self):
         """
         Unloads the model from GPU memory.
+
+        Waits for a generation or warm-up in progress, freeing the llama.cpp context
+        under it would crash the process.
         """
-        self.model.close()
-        self.model = None
+        with self.lock:
+            if self.model is not None:
+                self.model.close()
+                self.model = None
+            if self.draft_model is not None:
+                self.draft_model.close()
+                self.draft_model = None
+
+    def _check_loaded(self):
+        """Raise if the model was closed. Caller holds the lock."""
+        if self.model is None:
+            raise RuntimeError("The local model was unloaded.")
     
     def __del__(self):
         """Cleanup GPU memory on deletion"""
@@ -155,6 +389,10 @@ class Model:
             self.model.close()
         self.model = None
 
+class ModelLoadError(Exception):
+    """Raised when the local model failed to load or was not loaded."""
+
+
 class ModelManager:
     """
     Manages the lifecycle of a local LLM model including setup and unloading operations.
@@ -163,88 +401,447 @@ class ModelManager:
     using the llama.cpp Python bindings. It supports different model architectures and
     quantization levels.
 
+    Loading happens on a background thread. ``load_state`` tells whether the model is
+    loading, ready or failed, and ``wait_until_ready`` blocks until the load finishes
+    and raises the load error instead of returning a missing model.
+
     Attributes:
         local_model (Llama): Static reference to the loaded model instance. None if no model is loaded.
+        load_state (str): One of the ``LOAD_STATE_*`` constants.
+        load_error (Exception): The error of the last failed load, if any.
     """
     local_model = None
 
+    LOAD_STATE_UNLOADED = "unloaded"
+    LOAD_STATE_LOADING = "loading"
+    LOAD_STATE_READY = "ready"
+    LOAD_STATE_FAILED = "failed"
+
+    load_state = LOAD_STATE_UNLOADED
+    load_error = None
+    # Set whenever no load is in progress
+    load_event = threading.Event()
+    load_event.set()
+    load_lock = threading.Lock()
+    # Incremented by every load and unload so a superseded load discards its model
+    load_generation = 0
+
+    registry = ModelRegistry()
+    # Tuned llama.cpp settings per model, see utils/llama_tuner.py
+    profiles = LlamaProfileStore()
+    # Additional models that prompt types are routed to, see get_model_for_route
+    pool = None
+    # Vocabulary only tokenizers of routed models that are not loaded yet, by path
+    route_token_counters = {}
+    # Closes unloaded models once their current generation finished
+    unload_thread = None
+
     @staticmethod
-    def setup_model(app_settings, root):
+    def setup_model(app_settings, root, force_tune=False):
         """
         Initialize and load the LLM model based on application settings.
 
-        Creates a loading window and starts model loading in a separate thread to prevent
-        UI freezing. Automatically checks thread status and closes the loading window
-        when complete.
+        Shows a loading window while the model loads on a background thread. The window
+        is closed by the loading thread once the model is ready or failed to load.
 
         Args:
             app_settings: Application settings object containing model preferences
             root: Tkinter root window for creating the loading dialog
+            force_tune: Benchmark the llama.cpp settings before loading, even if the
+                model was tuned before
 
-        Raises:
-            ValueError: If the specified model file cannot be loaded
-        
         Note:
-            The method uses threading to avoid blocking the UI while loading the model.
             GPU layers are set to -1 for CUDA architecture and 0 for CPU.
         """
-        loading_window = LoadingWindow(root, "Loading Model", "Loading Model. Please wait")
+        message = "Tuning Model. This can take a few minutes" if force_tune else "Loading Model. Please wait"
+        loading_window = LoadingWindow(root, "Loading Model", message)
 
-        # unload before loading new model
-        if ModelManager.local_model is not None:
+        # unload before loading new model, this also supersedes a load in progress
+        if ModelManager.load_state != ModelManager.LOAD_STATE_UNLOADED:
             ModelManager.unload_model()
 
-        def load_model():
-            """
-            Internal function to handle the actual model loading process.
-            
-            Determines the model file based on settings and initializes the Llama instance
-            with appropriate parameters.
-            """
-            gpu_layers = 0
+        ModelManager.load_model_async(
+            app_settings,
+            show_errors=True,
+            on_finished=lambda: root.after(0, loading_window.destroy),
+            force_tune=force_tune,
+        )
+
+    @staticmethod
+    def preload_model(app_settings):
+        """
+        Load the model in the background at startup without blocking the window.
+
+        Args:
+            app_settings: Application settings object containing model preferences
+        """
+        print("Preloading the local model in the background.")
+        ModelManager.load_model_async(app_settings, show_errors=True)
+
+    @staticmethod
+    def load_model_async(app_settings, show_errors=False, on_finished=None, warm_up=True, force_tune=False):
+        """
+        Start loading the model on a background thread, unless a load is already running.
+
+        Args:
+            app_settings: Application settings object containing model preferences
+            show_errors: Show a message box if loading fails
+            on_finished: Called on the loading thread once loading succeeded or failed
+            warm_up: Run a one token generation after loading so the first request does
+                not pay for paging in the weights and allocating compute buffers
+            force_tune: Benchmark the llama.cpp settings before loading, even if the
+                model was tuned before
+
+        Returns:
+            The loading thread, or None if a load was already running
+        """
+        with ModelManager.load_lock:
+            if ModelManager.load_state == ModelManager.LOAD_STATE_LOADING:
+                return None
+            ModelManager.load_generation += 1
+            generation = ModelManager.load_generation
+            ModelManager.load_state = ModelManager.LOAD_STATE_LOADING
+            ModelManager.load_error = None
+            ModelManager.load_event.clear()
+
+        thread = threading.Thread(
+            target=ModelManager._load_model,
+            args=(app_settings, generation, show_errors, on_finished, warm_up, force_tune),
+            name="local-llm-load",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    @staticmethod
+    def _load_model(app_settings, generation, show_errors, on_finished, warm_up, force_tune=False):
+        """
+        Internal function to handle the actual model loading process.
+
+        Determines the model file based on settings and initializes the Llama instance
+        with appropriate parameters.
+        """
+        # Free the memory of the previous model before loading the next one
+        unload_thread = ModelManager.unload_thread
+        if unload_thread is not None:
+            unload_thread.join()
+
+        model_info = ModelManager.registry.resolve(app_settings.editable_settings["Model"])
+        model_path = model_info.path
+        print(f"Loading local model {model_info.describe()}")
+
+        speculative_mode = app_settings.editable_settings["Speculative Decoding"]
+        if speculative_mode not in SPECULATIVE_MODES:
+            print(f"Unknown speculative decoding mode '{speculative_mode}', using {SPECULATIVE_OFF}.")
+            speculative_mode = SPECULATIVE_OFF
+        try:
+            draft_tokens = max(1, int(app_settings.editable_settings["Speculative Draft Tokens"]))
+        except (TypeError, ValueError):
+            draft_tokens = 10
+
+        model_arguments = ModelManager._model_arguments(model_info, app_settings)
+        key = profile_key(model_path, model_arguments["gpu_layers"])
+        if force_tune or (app_settings.editable_settings["Auto-Tune Local Model"] and ModelManager.profiles.get(key) is None):
+            ModelManager._tune_model(model_info, model_arguments, generation)
+            model_arguments = ModelManager._model_arguments(model_info, app_settings)
+
+        start_time = time.perf_counter()
+        model = None
+        error = None
+        try:
+            model = Model(model_path,
+                **model_arguments,
+                speculative_mode=speculative_mode,
+                draft_tokens=draft_tokens,
+                draft_model_path=app_settings.editable_settings["Draft Model Path"] or None)
+        except Exception as e:
+            # model doesnt exist
+            #TODO: Logo to system log
+            error = e
+
+        with ModelManager.load_lock:
+            superseded = generation != ModelManager.load_generation
+            if not superseded:
+                ModelManager.local_model = model
+                ModelManager.load_error = error
+                ModelManager.load_state = ModelManager.LOAD_STATE_FAILED if error else ModelManager.LOAD_STATE_READY
 
-            if app_settings.editable_settings["Architecture"] == "CUDA (Nvidia GPU)":
-                gpu_layers = -1
+        if superseded:
+            # Unloaded or replaced while loading
+            if model is not None:
+                model.close()
+            if callable(on_finished):
+                on_finished()
+            return
 
-            #model_to_use = "gemma-2-2b-it-Q8_0.gguf"
-            model_to_use = "mistral-7b-instruct-v0.2.Q4_K_M.gguf"    
-            model_path = f"./models/{model_to_use}"
+        if error is None:
+            print(f"Local model loaded in {time.perf_counter() - start_time:.1f}s")
+            ModelManager.apply_prompt_cache_settings(app_settings)
+
+        ModelManager.load_event.set()
+        if callable(on_finished):
+            on_finished()
+
+        if error is not None:
+            print(f"Local model failed to load ({error.__class__.__name__}): {str(error)}")
+            if show_errors:
+                messagebox.showerror("Model Error", f"Model failed to load. Please ensure you have a valid model selected in the settings. Currently trying to load: {os.path.abspath(model_path)}. Error received ({error.__class__.__name__}): {str(error)}")
+        elif warm_up:
             try:
-                ModelManager.local_model = Model(model_path,
-                    context_size=4096,
-                    gpu_layers=gpu_layers,
-                    main_gpu=0,
-                    n_batch=512,
-                    n_threads=None,
-                    seed=1337)
+                model.warm_up()
             except Exception as e:
-                # model doesnt exist
-                #TODO: Logo to system log
-                messagebox.showerror("Model Error", f"Model failed to load. Please ensure you have a valid model selected in the settings. Currently trying to load: {os.path.abspath(model_path)}. Error received ({e.__class__.__name__}): {str(e)}")
-                ModelManager.local_model = None
+                print(f"Local model warm-up failed ({e.__class__.__name__}): {str(e)}")
 
-        thread = threading.Thread(target=load_model)
-        thread.start()
+    @staticmethod
+    def _tune_model(model_info, model_arguments, generation):
+        """
+        Benchmark llama.cpp settings for a model and save the best profile.
 
-        def check_thread_status(thread, loading_window, root):
-            """
-            Recursive function to check the status of the model loading thread.
-
-            Args:
-                thread: The thread to monitor
-                loading_window: LoadingWindow instance to close when complete
-                root: Tkinter root window for scheduling checks
-            """
-            if thread.is_alive():
-                root.after(500, lambda: check_thread_status(thread, loading_window, root))
-            else:
-                loading_window.destroy()
+        Runs on the loading thread before the model is loaded, so only one copy of the
+        model is in memory. A failed tuning is logged and the model loads with defaults.
+        """
+        if not os.path.exists(model_info.path):
+            return
+
+        tuner = LlamaTuner(
+            model_info.path,
+            context_size=model_arguments["context_size"],
+            gpu_layers=model_arguments["gpu_layers"],
+            # Stop if the model is unloaded or replaced while tuning
+            should_stop=lambda: generation != ModelManager.load_generation,
+        )
+        try:
+            profile = tuner.tune()
+        except Exception as e:
+            print(f"Tuning the local model failed ({e.__class__.__name__}): {str(e)}")
+            return
+
+        if generation == ModelManager.load_generation:
+            ModelManager.profiles.put(profile_key(model_info.path, model_arguments["gpu_layers"]), profile)
+
+    @staticmethod
+    def _model_arguments(model_info, app_settings):
+        """
+        Common Model arguments for a model file.
 
-        root.after(500, lambda: check_thread_status(thread, loading_window, root))
+        The context is the Local Context Size setting, limited to the context length the
+        model was trained with. Threads, batch size and KV cache come from the tuned
+        profile of the model. An untuned model uses the thread counts tuned for another
+        model on the same device, if any.
+        """
+        gpu_layers = 0
+
+        if app_settings.editable_settings["Architecture"] == "CUDA (Nvidia GPU)":
+            gpu_layers = -1
+
+        try:
+            context_size = int(app_settings.editable_settings["Local Context Size"])
+        except (TypeError, ValueError):
+            context_size = 4096
+        if model_info.context_length:
+            context_size = min(context_size, model_info.context_length)
 
+        arguments = dict(
+            context_size=context_size,
+            gpu_layers=gpu_layers,
+            main_gpu=0,
+            n_batch=512,
+            n_threads=None,
+            seed=1337,
+        )
+
+        profile = ModelManager.profiles.get(profile_key(model_info.path, gpu_layers))
+        if profile is None:
+            profile = ModelManager.profiles.get_device_threads("gpu" if gpu_layers else "cpu") or {}
+        for name in ("n_batch", "n_threads", "n_threads_batch", "flash_attn", "kv_cache", "use_mmap", "use_mlock"):
+            if name in profile:
+                arguments[name] = profile[name]
+        return arguments
 
     @staticmethod
-    def start_model_threaded(settings, root_window):
+    def retune_model(settings, root_window):
+        """
+        Forget the tuned profile of the selected model and reload it with a new tuning run.
+
+        :param settings: Configuration settings for the model
+        :param root_window: The main application window reference
+        :type root_window: tkinter.Tk
+        :return: The created thread instance
+        :rtype: threading.Thread
+        """
+        model_info = ModelManager.registry.resolve(settings.editable_settings["Model"])
+        gpu_layers = ModelManager._model_arguments(model_info, settings)["gpu_layers"]
+        ModelManager.profiles.remove(profile_key(model_info.path, gpu_layers))
+        return ModelManager.start_model_threaded(settings, root_window, force_tune=True)
+
+    @staticmethod
+    def resolve_route(route, app_settings):
+        """
+        Find the model a prompt type is routed to.
+
+        Args:
+            route: Prompt type, e.g. ``Scribe``, an HL7 prompt or ``Lab Analysis``
+            app_settings: Application settings object containing the routes
+
+        Returns:
+            The routed ModelInfo, or None if the prompt type uses the main model
+        """
+        if not route:
+            return None
+
+        model_name = parse_model_routes(app_settings.editable_settings["Local Model Routes"]).get(route)
+        if not model_name:
+            return None
+
+        model_info = ModelManager.registry.find(model_name)
+        if model_info is None:
+            print(f"Model '{model_name}' routed for {route} was not found in {ModelManager.registry.models_dir}, using the main model.")
+            return None
+
+        main_model = ModelManager.local_model
+        if main_model is not None and os.path.abspath(main_model.config["model_path"]) == os.path.abspath(model_info.path):
+            return None
+        return model_info
+
+    @staticmethod
+    def get_route_context_size(model_info, app_settings):
+        """
+        Get the context size a routed model is loaded with.
+
+        Args:
+            model_info: The routed ModelInfo
+            app_settings: Application settings object
+
+        Returns:
+            The context size in tokens
+        """
+        return ModelManager._model_arguments(model_info, app_settings)["context_size"]
+
+    @staticmethod
+    def get_route_token_counter(model_info):
+        """
+        Get the token counter of a routed model.
+
+        The loaded model's tokenizer is used when the model is in the pool. Otherwise only
+        its vocabulary is loaded, which is quick, so the request is planned with the right
+        tokenizer before the model itself is loaded.
+
+        Args:
+            model_info: The routed ModelInfo
+
+        Returns:
+            The TokenCounter, or None if the vocabulary could not be loaded
+        """
+        pool = ModelManager.pool
+        model = pool.peek(model_info) if pool is not None else None
+        if model is not None:
+            return model.token_counter
+
+        counter = ModelManager.route_token_counters.get(model_info.path)
+        if counter is None and LLAMA_AVAILABLE:
+            try:
+                vocab = Llama(model_path=model_info.path, vocab_only=True, verbose=False)
+            except Exception as e:
+                print(f"Failed to load the tokenizer of {model_info.file_name} ({e.__class__.__name__}): {str(e)}")
+                return None
+            counter = TokenCounter(
+                "llama.cpp",
+                lambda text: len(vocab.tokenize(text.encode("utf-8"), add_bos=False, special=True)),
+                exact=True,
+            )
+            ModelManager.route_token_counters[model_info.path] = counter
+        return counter
+
+    @staticmethod
+    def get_model_for_route(route, app_settings):
+        """
+        Get the model for a prompt type, loading it into the model pool if needed.
+
+        Must be called from the local LLM scheduler thread, which is the only thread
+        generating, so models are never unloaded while in use.
+
+        Args:
+            route: Prompt type, e.g. ``Scribe``, an HL7 prompt or ``Lab Analysis``
+            app_settings: Application settings object containing the routes
+
+        Returns:
+            The routed Model, or None if the prompt type uses the main model
+        """
+        model_info = ModelManager.resolve_route(route, app_settings)
+        if model_info is None:
+            return None
+
+        try:
+            budget_mb = float(app_settings.editable_settings["Local Model Memory Budget (MB)"])
+        except (TypeError, ValueError):
+            budget_mb = 8192
+        # The main model stays loaded and counts against the budget
+        main_model = ModelManager.local_model
+        main_bytes = ModelManager.registry.resolve(os.path.basename(main_model.config["model_path"])).estimated_memory_bytes if main_model else 0
+        budget_bytes = max(0, int(budget_mb * 1024 * 1024) - main_bytes)
+
+        if ModelManager.pool is None:
+            ModelManager.pool = ResidentModelPool(
+                lambda info: Model(info.path, **ModelManager._model_arguments(info, app_settings)),
+                budget_bytes,
+            )
+        else:
+            ModelManager.pool.configure(budget_bytes)
+        return ModelManager.pool.acquire(model_info)
+
+    @staticmethod
+    def get_pool_stats():
+        """
+        Get load state and model pool statistics for the debug window.
+
+        Returns:
+            dict of statistics
+        """
+        stats = {"state": ModelManager.load_state}
+        if ModelManager.local_model is not None:
+            stats["main model"] = os.path.basename(ModelManager.local_model.config["model_path"])
+            stats["context"] = ModelManager.local_model.config["context_size"]
+            config = ModelManager.local_model.config
+            stats["threads"] = f"{config['n_threads']} gen / {config['n_threads_batch']} prompt"
+            stats["batch / KV"] = f"{config['n_batch']} / {config['kv_cache']}{' + flash attn' if config['flash_attn'] else ''}"
+        if ModelManager.pool is not None:
+            stats.update(ModelManager.pool.get_stats())
+        return stats
+
+    @staticmethod
+    def wait_until_ready(timeout=None, cancel_event=None):
+        """
+        Block until the model has finished loading.
+
+        Args:
+            timeout: Maximum time to wait in seconds, None to wait as long as it takes
+            cancel_event: Optional event that stops the wait once it is set
+
+        Returns:
+            The loaded Model
+
+        Raises:
+            ModelLoadError: If the model failed to load or no load was started
+            TimeoutError: If the model is still loading after ``timeout`` seconds
+            OperationCancelledError: If ``cancel_event`` was set
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ModelManager.load_event.wait(0.1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise OperationCancelledError("Waiting for the local model was cancelled.")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"The local model is still loading after {timeout:.0f}s.")
+
+        state = ModelManager.load_state
+        if state == ModelManager.LOAD_STATE_FAILED:
+            error = ModelManager.load_error
+            raise ModelLoadError(f"The local model failed to load ({error.__class__.__name__}): {str(error)}") from error
+        if state != ModelManager.LOAD_STATE_READY or ModelManager.local_model is None:
+            raise ModelLoadError("The local model is not loaded.")
+        return ModelManager.local_model
+
+    @staticmethod
+    def start_model_threaded(settings, root_window, force_tune=False):
         """
         Start the model in a separate thread.
 
@@ -252,6 +849,8 @@ class ModelManager:
         :type settings: dict
         :param root_window: The main application window reference
         :type root_window: tkinter.Tk
+        :param force_tune: Benchmark the llama.cpp settings before loading
+        :type force_tune: bool
         :return: The created thread instance
         :rtype: threading.Thread
         
@@ -259,10 +858,37 @@ class ModelManager:
         function with the provided settings and root window reference. The model
         is accessed through ModelManager's local_model attribute.
         """
-        thread = threading.Thread(target=ModelManager.setup_model, args=(settings, root_window))
+        thread = threading.Thread(target=ModelManager.setup_model, args=(settings, root_window, force_tune))
         thread.start()
         return thread
 
+    @staticmethod
+    def apply_prompt_cache_settings(app_settings):
+        """
+        Configure the prompt cache of the loaded model from the application settings.
+
+        Args:
+            app_settings: Application settings object containing the prompt cache preferences
+        """
+        if ModelManager.local_model is None:
+            return
+
+        mode = app_settings.editable_settings["Prompt Cache"]
+        if mode not in PROMPT_CACHE_MODES:
+            print(f"Unknown prompt cache mode '{mode}', using {PROMPT_CACHE_RAM}.")
+            mode = PROMPT_CACHE_RAM
+
+        try:
+            size_mb = int(app_settings.editable_settings["Prompt Cache Size (MB)"])
+        except (TypeError, ValueError):
+            size_mb = 1024
+
+        try:
+            ModelManager.local_model.set_prompt_cache(mode, size_mb)
+        except Exception as e:
+            # The model still works without the cache, just slower
+            print(f"Failed to set up the prompt cache ({e.__class__.__name__}): {str(e)}")
+
     @staticmethod
     def unload_model():
         """
@@ -271,9 +897,31 @@ class ModelManager:
         Closes the model if it exists and sets the local_model reference to None.
         This method should be called before loading a new model or shutting down
         the application.
+
+        The models are closed on a background thread: closing waits for a generation
+        or warm-up that is still using the model, which must not block the caller (the
+        settings window). The next load waits for the close to finish.
         """
-        if ModelManager.local_model is not None:
-            ModelManager.local_model.model.close()
-            del ModelManager.local_model
+        with ModelManager.load_lock:
+            ModelManager.load_generation += 1
+            ModelManager.load_state = ModelManager.LOAD_STATE_UNLOADED
+            ModelManager.load_error = None
+            model = ModelManager.local_model
             ModelManager.local_model = None
+        # Wake up callers waiting on a load that will now be discarded
+        ModelManager.load_event.set()
+
+        pool = ModelManager.pool
+        previous_unload = ModelManager.unload_thread
+
+        def close_models():
+            if previous_unload is not None:
+                previous_unload.join()
+            if model is not None:
+                model.close()
+            if pool is not None:
+                pool.release_all()
+
+        ModelManager.unload_thread = threading.Thread(target=close_models, name="model-unload", daemon=True)
+        ModelManager.unload_thread.start()
             
\ No newline at end of file
@@ -0,0 +1,118 @@
+import tkinter as tk
+from tkinter import ttk
+from utils.file_utils import get_file_path
+from utils.batch_transcription import FINISHED_STATUSES
+
+
+class BatchTranscriptionWindow:
+    """
+    Progress window for a batch of uploaded recordings.
+
+    Shows one row per file with its status and processing time, an overall progress
+    bar, a cancel button and a summary once the batch is finished.
+
+    :param parent: The parent Tkinter window.
+    :type parent: tk.Tk
+    :param batch_queue: The queue processing the files.
+    :type batch_queue: BatchTranscriptionQueue
+    """
+
+    def __init__(self, parent, batch_queue):
+        self.parent = parent
+        self.batch_queue = batch_queue
+        self.rows = {}
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("Batch Transcription")
+        self.window.geometry("560x360")
+        self.window.iconbitmap(get_file_path('assets','logo.ico'))
+        self.window.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        self.tree = ttk.Treeview(self.window, columns=("status", "time"), height=10)
+        self.tree.heading("#0", text="File")
+        self.tree.heading("status", text="Status")
+        self.tree.heading("time", text="Time")
+        self.tree.column("#0", width=300)
+        self.tree.column("status", width=130)
+        self.tree.column("time", width=70, anchor="e")
+        self.tree.pack(padx=10, pady=(10, 5), fill="both", expand=True)
+
+        self.progress = ttk.Progressbar(self.window, mode='determinate')
+        self.progress.pack(padx=10, pady=5, fill="x")
+
+        self.summary_label = tk.Label(self.window, text="")
+        self.summary_label.pack(padx=10, pady=5)
+
+        self.cancel_button = ttk.Button(self.window, text="Cancel", command=self._on_cancel)
+        self.cancel_button.pack(pady=(0, 10))
+
+    def add_jobs(self, jobs):
+        """
+        Add a row for each job in the batch.
+
+        :param jobs: Jobs returned by ``BatchTranscriptionQueue.start``.
+        :type jobs: list[BatchJob]
+        """
+        for job in jobs:
+            self.rows[job.index] = self.tree.insert("", tk.END, text=job.name, values=(job.status, ""))
+        self.progress.configure(maximum=max(1, len(jobs)), value=0)
+        self._refresh_summary()
+        self._wait_for_finish()
+
+    def update_job(self, job):
+        """
+        Update a job's row. Safe to call from any thread.
+
+        :param job: The job whose status changed.
+        :type job: BatchJob
+        """
+        # The job keeps changing on the worker, show the status it had when this was called
+        status = job.status
+        self.parent.after(0, lambda: self._update_job(job, status))
+
+    def _update_job(self, job, status):
+        if not self.window.winfo_exists():
+            return
+
+        row = self.rows.get(job.index)
+        if row is not None:
+            elapsed = f"{job.elapsed:.1f}s" if status in FINISHED_STATUSES and job.elapsed else ""
+            text = status if not job.error else f"{status}: {job.error}"
+            self.tree.item(row, values=(text, elapsed))
+
+        self.progress.configure(value=sum(1 for j in self.batch_queue.jobs if j.status in FINISHED_STATUSES))
+        if not self.batch_queue.cancel_event.is_set():
+            self._refresh_summary()
+
+    def _refresh_summary(self):
+        if self.batch_queue.is_finished():
+            self.summary_label.config(text=self.batch_queue.summary())
+            self.cancel_button.config(text="Close", command=self._close)
+        else:
+            running = sum(1 for j in self.batch_queue.jobs if j.status not in FINISHED_STATUSES)
+            self.summary_label.config(text=f"{running} file(s) remaining")
+
+    def _on_cancel(self):
+        self.batch_queue.cancel()
+        self.cancel_button.config(state="disabled")
+        self.summary_label.config(text="Cancelling, waiting for files in progress...")
+
+    def _wait_for_finish(self):
+        if not self.window.winfo_exists():
+            return
+        if self.batch_queue.is_finished():
+            self.cancel_button.config(state="normal")
+            self.progress.configure(value=len(self.batch_queue.jobs))
+            self._refresh_summary()
+        else:
+            self.parent.after(200, self._wait_for_finish)
+
+    def _on_close(self):
+        # Closing the window while files are still processing cancels the batch
+        if not self.batch_queue.is_finished():
+            self.batch_queue.cancel()
+        self._close()
+
+    def _close(self):
+        if self.window.winfo_exists():
+            self.window.destroy()
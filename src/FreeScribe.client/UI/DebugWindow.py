@@ -64,6 +64,49 @@ class DualOutput:
         """
         return ''.join(DualOutput.buffer)
 
+class DebugStats:
+    """
+    Registry of runtime statistics shown at the top of the debug window.
+
+    Components register a provider function returning a dict of values, which is
+    called every time the debug window refreshes.
+    """
+    providers = {}
+
+    @staticmethod
+    def register(name, provider):
+        """
+        Register a statistics provider.
+
+        :param name: Section title shown in the debug window.
+        :type name: str
+        :param provider: Callable returning a dict of statistic names to values.
+        :type provider: callable
+        """
+        DebugStats.providers[name] = provider
+
+    @staticmethod
+    def unregister(name):
+        DebugStats.providers.pop(name, None)
+
+    @staticmethod
+    def get_report():
+        """
+        Format the statistics of every registered provider.
+
+        :return: One line per provider.
+        :rtype: str
+        """
+        lines = []
+        for name, provider in list(DebugStats.providers.items()):
+            try:
+                stats = provider()
+                values = ", ".join(f"{key}: {value}" for key, value in stats.items())
+            except Exception as e:
+                values = f"unavailable ({e})"
+            lines.append(f"{name} - {values}")
+        return "\n".join(lines)
+
 class DebugPrintWindow:
     """
     Creates and manages a tkinter window for displaying debug output.
@@ -83,6 +126,10 @@ class DebugPrintWindow:
         self.window.title("Debug Output")
         self.window.geometry("650x450")
 
+        # Label for runtime statistics
+        self.stats_label = tk.Label(self.window, text="", justify=tk.LEFT, anchor="w")
+        self.stats_label.pack(padx=10, pady=(10, 0), fill=tk.X)
+
         # Create a Text widget for displaying captured output
         self.text_widget = tk.Text(self.window, wrap="none", width=80, height=20)
         self.text_widget.pack(padx=10, pady=(10, 0), fill=tk.BOTH, expand=True)
@@ -126,6 +173,8 @@ class DebugPrintWindow:
         Preserves scroll position when updating content and only updates
         if there are changes in the buffer.
         """
+        self.stats_label.config(text=DebugStats.get_report())
+
         content = DualOutput.get_buffer_content()
         current_content = self.text_widget.get("1.0", tk.END).strip()
 
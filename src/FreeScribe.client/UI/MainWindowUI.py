@@ -197,6 +197,7 @@ class MainWindowUI:
         """
         self.menu_bar = tk.Menu(self.root)
         self.root.config(menu=self.menu_bar)
+        self._create_file_menu()
         self._create_settings_menu()
         self._create_help_menu()
         self._create_prompt_menu()
@@ -210,10 +211,24 @@ class MainWindowUI:
         if self.menu_bar is not None:
             self.menu_bar.destroy()
             self.menu_bar = None
+            self._destroy_file_menu()
             self._destroy_settings_menu()
             self._destroy_help_menu()
             self._destroy_prompt_menu()
 
+    def _create_file_menu(self):
+        # Add File menu
+        file_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label="File", menu=file_menu)
+        file_menu.add_command(label="Upload Recordings Folder...", command=lambda: self.root.event_generate("<<BatchUploadFolder>>"))
+        file_menu.add_command(label="Generate Multiple Notes...", command=lambda: self.root.event_generate("<<GenerateMultipleNotes>>"))
+
+    def _destroy_file_menu(self):
+        if self.menu_bar is not None:
+            file_menu = self.menu_bar.nametowidget('File')
+            if file_menu is not None:
+                file_menu.destroy()
+
     def _create_settings_menu(self):
         # Add Settings menu
         setting_menu = tk.Menu(self.menu_bar, tearoff=0)
@@ -0,0 +1,189 @@
+import tkinter as tk
+from tkinter import ttk, scrolledtext
+import pyperclip
+from utils.file_utils import get_file_path
+from utils.streaming import TokenBatcher
+from utils.note_fanout import FINISHED_STATUSES, STATUS_DONE
+
+
+class NoteFanoutWindow:
+    """
+    Window for generating several notes from the current transcript at once.
+
+    The prompts are picked from a list first. Once generation starts every prompt gets
+    its own tab, the note streams into it and the tab title shows its status and time.
+    A summary compares the total wait with generating the notes one after the other.
+
+    :param parent: The parent Tkinter window.
+    :type parent: tk.Tk
+    :param prompt_types: The prompts the user can pick from.
+    :type prompt_types: list[str]
+    :param on_generate: Called on the Tk thread with the selected prompts, returns the
+        unstarted ``NoteFanout`` that generates them.
+    :type on_generate: callable
+    :param on_output_done: Callback invoked on the Tk thread with each finished ``FanoutOutput``.
+    :type on_output_done: callable or None
+    """
+
+    def __init__(self, parent, prompt_types, on_generate, on_output_done=None):
+        self.parent = parent
+        self.prompt_types = prompt_types
+        self.on_generate = on_generate
+        self.on_output_done = on_output_done
+        self.fanout = None
+        self.tabs = {}
+        # Indexes of the outputs already passed to on_output_done
+        self.reported = set()
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("Generate Multiple Notes")
+        self.window.geometry("720x520")
+        self.window.iconbitmap(get_file_path('assets','logo.ico'))
+        self.window.protocol("WM_DELETE_WINDOW", self._on_close)
+
+        self.select_frame = tk.Frame(self.window)
+        self.select_frame.pack(padx=10, pady=10, fill="both", expand=True)
+        tk.Label(self.select_frame, text="Select the notes to generate from the transcript:").pack(anchor="w")
+        self.prompt_list = tk.Listbox(self.select_frame, selectmode=tk.MULTIPLE, exportselection=False, height=12)
+        for prompt_type in prompt_types:
+            self.prompt_list.insert(tk.END, prompt_type)
+        self.prompt_list.pack(pady=5, fill="both", expand=True)
+
+        self.notebook = ttk.Notebook(self.window)
+
+        self.summary_label = tk.Label(self.window, text="")
+        self.summary_label.pack(padx=10, pady=5)
+
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(pady=(0, 10))
+        self.generate_button = ttk.Button(button_frame, text="Generate", command=self._on_generate)
+        self.generate_button.pack(side=tk.LEFT, padx=5)
+        self.copy_button = ttk.Button(button_frame, text="Copy", command=self._copy_current, state="disabled")
+        self.copy_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="Cancel", command=self._close)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+    def _on_generate(self):
+        selected = [self.prompt_types[i] for i in self.prompt_list.curselection()]
+        if not selected:
+            self.summary_label.config(text="Select at least one note.")
+            return
+
+        self.fanout = self.on_generate(selected)
+        self.select_frame.pack_forget()
+        self.generate_button.pack_forget()
+        self.notebook.pack(padx=10, pady=(10, 5), fill="both", expand=True, before=self.summary_label)
+        self.copy_button.config(state="normal")
+        self.cancel_button.config(command=self._on_cancel)
+
+        self._add_outputs(self.fanout.start(selected))
+
+    def _add_outputs(self, outputs):
+        for output in outputs:
+            frame = tk.Frame(self.notebook)
+            text_area = scrolledtext.ScrolledText(frame, wrap=tk.WORD)
+            text_area.pack(fill="both", expand=True)
+            timing_label = tk.Label(frame, text="", anchor="w")
+            timing_label.pack(fill="x")
+            self.notebook.add(frame, text=self._tab_title(output, output.status))
+            self.tabs[output.index] = (frame, text_area, timing_label, TokenBatcher(self.parent, lambda text, is_first, t=text_area: self._append(t, text)))
+        self._refresh_summary()
+        self._wait_for_finish()
+
+    def push_token(self, output, text):
+        """
+        Stream a fragment of an output's note into its tab. Safe to call from any thread.
+
+        :param output: The output the fragment belongs to.
+        :type output: FanoutOutput
+        :param text: The streamed fragment.
+        :type text: str
+        """
+        tab = self.tabs.get(output.index)
+        if tab is not None:
+            tab[3].push(text)
+
+    def update_output(self, output):
+        """
+        Update an output's tab. Safe to call from any thread.
+
+        :param output: The output whose status changed.
+        :type output: FanoutOutput
+        """
+        # The output keeps changing on the worker, show the status it had when this was called
+        status = output.status
+        self.parent.after(0, lambda: self._update_output(output, status))
+
+    def _update_output(self, output, status):
+        if not self.window.winfo_exists():
+            return
+
+        tab = self.tabs.get(output.index)
+        if tab is not None:
+            frame, text_area, timing_label, batcher = tab
+            self.notebook.tab(frame, text=self._tab_title(output, status))
+            if status in FINISHED_STATUSES:
+                batcher.close()
+                if status == STATUS_DONE:
+                    # The final note replaces the stream, e.g. after post-processing
+                    text_area.delete("1.0", tk.END)
+                    text_area.insert(tk.END, output.note or "")
+                elif output.error:
+                    self._append(text_area, f"\n\nError: {output.error}")
+                first_token = f"first text after {output.first_token:.1f}s, " if output.first_token is not None else ""
+                timing_label.config(text=f"{status}: {first_token}{output.elapsed:.1f}s in total")
+
+        if status == STATUS_DONE and output.index not in self.reported and callable(self.on_output_done):
+            self.reported.add(output.index)
+            self.on_output_done(output)
+
+        if not self.fanout.cancel_token.cancelled:
+            self._refresh_summary()
+
+    def _tab_title(self, output, status):
+        if status == STATUS_DONE:
+            return f"{output.prompt_type} ({output.elapsed:.1f}s)"
+        return f"{output.prompt_type} ({status})"
+
+    def _append(self, text_area, text):
+        text_area.insert(tk.END, text)
+        text_area.see(tk.END)
+
+    def _copy_current(self):
+        current = self.notebook.select()
+        for frame, text_area, _, _ in self.tabs.values():
+            if str(frame) == current:
+                pyperclip.copy(text_area.get("1.0", tk.END).strip())
+                return
+
+    def _refresh_summary(self):
+        if self.fanout.is_finished():
+            self.summary_label.config(text=self.fanout.summary())
+            self.cancel_button.config(text="Close", command=self._close)
+        else:
+            running = sum(1 for o in self.fanout.outputs if o.status not in FINISHED_STATUSES)
+            self.summary_label.config(text=f"{running} note(s) remaining")
+
+    def _on_cancel(self):
+        self.fanout.cancel()
+        self.cancel_button.config(state="disabled")
+        self.summary_label.config(text="Cancelling, waiting for notes in progress...")
+
+    def _wait_for_finish(self):
+        if not self.window.winfo_exists():
+            return
+        if self.fanout.is_finished():
+            self.cancel_button.config(state="normal")
+            self._refresh_summary()
+        else:
+            self.parent.after(200, self._wait_for_finish)
+
+    def _on_close(self):
+        # Closing the window while notes are still generating cancels them
+        if self.fanout is not None and not self.fanout.is_finished():
+            self.fanout.cancel()
+        self._close()
+
+    def _close(self):
+        if self.window.winfo_exists():
+            self.window.destroy()
@@ -25,6 +25,7 @@ import requests
 import numpy as np
 from utils.file_utils import get_resource_path, get_file_path
 from Model import ModelManager
+from utils.model_registry import DEFAULT_LOCAL_MODEL
 import threading
 from UI.Widgets.MicrophoneSelector import MicrophoneState
 from utils.ip_utils import is_valid_url
@@ -108,6 +109,7 @@ class SettingsWindow():
         self.llm_settings = [
             "Model Endpoint",
             "AI Server Self-Signed Certificates",
+            "Stream Responses",
         ]
 
         self.adv_ai_settings = [
@@ -137,15 +139,38 @@ class SettingsWindow():
             "Feedback Base Folder",
             "Default Upload Folder",
             "Default Download Folder",
+            "Prompt Cache",
+            "Prompt Cache Size (MB)",
+            "Use Response Cache",
+            "Force Response Cache",
+            "Response Cache TTL (hours)",
+            "Response Cache Size (MB)",
+            "Speculative Decoding",
+            "Speculative Draft Tokens",
+            "Draft Model Path",
+            "Max Concurrent Chunks",
+            "Local Context Size",
+            "Local Model Routes",
+            "Local Model Memory Budget (MB)",
+            "Auto-Tune Local Model",
+            "Additional Model Endpoints",
+            "Endpoint Routing",
+            "Endpoint Health Check Interval (s)",
+            "Incremental Fact Extraction",
         ]
 
         self.adv_whisper_settings = [
             "Real Time Audio Length",
+            "Whisper CPU Threads",
         ]
 
 
         self.adv_general_settings = [
             "Enable Scribe Template",
+            "Batch Transcription Workers",
+            "Max Concurrent Notes",
+            "HTTP Connect Timeout (s)",
+            "HTTP Read Timeout (s)",
         ]
 
         self.editable_settings = {
@@ -159,6 +184,23 @@ class SettingsWindow():
             "use_world_info": False,
             "max_context_length": 5000,
             "max_length": 400,
+            "Prompt Cache": "RAM",
+            "Prompt Cache Size (MB)": 1024,
+            "Use Response Cache": True,
+            "Force Response Cache": False,
+            "Response Cache TTL (hours)": 24,
+            "Response Cache Size (MB)": 64,
+            "Speculative Decoding": "Off",
+            "Speculative Draft Tokens": 10,
+            "Draft Model Path": "",
+            "Max Concurrent Chunks": 4,
+            "Local Context Size": 4096,
+            "Local Model Routes": "",
+            "Local Model Memory Budget (MB)": 8192,
+            "Auto-Tune Local Model": True,
+            "Additional Model Endpoints": "",
+            "Endpoint Routing": "Least Outstanding",
+            "Endpoint Health Check Interval (s)": 30,
             "rep_pen": 1.1,
             "rep_pen_range": 5000,
             "rep_pen_slope": 0.7,
@@ -178,6 +220,9 @@ class SettingsWindow():
             SettingsKeys.WHISPER_ENDPOINT.value: "https://localhost:2224/whisperaudio",
             SettingsKeys.WHISPER_SERVER_API_KEY.value: "",
             "Whisper Model": "small.en",
+            "Whisper Backend": "faster-whisper",
+            "Whisper Compute Type": "int8",
+            "Whisper CPU Threads": 0,
             "Current Mic": "None",
             "Real Time": True,
             "Real Time Audio Length": 5,
@@ -193,9 +238,15 @@ class SettingsWindow():
             "Preset": "Custom",
             "Show Welcome Message": True,
             "Enable Scribe Template": False,
+            "Batch Transcription Workers": 2,
+            "Max Concurrent Notes": 4,
+            "HTTP Connect Timeout (s)": 10,
+            "HTTP Read Timeout (s)": 300,
             "Use Pre-Processing": True,
+            "Incremental Fact Extraction": True,
             "Use Post-Processing": False, # Disabled for now causes unexcepted behaviour
             "AI Server Self-Signed Certificates": False,
+            "Stream Responses": True,
             "S2T Server Self-Signed Certificates": False,
             "Pre-Processing": "Please break down the conversation into a list of facts. Take the conversation and transform it to a easy to read list:\n\n",
             "Post-Processing": "\n\nUsing the provided list of facts, review the SOAP note for accuracy. Verify that all details align with the information provided in the list of facts and ensure consistency throughout. Update or adjust the SOAP note as necessary to reflect the listed facts without offering opinions or subjective commentary. Ensure that the revised note excludes a \"Notes\" section and does not include a header for the SOAP note. Provide the revised note after making any necessary corrections.",
@@ -283,6 +334,10 @@ class SettingsWindow():
                     if key in self.editable_settings:
                         self.editable_settings[key] = value
 
+                # Settings saved before the backend could be chosen used openai-whisper, keep it
+                if "Whisper Backend" not in loaded_editable_settings:
+                    self.editable_settings["Whisper Backend"] = "openai-whisper"
+
                 if self.editable_settings["Use Docker Status Bar"] and self.main_window is not None:
                     self.main_window.create_docker_status_bar()
                 
@@ -456,8 +511,12 @@ class SettingsWindow():
         the dropdown widget in the settings window with the new list of models.
         """
         if self.editable_settings_entries["Use Local LLM"].get():
-            dropdown["values"] = ["mistral-7b-instruct-v0.2.Q4_K_M.gguf"]
-            dropdown.set("mistral-7b-instruct-v0.2.Q4_K_M.gguf")
+            local_models = ModelManager.registry.scan()
+            for info in local_models:
+                print(f"Local model: {info.describe()}")
+            models = [info.file_name for info in local_models] or [DEFAULT_LOCAL_MODEL]
+            dropdown["values"] = models
+            dropdown.set(self.editable_settings["Model"] if self.editable_settings["Model"] in models else ModelManager.registry.resolve(self.editable_settings["Model"]).file_name)
         else:
             dropdown["values"] = ["Loading models...", "Custom"]
             dropdown.set("Loading models...")
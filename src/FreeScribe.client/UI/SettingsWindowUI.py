@@ -29,6 +29,7 @@ from utils.file_utils import get_file_path
 from UI.MarkdownWindow import MarkdownWindow
 from UI.Widgets.MicrophoneSelector import MicrophoneSelector
 from UI.SettingsWindow import SettingsKeys, FeatureToggle
+from utils.stt_backends import STT_BACKENDS, COMPUTE_TYPES
 
 
 class SettingsWindowUI:
@@ -199,6 +200,18 @@ class SettingsWindowUI:
         
         left_row += 1
 
+        # create the local speech to text backend dropdown selection
+        tk.Label(left_frame, text="Whisper Backend").grid(row=left_row, column=0, padx=0, pady=5, sticky="w")
+        self.whisper_backend_drop_down = ttk.Combobox(left_frame, values=STT_BACKENDS, width=13, state="readonly")
+        self.whisper_backend_drop_down.grid(row=left_row, column=1, padx=0, pady=5, sticky="w")
+        if self.settings.editable_settings["Whisper Backend"] in STT_BACKENDS:
+            self.whisper_backend_drop_down.current(STT_BACKENDS.index(self.settings.editable_settings["Whisper Backend"]))
+        else:
+            self.whisper_backend_drop_down.current(0)
+        self.settings.editable_settings_entries["Whisper Backend"] = self.whisper_backend_drop_down
+
+        left_row += 1
+
         # set the state of the whisper settings based on the SettingsKeys.LOCAL_WHISPER.value checkbox once all widgets are created
         self.toggle_remote_whisper_settings()
 
@@ -215,6 +228,7 @@ class SettingsWindowUI:
         # set the local option to disabled on switch to remote
         inverted_state = "disabled" if current_state == 0 else "normal"
         self.whisper_models_drop_down.config(state=inverted_state)
+        self.whisper_backend_drop_down.config(state="disabled" if current_state == 0 else "readonly")
 
 
 
@@ -276,6 +290,12 @@ class SettingsWindowUI:
 
         left_row += 1
 
+        # Re-run the llama.cpp benchmark, e.g. after a hardware or driver change
+        self.tune_model_button = ttk.Button(left_frame, text="Tune Local Model", command=self.retune_local_model)
+        self.tune_model_button.grid(row=left_row, column=0, columnspan=2, padx=0, pady=5, sticky="w")
+
+        left_row += 1
+
         right_frame, right_row = self.create_editable_settings(right_frame, self.settings.llm_settings, padx=0, pady=0)
 
         # 2. OpenAI API Key (Right Column)
@@ -324,6 +344,7 @@ class SettingsWindowUI:
 
         inverted_state = "disabled" if current_state == 0 else "normal"
         self.architecture_dropdown.config(state=inverted_state)
+        self.tune_model_button.config(state=inverted_state)
         
         #flag used for determining if window was just opened so we dont spam the API.
         if not self.settings_opened:
@@ -335,6 +356,23 @@ class SettingsWindowUI:
 
             
 
+    def retune_local_model(self):
+        """
+        Save the settings and benchmark llama.cpp settings for the selected local model.
+
+        The current profile is discarded and the model is reloaded with the new one.
+        """
+        if not messagebox.askyesno(
+            "Tune Local Model",
+            "The local model will be benchmarked with different thread counts, batch sizes and "
+            "KV cache types, then reloaded with the fastest settings. This can take a few minutes. Continue?",
+            parent=self.settings_window,
+        ):
+            return
+
+        self.save_settings(False)
+        ModelManager.retune_model(self.settings, self.root)
+
     def on_model_selection_change(self, event):
         """
         Handle switching between model dropdown and custom model entry.
@@ -458,6 +496,16 @@ class SettingsWindowUI:
         self.cutoff_slider = AudioMeter(left_frame, width=150, height=50, 
                                     threshold=self.settings.editable_settings["Silence cut-off"] * 32768)
         self.cutoff_slider.grid(row=1, column=1, padx=0, pady=0, sticky="w")
+
+        # create the faster-whisper compute type dropdown selection
+        tk.Label(left_frame, text="Whisper Compute Type").grid(row=2, column=0, padx=0, pady=5, sticky="w")
+        self.whisper_compute_type_drop_down = ttk.Combobox(left_frame, values=COMPUTE_TYPES, width=13, state="readonly")
+        self.whisper_compute_type_drop_down.grid(row=2, column=1, padx=0, pady=5, sticky="w")
+        if self.settings.editable_settings["Whisper Compute Type"] in COMPUTE_TYPES:
+            self.whisper_compute_type_drop_down.current(COMPUTE_TYPES.index(self.settings.editable_settings["Whisper Compute Type"]))
+        else:
+            self.whisper_compute_type_drop_down.current(0)
+        self.settings.editable_settings_entries["Whisper Compute Type"] = self.whisper_compute_type_drop_down
         row += 1
 
         # AI Settings
@@ -555,6 +603,12 @@ class SettingsWindowUI:
         # save the old whisper model to compare with the new model later
         old_local_whisper = self.settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value]
         old_model = self.settings.editable_settings["Whisper Model"]
+        stt_backend_keys = ["Whisper Backend", "Whisper Compute Type", "Whisper CPU Threads"]
+        old_stt_backend = [str(self.settings.editable_settings[key]) for key in stt_backend_keys]
+        prompt_cache_keys = ["Prompt Cache", "Prompt Cache Size (MB)"]
+        old_prompt_cache = [str(self.settings.editable_settings[key]) for key in prompt_cache_keys]
+        model_reload_keys = ["Speculative Decoding", "Speculative Draft Tokens", "Draft Model Path", "Local Context Size"]
+        old_model_reload = [str(self.settings.editable_settings[key]) for key in model_reload_keys]
 
         self.settings.save_settings(
             self.openai_api_key_entry.get(),
@@ -575,6 +629,16 @@ class SettingsWindowUI:
         else:
             self.main_window.destroy_scribe_template()
 
+        if old_prompt_cache != [str(self.settings.editable_settings[key]) for key in prompt_cache_keys]:
+            # The cache can be swapped on the loaded model, no reload needed
+            ModelManager.apply_prompt_cache_settings(self.settings)
+
+        if (old_model_reload != [str(self.settings.editable_settings[key]) for key in model_reload_keys]
+                and self.settings.editable_settings["Use Local LLM"]
+                and ModelManager.local_model is not None):
+            # The draft model and the context size are fixed when the llama.cpp context is created
+            ModelManager.start_model_threaded(self.settings, self.root)
+
         if close_window:
             self.close_window()
 
@@ -582,7 +646,8 @@ class SettingsWindowUI:
         # if Local Whisper is selected, compare the old model with the new model and reload the model if it has changed
         if self.settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value] and (
                 old_local_whisper != self.settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value] or old_model !=
-                self.settings.editable_settings["Whisper Model"]):
+                self.settings.editable_settings["Whisper Model"] or
+                old_stt_backend != [str(self.settings.editable_settings[key]) for key in stt_backend_keys]):
             self.root.event_generate("<<LoadSttModel>>")
 
     def reset_to_default(self):
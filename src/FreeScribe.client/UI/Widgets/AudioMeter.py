@@ -13,13 +13,14 @@ and Research Students - Software Developer Alex Simko, Pemba Sherpa (F24), and N
 
 """
 
-import struct
 import tkinter as tk
 from tkinter import ttk
-import pyaudio
 import numpy as np
-from threading import Thread
-from UI.Widgets.MicrophoneSelector import MicrophoneState
+from threading import Thread, Lock
+from utils.audio_bus import AudioBus
+
+METER_REFRESH_MS = 50  # The UI redraws the meter at most 20 times a second
+METER_BUCKET_PX = 2  # Level changes smaller than this many pixels are not redrawn
 
 class AudioMeter(tk.Frame):
     """
@@ -57,6 +58,12 @@ class AudioMeter(tk.Frame):
         self.running = False
         self.threshold = threshold
         self.destroyed = False  # Add flag to track widget destruction
+        # Shared slot holding the loudest level seen since the UI last polled
+        self.level_lock = Lock()
+        self.pending_level = None
+        self.displayed_bucket = None
+        self.displayed_color = 'green'
+        self.poll_id = None
         self.setup_audio()
         self.create_widgets()
         
@@ -67,7 +74,7 @@ class AudioMeter(tk.Frame):
         """
         Clean up resources when the widget is destroyed.
 
-        This method stops the audio stream and terminates the PyAudio instance.
+        This method unsubscribes from the shared audio bus.
 
         :param event: The event that triggered the cleanup (default is None).
         :type event: tkinter.Event
@@ -78,13 +85,18 @@ class AudioMeter(tk.Frame):
 
         self.destroyed = True
         self.running = False
+
+        if self.poll_id is not None:
+            try:
+                self.after_cancel(self.poll_id)
+            except tk.TclError:
+                pass
+            self.poll_id = None
         
         # Stop audio first
-        if hasattr(self, 'stream') and self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        if hasattr(self, 'p') and self.p:
-            self.p.terminate()
+        if hasattr(self, 'subscription') and self.subscription:
+            self.subscription.close()
+            self.subscription = None
             
         # Then wait for thread
         if hasattr(self, 'monitoring_thread') and self.monitoring_thread:
@@ -103,15 +115,13 @@ class AudioMeter(tk.Frame):
         """
         Set up the audio parameters for capturing audio input.
 
-        This method initializes the PyAudio instance and sets the audio format,
-        number of channels, sample rate, and chunk size.
+        The meter does not open its own device stream, it listens to the shared
+        audio bus so it can run alongside the recorder on the same microphone.
         """
-        # Adjusted CHUNK size for 16kHz to maintain similar update rate
-        self.CHUNK = 512  # Reduced from 1024 to maintain similar time resolution
-        self.FORMAT = pyaudio.paInt16
-        self.CHANNELS = 1
-        self.RATE = 16000  # Changed from 44100 to 16000
-        self.p = pyaudio.PyAudio()
+        self.audio_bus = AudioBus.shared()
+        self.CHUNK = self.audio_bus.chunk
+        self.RATE = self.audio_bus.rate
+        self.subscription = None
         
     def create_widgets(self):
         """
@@ -190,52 +200,93 @@ class AudioMeter(tk.Frame):
         """
         Start or stop the audio monitoring.
 
-        This method starts or stops the audio stream and the monitoring thread
-        based on the current state of the widget.
+        This method subscribes to or unsubscribes from the audio bus and starts
+        the monitoring thread based on the current state of the widget.
         """
         if not self.running:
-            self.running = True
-            
             try:
-                self.stream = self.p.open(
-                    format=self.FORMAT,
-                    channels=1,
-                    rate=self.RATE,
-                    input=True,
-                    input_device_index=MicrophoneState.SELECTED_MICROPHONE_INDEX,
-                    frames_per_buffer=self.CHUNK,
-                )
+                # Small queue, the meter only ever cares about the latest audio
+                self.subscription = self.audio_bus.subscribe("audio meter", maxsize=4)
             except (OSError, IOError) as e:
                 tk.messagebox.showerror("Error", f"Please check your microphone settings under the speech2text settings tab. Error opening audio stream: {e}")
+                return
 
-            self.monitoring_thread = Thread(target=self.update_meter)
+            self.running = True
+            self.monitoring_thread = Thread(target=self.update_meter, daemon=True)
             self.monitoring_thread.start()
+            self.poll_id = self.after(METER_REFRESH_MS, self.poll_level)
         else:
             self.running = False
-            self.stream.stop_stream()
-            self.stream.close()
+            if self.subscription:
+                self.subscription.close()
+                self.subscription = None
     
+    @staticmethod
+    def peak_amplitude(data):
+        """
+        Get the peak absolute amplitude of a raw int16 PCM buffer.
+
+        Computed directly on the buffer with NumPy, the negative peak is negated
+        separately so -32768 does not overflow int16.
+
+        :param data: Raw int16 PCM bytes.
+        :type data: bytes
+        :return: The peak amplitude in the range 0 - 32768.
+        :rtype: int
+        """
+        samples = np.frombuffer(data, dtype=np.int16)
+        if samples.size == 0:
+            return 0
+        return max(int(samples.max()), -int(samples.min()))
+
     def update_meter(self):
         """
-        Continuously update the audio meter.
+        Continuously measure the audio level.
 
-        This method reads audio data from the stream, calculates the maximum
-        audio level, and updates the meter display on the main thread.
+        This method reads audio data from the bus and publishes the loudest level
+        seen since the last redraw to a shared slot. The UI picks it up in
+        ``poll_level`` so no Tk events are scheduled from this thread.
         """
+        subscription = self.subscription
         while self.running and not self.destroyed:  # Check destroyed flag
             try:
-                data = self.stream.read(self.CHUNK, exception_on_overflow=False)
-                audio_data = struct.unpack(f'{self.CHUNK}h', data)
-                max_value = max(abs(np.array(audio_data)))
+                data = subscription.read(timeout=0.1)
+                if data is None:
+                    continue
+                max_value = self.peak_amplitude(data)
                 level = min(self.width, int((max_value / 32767) * self.width))
-                
-                # Only schedule update if not destroyed
-                if not self.destroyed:
-                    self.master.after(0, self.update_meter_display, level)
+
+                with self.level_lock:
+                    if self.pending_level is None or level > self.pending_level:
+                        self.pending_level = level
             except Exception as e:
                 print(f"Error in audio monitoring: {e}")
                 break
-    
+
+    def poll_level(self):
+        """
+        Redraw the meter from the shared level slot at a fixed frame rate.
+
+        Runs on the Tk thread. Nothing is drawn when no new audio arrived or when
+        the level falls in the same bucket as what is already displayed.
+        """
+        self.poll_id = None
+        if self.destroyed or not self.running:
+            return
+
+        with self.level_lock:
+            level = self.pending_level
+            self.pending_level = None
+
+        if level is not None:
+            bucket = level // METER_BUCKET_PX
+            if bucket != self.displayed_bucket:
+                self.displayed_bucket = bucket
+                self.update_meter_display(bucket * METER_BUCKET_PX)
+
+        if not self.destroyed:
+            self.poll_id = self.after(METER_REFRESH_MS, self.poll_level)
+
     def update_meter_display(self, level):
         """
         Update the meter display on the canvas.
@@ -261,7 +312,9 @@ class AudioMeter(tk.Frame):
                     color = 'yellow'
                 else:
                     color = 'red'
-                self.canvas.itemconfig(self.level_meter, fill=color)
+                if color != self.displayed_color:
+                    self.displayed_color = color
+                    self.canvas.itemconfig(self.level_meter, fill=color)
             except tk.TclError:
                 # Widget was destroyed during update
                 self.cleanup()
@@ -14,26 +14,15 @@ and Research Students - Software Developer Alex Simko, Pemba Sherpa (F24), and N
 import os
 import tkinter as tk
 from tkinter import scrolledtext, ttk, filedialog
-import requests
 import pyperclip
 import wave
 import threading
 import numpy as np
 import base64
 import json
-import pyaudio
 import tkinter.messagebox as messagebox
 from datetime import datetime
 
-try:
-    import whisper # python package is named openai-whisper
-    WHISPER_AVAILABLE = True
-except ImportError:
-    whisper = None
-    WHISPER_AVAILABLE = False
-
-import scrubadub
-import re
 
 try:
     import speech_recognition as sr # python package is named speechrecognition
@@ -44,6 +33,7 @@ except ImportError:
 import time
 import queue
 import atexit
+import functools
 from UI.MainWindowUI import MainWindowUI
 from UI.SettingsWindow import SettingsWindow, SettingsKeys
 from UI.PromptsWindow import PromptsWindow
@@ -52,7 +42,8 @@ from UI.OscarEformsUI import OscarEformsUI
 from UI.Widgets.CustomTextBox import CustomTextBox
 from UI.Widgets.LabSelectionPanel import LabSelectionPanel
 from UI.LoadingWindow import LoadingWindow
-from UI.Widgets.MicrophoneSelector import MicrophoneState
+from UI.BatchTranscriptionWindow import BatchTranscriptionWindow
+from UI.NoteFanoutWindow import NoteFanoutWindow
 from Model import  ModelManager
 from utils.ip_utils import is_private_ip
 from utils.file_utils import get_file_path, get_resource_path
@@ -60,9 +51,24 @@ from utils.read_files import file_reader, extract_patient_name, detect_type, ext
 from utils.hl7 import *
 from utils.lab_processor import generate_lab_hl7
 from utils.auto_processing import AutoProcessor
-import ctypes
+from utils.audio_bus import AudioBus
+from utils.stt_backends import create_stt_backend
+from utils.audio_ingest import AudioIngestError, AUDIO_FILE_TYPES, format_bytes, load_audio_for_transcription, prepare_audio_upload
+from utils.batch_transcription import BatchTranscriptionQueue, STATUS_DONE
+from utils.note_fanout import NoteFanout
+from utils.fact_extractor import IncrementalFactExtractor
+from utils.phi_scrubber import IncrementalScrubber, get_phi_scrubber, scrub_phi
+from utils.streaming import TokenBatcher, iter_sse_content
+from utils.response_cache import ResponseCache, make_cache_key
+from utils.llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_LAB, PRIORITY_AUTO
+from utils.chunking import MERGE_HL7_OBX, MERGE_CONCATENATE, MERGE_LLM, build_merge_prompt, split_into_chunks, map_chunks, merge_hl7_obx, merge_concatenate
+from utils.model_registry import ROUTE_LAB_ANALYSIS
+from utils.token_budget import PromptTooLongError, RequestBudget, TokenUsageStats, get_remote_token_counter, plan_request
+from utils.endpoint_router import EndpointRouter, HEALTH_CHECK_TIMEOUT, parse_endpoints
+from utils.async_http import get_http_client, make_timeout
+from utils.cancellation import CancellationToken, OperationCancelledError, check_cancelled
 import sys
-from UI.DebugWindow import DualOutput
+from UI.DebugWindow import DualOutput, DebugStats
 import traceback
 import shutil
 
@@ -108,6 +114,8 @@ if app_settings.editable_settings["Use Docker Status Bar"]:
     window.create_docker_status_bar()
 
 NOTE_CREATION = "Note Creation...Please Wait"
+# Large models on slow disks can take minutes to load
+LOCAL_MODEL_LOAD_TIMEOUT = 300
 
 user_message = []
 response_history = []
@@ -115,7 +123,6 @@ current_view = "full"
 username = "user"
 botname = "Assistant"
 num_lines_to_keep = 20
-uploaded_file_path = None
 is_recording = False
 is_realtimeactive = False
 audio_data = []
@@ -127,12 +134,26 @@ is_gpt_button_active = False
 auto_process_thread = None
 stop_auto_processing = False
 auto_processor = None
-p = pyaudio.PyAudio()
+audio_bus = AudioBus.shared()
 audio_queue = queue.Queue()
-CHUNK = 1024
-FORMAT = pyaudio.paInt16
-CHANNELS = 1
-RATE = 16000
+CHUNK = audio_bus.chunk
+FORMAT = audio_bus.format
+CHANNELS = audio_bus.channels
+RATE = audio_bus.rate
+RECORDER_QUEUE_SIZE = 16 * RATE // CHUNK  # Roughly 16 seconds of audio buffered for the recorder
+response_cache = ResponseCache(get_resource_path('response_cache.sqlite3'), get_resource_path('response_cache.key'))
+DebugStats.register("Response cache", response_cache.get_stats)
+llm_scheduler = LLMScheduler()
+DebugStats.register("Local LLM scheduler", llm_scheduler.get_stats)
+DebugStats.register("Local model", ModelManager.get_pool_stats)
+token_usage = TokenUsageStats()
+DebugStats.register("LLM tokens", token_usage.get_stats)
+endpoint_router = EndpointRouter()
+DebugStats.register("Model endpoints", endpoint_router.get_stats)
+http_client = get_http_client()
+DebugStats.register("HTTP", http_client.get_stats)
+DebugStats.register("Fact extraction", lambda: fact_extractor.get_stats() if fact_extractor is not None else {"active": False})
+DebugStats.register("Speech to text", lambda: stt_local_model.get_stats() if stt_local_model is not None else {"loaded": False})
 
 # Application flags
 is_audio_processing_realtime_canceled = threading.Event()
@@ -141,13 +162,18 @@ is_audio_processing_whole_canceled = threading.Event()
 # Constants
 DEFAULT_BUTTON_COLOUR = "SystemButtonFace"
 
-#Thread tracking variables
-REALTIME_TRANSCRIBE_THREAD_ID = None
-GENERATION_THREAD_ID = None
+# Token of the running transcription or note generation, cancelled by clearing the application
+GENERATION_CANCEL_TOKEN = None
 
-# Global instance of whisper model
+# Global instance of the local speech to text backend
 stt_local_model = None
 
+# Extracts the facts of the current realtime recording while it is being recorded
+fact_extractor = None
+
+# Scrubs the transcript of the current realtime recording while it is being recorded
+realtime_scrubber = None
+
 
 def get_prompt(formatted_message):
 
@@ -191,8 +217,8 @@ def threaded_handle_message(formatted_message):
     thread.start()
     return thread
 
-def threaded_send_audio_to_server():
-    thread = threading.Thread(target=send_audio_to_server)
+def threaded_send_audio_to_server(audio_file=None):
+    thread = threading.Thread(target=send_audio_to_server, args=(audio_file,))
     thread.start()
     return thread
 
@@ -253,13 +279,7 @@ def record_audio():
     global is_paused, frames, audio_queue
 
     try:
-        stream = p.open(
-            format=FORMAT, 
-            channels=1, 
-            rate=RATE, 
-            input=True,
-            frames_per_buffer=CHUNK, 
-            input_device_index=int(MicrophoneState.SELECTED_MICROPHONE_INDEX))
+        subscription = audio_bus.subscribe("recorder", maxsize=RECORDER_QUEUE_SIZE)
     except (OSError, IOError) as e:
         messagebox.showerror("Audio Error", f"Please check your microphone settings under whisper settings. Error opening audio stream: {e}")
         return
@@ -272,40 +292,61 @@ def record_audio():
     minimum_audio_duration = int(app_settings.editable_settings["Real Time Audio Length"])
     
     while is_recording:
-        if not is_paused:
-            data = stream.read(CHUNK, exception_on_overflow=False)
-            frames.append(data)
-            # Check for silence
-            audio_buffer = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
-            if is_silent(audio_buffer, app_settings.editable_settings["Silence cut-off"]):
-                silent_duration += CHUNK / RATE
-            else:
-                current_chunk.append(data)
-                silent_duration = 0
-            
-            record_duration += CHUNK / RATE
-            
-            # If the current_chunk has at least 5 seconds of audio and 1 second of silence at the end
-            if record_duration >= minimum_audio_duration and silent_duration >= minimum_silent_duration:
-                if app_settings.editable_settings["Real Time"] and current_chunk:
-                    audio_queue.put(b''.join(current_chunk))
-                current_chunk = []
-                silent_duration = 0
-                record_duration = 0
+        try:
+            data = subscription.read(timeout=0.1)
+        except OSError as e:
+            # The microphone went away, keep what was recorded and stop the recording
+            print(f"Recording stopped: {e}")
+            root.after(0, lambda error=e: on_recording_failed(error))
+            break
+        if data is None or is_paused:
+            # Frames captured while paused are discarded
+            continue
+
+        frames.append(data)
+        # Check for silence
+        audio_buffer = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+        if is_silent(audio_buffer, app_settings.editable_settings["Silence cut-off"]):
+            silent_duration += CHUNK / RATE
+        else:
+            current_chunk.append(data)
+            silent_duration = 0
+        
+        record_duration += CHUNK / RATE
+        
+        # If the current_chunk has at least 5 seconds of audio and 1 second of silence at the end
+        if record_duration >= minimum_audio_duration and silent_duration >= minimum_silent_duration:
+            if app_settings.editable_settings["Real Time"] and current_chunk:
+                audio_queue.put(b''.join(current_chunk))
+            current_chunk = []
+            silent_duration = 0
+            record_duration = 0
 
     # Send any remaining audio chunk when recording stops
     if current_chunk:
         audio_queue.put(b''.join(current_chunk))
 
-    stream.stop_stream()
-    stream.close()
+    subscription.close()
     audio_queue.put(None)
 
 
+def on_recording_failed(error):
+    """
+    Tell the user the microphone stream failed and stop the recording.
+
+    :param error: The error raised by the audio stream.
+    :type error: OSError
+    """
+    messagebox.showerror("Audio Error", f"Please check your microphone settings under whisper settings. Error reading audio stream: {error}")
+    if is_recording:
+        threaded_toggle_recording()
+
 def is_silent(data, threshold=0.01):
     """Check if audio chunk is silent"""
-    data_array = np.array(data)
-    max_value = max(abs(data_array))
+    data_array = np.asarray(data)
+    if data_array.size == 0:
+        return True
+    max_value = np.max(np.abs(data_array))
     return max_value < threshold
 
 def realtime_text():
@@ -323,7 +364,11 @@ def realtime_text():
                 local_cancel_flag = True
                 break
 
-            audio_data = audio_queue.get()
+            try:
+                # Wake up regularly so a cancel is noticed without a sentinel in the queue
+                audio_data = audio_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
             if audio_data is None:
                 break
             if app_settings.editable_settings["Real Time"] == True:
@@ -336,21 +381,27 @@ def realtime_text():
                             update_gui("Local Whisper model not loaded. Please check your settings.")
                             break
 
-                        result = stt_local_model.transcribe(audio_buffer, fp16=False)
+                        try:
+                            text = stt_local_model.transcribe(audio_buffer, cancel_token=is_audio_processing_realtime_canceled)
+                        except OperationCancelledError:
+                            print("Real time transcription cancelled.")
+                            audio_queue.task_done()
+                            continue
                         if not local_cancel_flag and not is_audio_processing_realtime_canceled.is_set():
-                            update_gui(result['text'])
+                            update_gui(text)
+                            add_fact_segment(text)
                     else:
                         print("Remote Real Time Whisper")
                         if frames:
                             with wave.open(get_resource_path("realtime.wav"), 'wb') as wf:
                                 wf.setnchannels(CHANNELS)
-                                wf.setsampwidth(p.get_sample_size(FORMAT))
+                                wf.setsampwidth(audio_bus.get_sample_size())
                                 wf.setframerate(RATE)
                                 wf.writeframes(b''.join(frames))
                             frames = []
                         file_to_send = get_resource_path("realtime.wav")
                         with open(file_to_send, 'rb') as f:
-                            files = {'audio': f}
+                            files = {'audio': (os.path.basename(file_to_send), f.read())}
 
                             headers = {
                                 "Authorization": "Bearer "+app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]
@@ -358,13 +409,18 @@ def realtime_text():
 
                             try:
                                 verify = not app_settings.editable_settings["S2T Server Self-Signed Certificates"]
-                                response = requests.post(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers,files=files, verify=verify)
+                                # Aborted as soon as the recording is cancelled
+                                response = http_client.request("POST", app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers, files=files, verify=verify,
+                                                               timeout=get_http_timeout(), cancel_event=is_audio_processing_realtime_canceled)
                                 if response.status_code == 200:
                                     text = response.json()['text']
                                     if not local_cancel_flag and not is_audio_processing_realtime_canceled.is_set():
                                         update_gui(text)
+                                        add_fact_segment(text)
                                 else:
                                     update_gui(f"Error (HTTP Status {response.status_code}): {response.text}")
+                            except OperationCancelledError:
+                                print("Real time transcription request cancelled.")
                             except Exception as e:
                                 update_gui(f"Error: {e}")
                             finally:
@@ -379,13 +435,74 @@ def realtime_text():
 def update_gui(text):
     user_input.scrolled_text.insert(tk.END, text + '\n')
     user_input.scrolled_text.see(tk.END)
+    # Keep the scrubbed copy identical to the transcript box
+    scrubber = realtime_scrubber
+    if scrubber is not None:
+        scrubber.add_text(text + '\n')
+
+def start_fact_extraction():
+    """
+    Start extracting the facts of a new realtime recording while it is recorded.
+
+    Only used when pre-processing and Incremental Fact Extraction are enabled. The
+    facts are extracted from the scrubbed transcript, like the full pre-processing pass.
+    """
+    global fact_extractor
+    stop_fact_extraction()
+
+    settings = app_settings.editable_settings
+    # Only the Scribe note uses the facts
+    if not (settings["Real Time"] and settings["Use Pre-Processing"] and settings["Incremental Fact Extraction"]) or selected_prompt.get() != "Scribe":
+        return
+
+    def extract(text, cancel_event):
+        return send_document_to_chatgpt(
+            lambda piece: f"{app_settings.editable_settings['Pre-Processing']} {piece}",
+            scrub_phi(text, cancel_token=cancel_event), merge=MERGE_CONCATENATE, cancel_event=cancel_event, route="Scribe")
+
+    fact_extractor = IncrementalFactExtractor(extract)
+
+def stop_fact_extraction():
+    """Cancel the fact extraction of the previous recording."""
+    global fact_extractor
+    if fact_extractor is not None:
+        fact_extractor.cancel()
+        fact_extractor = None
+
+def add_fact_segment(text):
+    """Pass a realtime transcript segment on to the fact extraction."""
+    extractor = fact_extractor
+    if extractor is not None:
+        extractor.add_segment(text)
+
+def get_realtime_facts(transcript, cancel_event=None):
+    """
+    Get the facts extracted while recording, if they belong to the transcript.
+
+    :param transcript: The unscrubbed transcript the note is generated from.
+    :type transcript: str
+    :param cancel_event: Optional event that stops the wait once it is set.
+    :type cancel_event: threading.Event or None
+    :return: The facts list, None if the transcript was edited, nothing was extracted
+        or the extraction failed.
+    :rtype: str or None
+    """
+    extractor = fact_extractor
+    if extractor is None or not extractor.matches(transcript):
+        return None
+
+    start_time = time.perf_counter()
+    facts = extractor.finish(cancel_event)
+    if facts is not None:
+        print(f"Using {len(extractor.facts)} facts extracted while recording, waited {time.perf_counter() - start_time:.1f}s for the last part.")
+    return facts
 
 def save_audio():
     global frames
     if frames:
         with wave.open(get_resource_path("recording.wav"), 'wb') as wf:
             wf.setnchannels(CHANNELS)
-            wf.setsampwidth(p.get_sample_size(FORMAT))
+            wf.setsampwidth(audio_bus.get_sample_size())
             wf.setframerate(RATE)
             wf.writeframes(b''.join(frames))
         frames = []  # Clear recorded data
@@ -396,7 +513,7 @@ def save_audio():
             threaded_send_audio_to_server()
 
 def toggle_recording():
-    global is_recording, recording_thread, DEFAULT_BUTTON_COLOUR, audio_queue, current_view, REALTIME_TRANSCRIBE_THREAD_ID
+    global is_recording, recording_thread, DEFAULT_BUTTON_COLOUR, audio_queue, current_view, realtime_scrubber
 
     # Reset the cancel flags going into a fresh recording
     if not is_recording:
@@ -410,7 +527,8 @@ def toggle_recording():
 
     if not is_recording:
         disable_recording_ui_elements()
-        REALTIME_TRANSCRIBE_THREAD_ID = realtime_thread.ident
+        start_fact_extraction()
+        realtime_scrubber = IncrementalScrubber() if app_settings.editable_settings["Real Time"] else None
         user_input.scrolled_text.configure(state='normal')
         user_input.scrolled_text.delete("1.0", tk.END)
         if not app_settings.editable_settings["Real Time"]:
@@ -437,28 +555,7 @@ def toggle_recording():
             recording_thread.join()  # Ensure the recording thread is terminated
         
         if app_settings.editable_settings["Real Time"] and not is_audio_processing_realtime_canceled.is_set():
-            def cancel_realtime_processing(thread_id):
-                """Cancels any ongoing audio processing.
-                
-                Sets the global flag to stop audio processing operations.
-                """
-                global REALTIME_TRANSCRIBE_THREAD_ID
-
-                try:
-                    kill_thread(thread_id)
-                except Exception as e:
-                    # Log the error message
-                    # TODO System logger
-                    print(f"An error occurred: {e}")
-                finally:
-                    REALTIME_TRANSCRIBE_THREAD_ID = None
-
-                #empty the queue
-                while not audio_queue.empty():
-                    audio_queue.get()
-                    audio_queue.task_done()
-
-            loading_window = LoadingWindow(root, "Processing Audio", "Processing Audio. Please wait.", on_cancel=lambda: (cancel_processing(), cancel_realtime_processing(REALTIME_TRANSCRIBE_THREAD_ID)))
+            loading_window = LoadingWindow(root, "Processing Audio", "Processing Audio. Please wait.", on_cancel=lambda: (cancel_processing(), cancel_realtime_transcription()))
 
 
             timeout_timer = 0
@@ -510,6 +607,22 @@ def cancel_processing():
     else:
         is_audio_processing_whole_canceled.set()  # Flag to terminate processing
 
+def cancel_realtime_transcription():
+    """Stops the realtime transcription thread and drops the audio it has not processed.
+
+    The thread stops the chunk it is transcribing at its next cancellation check and
+    then exits, it is not killed.
+    """
+    is_audio_processing_realtime_canceled.set()
+
+    # empty the queue
+    while True:
+        try:
+            audio_queue.get_nowait()
+        except queue.Empty:
+            break
+        audio_queue.task_done()
+
 def clear_application_press():
     """Resets the application state by clearing text fields and recording status."""
     reset_recording_status()  # Reset recording-related variables
@@ -523,32 +636,20 @@ def reset_recording_status():
         - Canceling any processing
         - Stopping the recording thread
     """
-    global is_recording, frames, audio_queue, REALTIME_TRANSCRIBE_THREAD_ID, GENERATION_THREAD_ID
+    global is_recording, frames, audio_queue, GENERATION_CANCEL_TOKEN, realtime_scrubber
     if is_recording:  # Only reset if currently recording
         cancel_processing()  # Stop any ongoing processing
         threaded_toggle_recording()  # Stop the recording thread
 
-    # kill the generation thread if active
-    if REALTIME_TRANSCRIBE_THREAD_ID:
-        # Exit the current realtime thread
-        try:
-            kill_thread(REALTIME_TRANSCRIBE_THREAD_ID)
-        except Exception as e:
-            # Log the error message
-            # TODO System logger
-            print(f"An error occurred: {e}")
-        finally:
-            REALTIME_TRANSCRIBE_THREAD_ID = None
+    # Stop the realtime thread if it is still working through the queue
+    cancel_realtime_transcription()
+    stop_fact_extraction()
+    realtime_scrubber = None
 
-    if GENERATION_THREAD_ID:
-        try:
-            kill_thread(GENERATION_THREAD_ID)
-        except Exception as e:
-            # Log the error message
-            # TODO System logger
-            print(f"An error occurred: {e}")
-        finally:
-            GENERATION_THREAD_ID = None
+    # Cancel the transcription or note generation if active
+    if GENERATION_CANCEL_TOKEN is not None:
+        GENERATION_CANCEL_TOKEN.cancel()
+        GENERATION_CANCEL_TOKEN = None
 
 def clear_all_text_fields():
     """Clears and resets all text fields in the application UI.
@@ -584,191 +685,148 @@ def clear_all_text_fields():
     use_aiscribe = not use_aiscribe
     toggle_button.config(text="AI Scribe\nON" if use_aiscribe else "AI Scribe\nOFF")"""
 
-def send_audio_to_server():
+def transcribe_audio_file(file_path, is_upload=True, cancel_event=None):
     """
-    Sends an audio file to either a local or remote Whisper server for transcription.
+    Transcribe an audio file with the local model or the remote Whisper server.
+
+    Uploaded files are decoded to 16 kHz mono on the client first, see ``utils.audio_ingest``.
+
+    :param file_path: Path to the audio file.
+    :type file_path: str
+    :param is_upload: False for our own 16 kHz mono recording, which needs no decoding.
+    :type is_upload: bool
+    :param cancel_event: Optional event, local transcription stops between segments and the
+        request to the remote server is aborted once it is set.
+    :type cancel_event: threading.Event or None
+    :return: The transcribed text.
+    :rtype: str
+    :raises RuntimeError: If the local model is not loaded.
+    :raises httpx.HTTPError: If the request to the remote server fails or times out.
+    :raises OperationCancelledError: If the transcription was cancelled.
+    """
+    # Check if SettingsKeys.LOCAL_WHISPER is enabled in the editable settings
+    if app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value] == True:
+        if stt_local_model is None:
+            raise RuntimeError("Local Whisper model not loaded. Please check your settings.")
 
-    Global Variables:
-    ----------------
-    uploaded_file_path : str
-        The path to the uploaded audio file. If `None`, the function defaults to
-        'recording.wav'.
+        if not is_upload:
+            # Our own recording is already 16 kHz mono
+            audio_to_transcribe = file_path
+        else:
+            # Decode uploads to 16 kHz mono here so the model gets samples directly
+            audio_to_transcribe = load_audio_for_transcription(file_path)
+            if not isinstance(audio_to_transcribe, str):
+                print(f"Decoded {os.path.basename(file_path)} to {len(audio_to_transcribe) / RATE:.1f}s of 16 kHz mono audio")
+
+        # Transcribe the audio file using the loaded model
+        return stt_local_model.transcribe(audio_to_transcribe, cancel_token=cancel_event)
+
+    file_to_send = file_path
+    upload = None
+    if is_upload:
+        try:
+            # Downmix and resample uploads before sending to cut the upload size
+            upload = prepare_audio_upload(file_path)
+            print(f"Prepared {os.path.basename(file_path)} for upload: {format_bytes(upload.original_bytes)} -> {format_bytes(upload.output_bytes)} ({format_bytes(upload.bytes_saved)} saved)")
+            file_to_send = upload.path
+        except AudioIngestError as e:
+            # Let the server try to decode the file itself
+            print(f"Could not decode audio locally, uploading original file: {e}")
+
+    try:
+        # Open the audio file in binary mode
+        with open(file_to_send, 'rb') as f:
+            files = {'audio': (os.path.basename(file_to_send), f.read())}
+
+            # Add the Bearer token to the headers for authentication
+            headers = {
+                "Authorization": f"Bearer {app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]}"
+            }
+
+            verify = not app_settings.editable_settings["S2T Server Self-Signed Certificates"]
+
+            # Send the request without verifying the SSL certificate
+            response = http_client.request("POST", app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers, files=files, verify=verify,
+                                           timeout=get_http_timeout(), cancel_event=cancel_event)
+
+            response.raise_for_status()
+            return response.json()['text']
+    finally:
+        if upload is not None:
+            upload.cleanup()
+
+def send_audio_to_server(audio_file=None):
+    """
+    Sends an audio file to either a local or remote Whisper server for transcription.
 
     Parameters:
     -----------
-    None
+    audio_file : str or None
+        The path to the uploaded audio file. If `None`, the function defaults to
+        'recording.wav', which is deleted afterwards.
 
     Returns:
     --------
     None
-
-    Raises:
-    -------
-    ValueError
-        If the `app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value]` flag is not a boolean.
-    FileNotFoundError
-        If the specified audio file does not exist.
-    requests.exceptions.RequestException
-        If there is an issue with the HTTP request to the remote server.
     """
 
-    global uploaded_file_path
-    current_thread_id = threading.current_thread().ident
+    global GENERATION_CANCEL_TOKEN
 
-    def cancel_whole_audio_process(thread_id):
-        global GENERATION_THREAD_ID
-        
-        is_audio_processing_whole_canceled.clear()
-
-        try:
-            kill_thread(thread_id)
-        except Exception as e:
-            # Log the error message
-            #TODO Logging the message to system logger
-            print(f"An error occurred: {e}")
-        finally:
-            GENERATION_THREAD_ID = None
+    # Stops local transcription between segments and aborts the request to the Whisper server.
+    # Only this token is cancelled, the recording cancel flags would also drop later uploads.
+    cancel_token = CancellationToken()
+    GENERATION_CANCEL_TOKEN = cancel_token
 
-    loading_window = LoadingWindow(root, "Processing Audio", "Processing Audio. Please wait.", on_cancel=lambda: (cancel_processing(), cancel_whole_audio_process(current_thread_id)))
+    loading_window = LoadingWindow(root, "Processing Audio", "Processing Audio. Please wait.", on_cancel=cancel_token.cancel)
 
-    # Check if SettingsKeys.LOCAL_WHISPER is enabled in the editable settings
     if app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value] == True:
         # Inform the user that SettingsKeys.LOCAL_WHISPER.value is being used for transcription
         print(f"Using {SettingsKeys.LOCAL_WHISPER.value} for transcription.")
-        # Configure the user input widget to be editable and clear its content
-        user_input.scrolled_text.configure(state='normal')
-        user_input.scrolled_text.delete("1.0", tk.END)
-
-        # Display a message indicating that audio to text processing is in progress
-        user_input.scrolled_text.insert(tk.END, "Audio to Text Processing...Please Wait")
-        try:
-            # Determine the file to send for transcription
-            file_to_send = uploaded_file_path or get_resource_path('recording.wav')
-            delete_file = False if uploaded_file_path else True
-            uploaded_file_path = None
-
-            # Transcribe the audio file using the loaded model
-            result = stt_local_model.transcribe(file_to_send)
-            transcribed_text = result["text"]
-
-            # done with file clean up
-            if os.path.exists(file_to_send) and delete_file is True:
-                os.remove(file_to_send)
-
-            #check if canceled, if so do not update the UI
-            if not is_audio_processing_whole_canceled.is_set():
-                # Update the user input widget with the transcribed text
-                user_input.scrolled_text.configure(state='normal')
-                user_input.scrolled_text.delete("1.0", tk.END)
-                user_input.scrolled_text.insert(tk.END, transcribed_text)
-
-                # Send the transcribed text and receive a response
-                send_and_receive()
-        except Exception as e:
-            # Log the error message
-            # TODO: Add system eventlogger
-            print(f"An error occurred: {e}")
-
-            #log error to input window
-            user_input.scrolled_text.configure(state='normal')
-            user_input.scrolled_text.delete("1.0", tk.END)
-            user_input.scrolled_text.insert(tk.END, f"An error occurred: {e}")
-            user_input.scrolled_text.configure(state='disabled')
-        finally:
-            loading_window.destroy()
-            
     else:
         # Inform the user that Remote Whisper is being used for transcription
         print("Using Remote Whisper for transcription.")
 
-        # Configure the user input widget to be editable and clear its content
-        user_input.scrolled_text.configure(state='normal')
-        user_input.scrolled_text.delete("1.0", tk.END)
-
-        # Display a message indicating that audio to text processing is in progress
-        user_input.scrolled_text.insert(tk.END, "Audio to Text Processing...Please Wait")
-
-        delete_file = False if uploaded_file_path else True
-
-        # Determine the file to send for transcription
-        if uploaded_file_path:
-            file_to_send = uploaded_file_path
-            uploaded_file_path = None
-        else:
-            file_to_send = get_resource_path('recording.wav')
-
-        # Open the audio file in binary mode
-        with open(file_to_send, 'rb') as f:
-            files = {'audio': f}
+    # Configure the user input widget to be editable and clear its content
+    user_input.scrolled_text.configure(state='normal')
+    user_input.scrolled_text.delete("1.0", tk.END)
 
-            # Add the Bearer token to the headers for authentication
-            headers = {
-                "Authorization": f"Bearer {app_settings.editable_settings[SettingsKeys.WHISPER_SERVER_API_KEY.value]}"
-            }
+    # Display a message indicating that audio to text processing is in progress
+    user_input.scrolled_text.insert(tk.END, "Audio to Text Processing...Please Wait")
 
-            try:
-                verify = not app_settings.editable_settings["S2T Server Self-Signed Certificates"]
+    # Determine the file to send for transcription
+    file_to_send = audio_file or get_resource_path('recording.wav')
+    delete_file = audio_file is None
 
-                # Send the request without verifying the SSL certificate
-                response = requests.post(app_settings.editable_settings[SettingsKeys.WHISPER_ENDPOINT.value], headers=headers, files=files, verify=verify)
+    try:
+        transcribed_text = transcribe_audio_file(file_to_send, is_upload=not delete_file, cancel_event=cancel_token)
 
-                response.raise_for_status()
+        #check if canceled, if so do not update the UI
+        cancel_token.raise_if_cancelled()
 
-                # check if canceled, if so do not update the UI
-                if not is_audio_processing_whole_canceled.is_set():
-                    # Update the UI with the transcribed text
-                    transcribed_text = response.json()['text']
-                    user_input.scrolled_text.configure(state='normal')
-                    user_input.scrolled_text.delete("1.0", tk.END)
-                    user_input.scrolled_text.insert(tk.END, transcribed_text)
+        # Update the user input widget with the transcribed text
+        user_input.scrolled_text.configure(state='normal')
+        user_input.scrolled_text.delete("1.0", tk.END)
+        user_input.scrolled_text.insert(tk.END, transcribed_text)
 
-                    # Send the transcribed text and receive a response
-                    send_and_receive()
-            except Exception as e:
-                # log error message
-                #TODO: Implment proper logging to system
-                print(f"An error occurred: {e}")
-                # Display an error message to the user
-                user_input.scrolled_text.configure(state='normal')
-                user_input.scrolled_text.delete("1.0", tk.END)
-                user_input.scrolled_text.insert(tk.END, f"An error occurred: {e}")
-                user_input.scrolled_text.configure(state='disabled')
-            finally:
-                # done with file clean up
-                f.close()
-                if os.path.exists(file_to_send) and delete_file:
-                    os.remove(file_to_send)
-                loading_window.destroy()
-
-def kill_thread(thread_id):
-    """
-    Terminate a thread with a given thread ID.
-
-    This function forcibly terminates a thread by raising a `SystemExit` exception in its context.
-    **Use with caution**, as this method is not safe and can lead to unpredictable behavior, 
-    including corruption of shared resources or deadlocks.
-
-    :param thread_id: The ID of the thread to terminate.
-    :type thread_id: int
-    :raises ValueError: If the thread ID is invalid.
-    :raises SystemError: If the operation fails due to an unexpected state.
-    """
-    # Call the C function `PyThreadState_SetAsyncExc` to asynchronously raise
-    # an exception in the target thread's context.
-    res = ctypes.pythonapi.PyThreadState_SetAsyncExc(
-        ctypes.c_long(thread_id),  # The thread ID to target (converted to `long`).
-        ctypes.py_object(SystemExit)  # The exception to raise in the thread.
-    )
+        # Send the transcribed text and receive a response
+        send_and_receive()
+    except OperationCancelledError:
+        print("Transcription cancelled.")
+    except Exception as e:
+        # Log the error message
+        # TODO: Add system eventlogger
+        print(f"An error occurred: {e}")
 
-    # Check the result of the function call.
-    if res == 0:
-        # If 0 is returned, the thread ID is invalid.
-        raise ValueError(f"Invalid thread ID: {thread_id}")
-    elif res > 1:
-        # If more than one thread was affected, something went wrong.
-        # Reset the state to prevent corrupting other threads.
-        ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, None)
-        raise SystemError("PyThreadState_SetAsyncExc failed")
+        #log error to input window
+        user_input.scrolled_text.configure(state='normal')
+        user_input.scrolled_text.delete("1.0", tk.END)
+        user_input.scrolled_text.insert(tk.END, f"An error occurred: {e}")
+        user_input.scrolled_text.configure(state='disabled')
+    finally:
+        # done with file clean up
+        if os.path.exists(file_to_send) and delete_file:
+            os.remove(file_to_send)
+        loading_window.destroy()
 
 def send_and_receive():
     global use_aiscribe, user_message
@@ -792,8 +850,18 @@ def display_text(text):
     response_display.scrolled_text.configure(fg='black')
 
 IS_FIRST_LOG = True
-def update_gui_with_response(response_text):
-    global response_history, user_message, IS_FIRST_LOG
+def add_to_response_history(transcript, response_text):
+    """
+    Record a transcript and its note in the response history and refresh the timestamp list.
+
+    Must be called on the Tk thread.
+
+    :param transcript: The text the note was generated from.
+    :type transcript: str
+    :param response_text: The generated note.
+    :type response_text: str
+    """
+    global response_history, IS_FIRST_LOG
 
     if IS_FIRST_LOG:
         timestamp_listbox.delete(0, tk.END)
@@ -801,13 +869,18 @@ def update_gui_with_response(response_text):
         IS_FIRST_LOG = False
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    response_history.insert(0, (timestamp, user_message, response_text))
+    response_history.insert(0, (timestamp, transcript, response_text))
 
     # Update the timestamp listbox
     timestamp_listbox.delete(0, tk.END)
     for time, _, _ in response_history:
         timestamp_listbox.insert(tk.END, time)
 
+def update_gui_with_response(response_text):
+    global user_message
+
+    add_to_response_history(user_message, response_text)
+
     display_text(response_text)
     pyperclip.copy(response_text)
     user_input.scrolled_text.configure(state='normal')
@@ -825,7 +898,7 @@ def update_gui_with_response(response_text):
             def analyze_and_update():
                 try:
                     from utils.lab_analysis import analyze_plan_for_labs
-                    suggested_labels = analyze_plan_for_labs(plan_text, send_text_to_chatgpt)
+                    suggested_labels = analyze_plan_for_labs(plan_text, functools.partial(send_text_to_chatgpt, priority=PRIORITY_LAB, route=ROUTE_LAB_ANALYSIS))
                     # Update panel on main thread - always call set_checkboxes (even if empty) to clear previous selections
                     root.after(0, lambda: lab_selection_panel.set_checkboxes(suggested_labels))
                     root.after(0, lambda: lab_selection_panel.show())
@@ -864,7 +937,27 @@ def show_response(event):
         response_display.scrolled_text.config(fg='black')
         pyperclip.copy(response_text)
 
-def send_text_to_api(edited_text, context_length=None):
+def send_text_to_api(edited_text, context_length=None, on_token=None, json_schema=None, max_tokens=None, cancel_event=None):
+    """
+    Send a prompt to the remote OpenAI style endpoint.
+
+    :param edited_text: The prompt.
+    :type edited_text: str
+    :param context_length: Optional max context length to request.
+    :type context_length: int or None
+    :param on_token: If given, the response is streamed and each text fragment is passed
+        to this callable as it arrives.
+    :type on_token: callable or None
+    :param json_schema: Optional JSON schema the response must follow (structured output).
+    :type json_schema: dict or None
+    :param max_tokens: Optional limit on the number of generated tokens.
+    :type max_tokens: int or None
+    :param cancel_event: Optional event, the request is aborted and the connection closed once it is set.
+    :type cancel_event: threading.Event or None
+    :return: The complete response text.
+    :rtype: str
+    :raises OperationCancelledError: If the request was cancelled.
+    """
     headers = {
         "Authorization": f"Bearer {app_settings.OPENAI_API_KEY}",
         "Content-Type": "application/json",
@@ -912,19 +1005,51 @@ def send_text_to_api(edited_text, context_length=None):
 
         print(f"Error parsing settings: {e}. Using default settings.")
 
-    try:
+    if json_schema is not None:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "response", "strict": True, "schema": json_schema},
+        }
 
-        if app_settings.editable_settings["Model Endpoint"].endswith('/'):
-            app_settings.editable_settings["Model Endpoint"] = app_settings.editable_settings["Model Endpoint"][:-1]
+    if max_tokens is not None:
+        payload["max_tokens"] = int(max_tokens)
+
+    try:
+        configure_endpoint_router()
 
         # Open API Style
         verify = not app_settings.editable_settings["AI Server Self-Signed Certificates"]
-        response = requests.post(app_settings.editable_settings["Model Endpoint"]+"/chat/completions", headers=headers, json=payload, verify=verify)
 
-        response.raise_for_status()
-        response_data = response.json()
-        response_text = (response_data['choices'][0]['message']['content'])
-        return response_text
+        if on_token is not None:
+            streamed = []
+
+            def on_streamed_token(fragment):
+                streamed.append(fragment)
+                on_token(fragment)
+
+            # Fail over only until the first fragment was shown
+            return endpoint_router.call(
+                lambda endpoint: stream_text_from_api(endpoint, headers, payload, verify, on_streamed_token, cancel_event),
+                can_retry=lambda: not streamed,
+            )
+
+        def post(endpoint):
+            request_payload = payload
+            response = http_client.request("POST", endpoint+"/chat/completions", headers=headers, json=request_payload, verify=verify,
+                                           timeout=get_http_timeout(), cancel_event=cancel_event)
+
+            if response.status_code == 400 and "response_format" in request_payload:
+                # Older OpenAI compatible servers reject json_schema, the prompt still asks for JSON
+                print("Endpoint does not support structured output, retrying without response_format.")
+                request_payload = {key: value for key, value in request_payload.items() if key != "response_format"}
+                response = http_client.request("POST", endpoint+"/chat/completions", headers=headers, json=request_payload, verify=verify,
+                                               timeout=get_http_timeout(), cancel_event=cancel_event)
+
+            response.raise_for_status()
+            response_data = response.json()
+            return response_data['choices'][0]['message']['content']
+
+        return endpoint_router.call(post)
 
         #############################################################
         #                                                           #
@@ -949,33 +1074,421 @@ def send_text_to_api(edited_text, context_length=None):
     except Exception as e:
         raise e
 
-def send_text_to_localmodel(edited_text):  
-    # Send prompt to local model and get response
-    if ModelManager.local_model is None:
-        ModelManager.setup_model(app_settings=app_settings, root=root)
+def get_http_timeout():
+    """
+    Get the timeouts of requests to the LLM and Whisper servers from the settings.
 
-        timer = 0
-        while ModelManager.local_model is None and timer < 30:
-            timer += 0.1
-            time.sleep(0.1)
-        
+    :rtype: httpx.Timeout
+    """
+    try:
+        connect = float(app_settings.editable_settings["HTTP Connect Timeout (s)"])
+        read = float(app_settings.editable_settings["HTTP Read Timeout (s)"])
+    except (TypeError, ValueError):
+        return make_timeout()
+    # 0 turns the read timeout off, e.g. for very slow servers
+    return make_timeout(connect, read if read > 0 else None)
+
+def get_model_endpoints():
+    """
+    Get the remote endpoints: the Model Endpoint followed by the Additional Model Endpoints.
+
+    :return: Base URLs without trailing slashes.
+    :rtype: list[str]
+    """
+    settings = app_settings.editable_settings
+    return parse_endpoints(f"{settings['Model Endpoint']};{settings['Additional Model Endpoints']}")
+
+def needs_phi_review():
+    """
+    Check if a scrubbed transcript has to be reviewed before it is sent.
+
+    A transcript goes without review only to the local LLM or when every endpoint it can
+    fail over to is on a private network, and Show Scrub PHI is off.
+
+    :return: True if the transcript must be shown in the Scrub PHI popup first.
+    :rtype: bool
+    """
+    settings = app_settings.editable_settings
+    if settings["Show Scrub PHI"]:
+        return True
+    if settings["Use Local LLM"]:
+        return False
+    endpoints = get_model_endpoints()
+    return not endpoints or not all(is_private_ip(endpoint) for endpoint in endpoints)
+
+def check_endpoint_health(endpoint):
+    """
+    Health check of a remote endpoint, lists its models.
 
-    return ModelManager.local_model.generate_response(
-        edited_text,
-        max_tokens=int(app_settings.editable_settings["max_length"]),
+    :param endpoint: Base URL of the endpoint.
+    :type endpoint: str
+    :raises httpx.HTTPError: If the endpoint is down or answers with an error.
+    """
+    headers = {"Authorization": f"Bearer {app_settings.OPENAI_API_KEY}"}
+    verify = not app_settings.editable_settings["AI Server Self-Signed Certificates"]
+    response = http_client.request("GET", endpoint+"/models", headers=headers, verify=verify,
+                                   timeout=make_timeout(HEALTH_CHECK_TIMEOUT, HEALTH_CHECK_TIMEOUT))
+    response.raise_for_status()
+
+def configure_endpoint_router():
+    """
+    Apply the endpoint settings to the router and run health checks when there is more than one endpoint.
+    """
+    endpoints = get_model_endpoints()
+    endpoint_router.configure(endpoints, app_settings.editable_settings["Endpoint Routing"])
+
+    try:
+        interval = float(app_settings.editable_settings["Endpoint Health Check Interval (s)"])
+    except (TypeError, ValueError):
+        interval = 30.0
+
+    if len(endpoints) > 1 and interval > 0:
+        if endpoint_router.health_interval != interval:
+            endpoint_router.start_health_checks(check_endpoint_health, interval)
+    elif endpoint_router.health_thread is not None:
+        endpoint_router.stop_health_checks()
+
+def stream_text_from_api(endpoint, headers, payload, verify, on_token, cancel_event=None):
+    """
+    Request a streamed chat completion (server-sent events) and pass fragments to ``on_token``.
+
+    Falls back to a regular response if the server ignores ``stream``.
+
+    :param endpoint: Base URL of the endpoint.
+    :type endpoint: str
+    :param cancel_event: Optional event, the stream is aborted and the connection closed once it is set.
+    :type cancel_event: threading.Event or None
+    :return: The complete response text.
+    :rtype: str
+    """
+    payload = dict(payload, stream=True)
+    headers = dict(headers, accept="text/event-stream")
+
+    start_time = time.perf_counter()
+    first_token_time = None
+    fragments = []
+
+    with http_client.stream("POST", endpoint+"/chat/completions", headers=headers, json=payload, verify=verify,
+                            timeout=get_http_timeout(), cancel_event=cancel_event) as response:
+        response.raise_for_status()
+
+        if "text/event-stream" not in response.headers.get("Content-Type", ""):
+            # Server does not support streaming, it sent the whole completion at once
+            response_text = response.json()['choices'][0]['message']['content']
+            on_token(response_text)
+            return response_text
+
+        for fragment in iter_sse_content(response):
+            # A fast stream may buffer several fragments per read, stop between them too
+            check_cancelled(cancel_event)
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+                print(f"Time to first token: {first_token_time - start_time:.2f}s")
+            fragments.append(fragment)
+            on_token(fragment)
+
+    print(f"Streamed response completed in {time.perf_counter() - start_time:.2f}s")
+    return "".join(fragments)
+
+def send_text_to_localmodel(edited_text, on_token=None, cancel_event=None, priority=PRIORITY_INTERACTIVE, json_schema=None, max_tokens=None, route=None):  
+    """
+    Send a prompt to the local llama.cpp model.
+
+    Requests are queued on the local LLM scheduler so only one generation uses the
+    model at a time, interactive notes ahead of background work.
+
+    :param edited_text: The prompt.
+    :type edited_text: str
+    :param on_token: If given, each text fragment is passed to this callable as it is generated.
+    :type on_token: callable or None
+    :param cancel_event: Optional event, the request leaves the queue or generation stops between tokens once it is set.
+    :type cancel_event: threading.Event or None
+    :param priority: Scheduler priority, one of the ``PRIORITY_*`` constants.
+    :type priority: int
+    :param json_schema: Optional JSON schema, generation is constrained by a grammar built from it.
+    :type json_schema: dict or None
+    :param max_tokens: Optional limit on the number of generated tokens, defaults to the max_length setting.
+    :type max_tokens: int or None
+    :param route: Optional prompt type, used to pick a model from the Local Model Routes setting.
+    :type route: str or None
+    :return: The generated text.
+    :rtype: str
+    """
+    # Load the model if it is not loaded yet or the last load failed, then wait for it
+    if ModelManager.load_state in (ModelManager.LOAD_STATE_UNLOADED, ModelManager.LOAD_STATE_FAILED):
+        ModelManager.load_model_async(app_settings)
+    model = ModelManager.wait_until_ready(timeout=LOCAL_MODEL_LOAD_TIMEOUT, cancel_event=cancel_event)
+
+    generation_args = dict(
+        max_tokens=int(max_tokens or app_settings.editable_settings["max_length"]),
         temperature=float(app_settings.editable_settings["temperature"]),
         top_p=float(app_settings.editable_settings["top_p"]),
         repeat_penalty=float(app_settings.editable_settings["rep_pen"]),
+        cancel_event=cancel_event,
+        response_format={"type": "json_object", "schema": json_schema} if json_schema is not None else None,
     )
 
-    
+    def generate():
+        # Runs on the scheduler thread, which is the only thread using the model
+        # Errors are raised rather than returned as text so they are never cached as a response
+        fragments = []
+        target = ModelManager.get_model_for_route(route, app_settings) or model
+        for fragment in target.generate_response_stream(edited_text, **generation_args):
+            fragments.append(fragment)
+            if on_token is not None:
+                on_token(fragment)
+        return "".join(fragments)
+
+    return llm_scheduler.run(generate, priority=priority, cancel_event=cancel_event)
+
+
+def get_response_cache_key(edited_text, context_length=None, json_schema=None, max_tokens=None, route=None):
+    """
+    Build the response cache key for a prompt with the current model and sampling settings.
+
+    :return: The key, or None if the request must not be cached.
+    :rtype: str or None
+    """
+    settings = app_settings.editable_settings
+    if not settings["Use Response Cache"] or not response_cache.enabled:
+        return None
+
+    try:
+        temperature = float(settings["temperature"])
+    except (TypeError, ValueError):
+        temperature = None
+
+    # Sampling makes responses non-deterministic, a cached answer would hide that
+    if (temperature is None or temperature > 0) and not settings["Force Response Cache"]:
+        response_cache.record_bypass()
+        return None
+
+    ttl_hours = float(settings["Response Cache TTL (hours)"])
+    size_mb = float(settings["Response Cache Size (MB)"])
+    response_cache.configure(ttl_hours * 3600, int(size_mb * 1024 * 1024))
+
+    if settings["Use Local LLM"]:
+        endpoint = "local"
+        routed_model = ModelManager.resolve_route(route, app_settings)
+        if routed_model is not None:
+            model = routed_model.path
+        else:
+            model = ModelManager.local_model.config["model_path"] if ModelManager.local_model else "local"
+        params = {key: settings[key] for key in ["max_length", "temperature", "top_p", "rep_pen"]}
+    else:
+        endpoint = settings["Model Endpoint"].rstrip('/')
+        model = settings["Model"].strip()
+        params = {key: settings[key] for key in ["max_length", "temperature", "top_p", "top_k", "tfs", "best_of"]}
+        params["context_length"] = context_length
+
+    if json_schema is not None:
+        params["json_schema"] = json_schema
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+
+    return make_cache_key(endpoint, model, edited_text, params)
+
+def get_token_counter(route=None):
+    """
+    Get the token counter for the model requests currently go to.
+
+    :param route: Prompt type, a local model may be routed for it.
+    :type route: str or None
+    :rtype: TokenCounter
+    """
+    if app_settings.editable_settings["Use Local LLM"]:
+        routed_model = ModelManager.resolve_route(route, app_settings)
+        if routed_model is not None:
+            counter = ModelManager.get_route_token_counter(routed_model)
+            if counter is not None:
+                return counter
+        if ModelManager.local_model is not None:
+            return ModelManager.local_model.token_counter
+    return get_remote_token_counter()
+
+def get_context_size(context_length=None, route=None):
+    """
+    Get the context window of the model requests currently go to.
+
+    :param context_length: Context length requested from the remote endpoint, if any.
+    :type context_length: int or None
+    :param route: Prompt type, a local model may be routed for it.
+    :type route: str or None
+    :rtype: int
+    """
+    if app_settings.editable_settings["Use Local LLM"]:
+        routed_model = ModelManager.resolve_route(route, app_settings)
+        if routed_model is not None:
+            return ModelManager.get_route_context_size(routed_model, app_settings)
+        return ModelManager.local_model.config["context_size"] if ModelManager.local_model is not None else 4096
+    return int(context_length or app_settings.editable_settings["max_context_length"])
+
+def plan_llm_request(edited_text, context_length=None, max_tokens=None, route=None):
+    """
+    Count the prompt and pick ``max_tokens`` before anything is sent.
+
+    The context and tokenizer are those of the local model routed for ``route``, if any.
 
+    :return: The budget for the request.
+    :rtype: RequestBudget
+    :raises PromptTooLongError: If the prompt does not fit, when the count is exact.
+    """
+    counter = get_token_counter(route)
+    context_size = get_context_size(context_length, route)
+    requested = int(max_tokens or app_settings.editable_settings["max_length"])
+    prompt_tokens = counter.count(edited_text)
+
+    try:
+        budget = plan_request(prompt_tokens, context_size, requested)
+    except PromptTooLongError as e:
+        if counter.exact:
+            token_usage.record_rejected()
+            raise
+        # Approximate count and the endpoint may allow more than max_context_length, let it decide
+        print(f"Warning: {e} (estimated with {counter.name}, sending anyway)")
+        return RequestBudget(prompt_tokens, requested, context_size, False)
+
+    if budget.clamped:
+        print(f"Warning: prompt is {prompt_tokens} tokens, limiting the response to {budget.max_tokens} "
+              f"tokens instead of {requested} to fit the {context_size} token context.")
+    return budget
+
+def send_text_to_chatgpt(edited_text, context_length=None, on_token=None, cancel_event=None, priority=PRIORITY_INTERACTIVE, json_schema=None, max_tokens=None, route=None):  
+    cache_key = get_response_cache_key(edited_text, context_length, json_schema, max_tokens, route)
+    if cache_key is not None:
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            print("Using cached LLM response.")
+            if on_token is not None:
+                on_token(cached_response)
+            return cached_response
+
+    budget = plan_llm_request(edited_text, context_length, max_tokens, route)
+    start_time = time.perf_counter()
 
-def send_text_to_chatgpt(edited_text, context_length=None):  
     if app_settings.editable_settings["Use Local LLM"]:
-        return send_text_to_localmodel(edited_text)
+        response_text = send_text_to_localmodel(edited_text, on_token=on_token, cancel_event=cancel_event, priority=priority, json_schema=json_schema, max_tokens=budget.max_tokens, route=route)
+        token_usage.record("local", budget, get_token_counter(route).count(response_text), time.perf_counter() - start_time)
     else:
-        return send_text_to_api(edited_text, context_length)
+        # Remote endpoints choose their own response length unless it has to be limited
+        remote_max_tokens = budget.max_tokens if (max_tokens is not None or budget.clamped) else None
+        response_text = send_text_to_api(edited_text, context_length, on_token=on_token, json_schema=json_schema, max_tokens=remote_max_tokens, cancel_event=cancel_event)
+        token_usage.record(app_settings.editable_settings["Model"].strip(), budget, get_token_counter().count(response_text), time.perf_counter() - start_time)
+
+    # Local generation returns the partial response when cancelled, never use or cache it
+    check_cancelled(cancel_event)
+    if cache_key is not None and response_text:
+        response_cache.put(cache_key, response_text)
+
+    return response_text
+
+def get_document_token_budget(build_prompt, context_length=None, route=None):
+    """
+    Work out how many tokens of document fit in one request next to the prompt and the response.
+
+    :param build_prompt: Builds the full prompt for a piece of the document.
+    :type build_prompt: callable
+    :param context_length: Context length requested from the remote endpoint, if any.
+    :type context_length: int or None
+    :param route: Prompt type, a local model may be routed for it.
+    :type route: str or None
+    :rtype: int
+    """
+    # Room for the response and the chat template around the prompt
+    reserved = int(app_settings.editable_settings["max_length"]) + 64
+    return max(256, get_context_size(context_length, route) - get_token_counter(route).count_template(build_prompt("")) - reserved)
+
+def send_document_to_chatgpt(build_prompt, document, merge=MERGE_LLM, context_length=None, on_token=None, cancel_event=None, priority=PRIORITY_INTERACTIVE, route=None, depth=0, task=None):
+    """
+    Send a prompt built around a document, splitting the document when it exceeds the model context.
+
+    Documents that fit are sent in one request, exactly as before. Larger documents are
+    split at page and section boundaries, every chunk is sent with the same prompt and
+    the results are merged with ``merge``. Remote chunks run concurrently, local chunks
+    run one after the other so the shared prompt prefix stays in the KV cache.
+
+    :param build_prompt: Builds the full prompt for a piece of the document.
+    :type build_prompt: callable
+    :param document: The document text.
+    :type document: str
+    :param merge: ``MERGE_HL7_OBX``, ``MERGE_CONCATENATE`` or ``MERGE_LLM``.
+    :type merge: str
+    :param on_token: Optional callable receiving the final response as it streams in. Only
+        single requests and the final LLM merge are streamed.
+    :type on_token: callable or None
+    :param task: The original prompt repeated in the LLM merge, taken from ``build_prompt``
+        when not given.
+    :type task: str or None
+    :return: The (merged) response.
+    :rtype: str
+    """
+    budget = get_document_token_budget(build_prompt, context_length, route)
+    counter = get_token_counter(route)
+    if counter.count(document) <= budget:
+        return send_text_to_chatgpt(build_prompt(document), context_length=context_length, on_token=on_token, cancel_event=cancel_event, priority=priority, route=route)
+
+    chunks = split_into_chunks(document, budget, counter.count)
+    print(f"Document exceeds the model context ({budget} tokens available), processing it in {len(chunks)} parts.")
+
+    if app_settings.editable_settings["Use Local LLM"]:
+        max_workers = 1
+    else:
+        try:
+            max_workers = max(1, int(app_settings.editable_settings["Max Concurrent Chunks"]))
+        except (TypeError, ValueError):
+            max_workers = 4
+
+    start_time = time.perf_counter()
+    results = map_chunks(
+        chunks,
+        lambda chunk: send_text_to_chatgpt(build_prompt(chunk), context_length=context_length, cancel_event=cancel_event, priority=priority, route=route),
+        max_workers=max_workers,
+        cancel_event=cancel_event,
+    )
+    print(f"Processed {len(results)} parts in {time.perf_counter() - start_time:.1f}s")
+
+    if merge == MERGE_HL7_OBX:
+        return merge_hl7_obx(results)
+    if merge == MERGE_CONCATENATE or depth >= 2 or (cancel_event is not None and cancel_event.is_set()):
+        return merge_concatenate(results)
+
+    # The merge keeps the original prompt (note format, patient's sex, instructions), and
+    # is split again if the partial results do not fit together either
+    if task is None:
+        task = build_prompt("").strip()
+    return send_document_to_chatgpt(
+        lambda parts: build_merge_prompt(task, parts),
+        "\n\n".join(results),
+        merge=MERGE_LLM,
+        context_length=context_length,
+        on_token=on_token,
+        cancel_event=cancel_event,
+        priority=priority,
+        route=route,
+        depth=depth + 1,
+        task=task,
+    )
+
+def create_response_stream():
+    """
+    Create a token batcher that streams the note being generated into the response display.
+
+    :return: The batcher, or None if streaming is disabled.
+    :rtype: TokenBatcher or None
+    """
+    if not app_settings.editable_settings["Stream Responses"]:
+        return None
+
+    def on_flush(text, is_first):
+        response_display.scrolled_text.configure(state='normal')
+        if is_first:
+            # Replace the "Note Creation...Please Wait" placeholder
+            response_display.scrolled_text.delete("1.0", tk.END)
+            response_display.scrolled_text.configure(fg='black')
+        response_display.scrolled_text.insert(tk.END, text)
+        response_display.scrolled_text.see(tk.END)
+
+    return TokenBatcher(root, on_flush)
 
 
 def get_labs_from_response():
@@ -1005,7 +1518,7 @@ def get_labs_from_response():
     # Analyze plan using LLM in a separate thread
     def analyze_and_update():
         try:
-            suggested_labels = analyze_plan_for_labs(plan_text, send_text_to_chatgpt)
+            suggested_labels = analyze_plan_for_labs(plan_text, functools.partial(send_text_to_chatgpt, priority=PRIORITY_LAB, route=ROUTE_LAB_ANALYSIS))
             # Update panel on main thread - always call set_checkboxes (even if empty) to clear previous selections
             root.after(0, lambda: lab_selection_panel.set_checkboxes(suggested_labels))
             root.after(0, lambda: lab_selection_panel.show())
@@ -1016,103 +1529,158 @@ def get_labs_from_response():
     
     threading.Thread(target=analyze_and_update, daemon=True).start()
 
-def generate_note(formatted_message):
-            try:
-                prompt_type = selected_prompt.get()
-                sex = oscar.get_patients_sex()
-                # If note generation is on
-                if prompt_type == "Scribe":
-                    # If pre-processing is enabled
-                    if app_settings.editable_settings["Use Pre-Processing"]:
-                        #Generate Facts List
-                        list_of_facts = send_text_to_chatgpt(f"{app_settings.editable_settings['Pre-Processing']} {formatted_message}")
-                        
-                        #Make a note from the facts
-                        medical_note = send_text_to_chatgpt(f"{app_settings.AISCRIBE} {list_of_facts} {app_settings.AISCRIBE2}")
-
-                        # If post-processing is enabled check the note over
-                        if app_settings.editable_settings["Use Post-Processing"]:
-                            post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nFacts:{list_of_facts}\nNotes:{medical_note}")
-                            update_gui_with_response(post_processed_note)
-                        else:
-                            update_gui_with_response(medical_note)
-
-                    else: # If pre-processing is not enabled thhen just generate the note
-                        medical_note = send_text_to_chatgpt(f"{app_settings.AISCRIBE} {formatted_message} {app_settings.AISCRIBE2}")
-
-                        if app_settings.editable_settings["Use Post-Processing"]:
-                            post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nNotes:{medical_note}")
-                            update_gui_with_response(post_processed_note)
-                        else:
-                            update_gui_with_response(medical_note)
-                
-                
-                elif prompt_type == "None":
-                    ai_response = send_text_to_chatgpt(formatted_message)
-                    update_gui_with_response(ai_response)
-                
-                elif prompt_type in HL7_PROMPTS or prompt_type == "Auto":
-                    if not 'file_path' in globals():
-                        prompt = ai_prompts.get(prompt_type)
-                        ai_response = send_text_to_chatgpt(f"{prompt}\n{formatted_message}")
-                        update_gui_with_response(ai_response)
-                        return True
-
-                    # Set max context length to 8192
-                    context_length = 8192
-
-                    # Extract document type and patient name from file
-                    filename = os.path.basename(file_path)
-                    try:
-                        doc_type = detect_type(filename).upper()
-                        first_name, last_name, _ = extract_patient_name(filename)
-                        print(f"Document type: {doc_type}")
-                        print(f"Patient Name: {first_name} {last_name}")
-                    except Exception as e:
-                        print(f"An unknown error occurred while trying to extract document type and patient name: {e}")
-
-                    # Generate HL7 Header
-                    if first_name and last_name:
-                        res = find_details(app_settings.editable_settings['ReportMasterPath'], last_name, first_name)
-                        if res:
-                            sex, hin, dob, name, _ = res
-                            obs_date = extract_observation_date(ocr_text, doc_type)
-                            hl7_header = generate_header(name, hin, dob, sex, obs_date, obs_date)
-                        else:
-                            print("Unable to generate HL7 header, creating header template that needs to be filled in")
-                            hl7_header = generate_header("<PATIENT NAME>", "<HIN>", "<DOB>", "<SEX>", "<MESSAGE DATE>", "<OBSERVATION DATE>")
-                        
-                    else:
-                        print("Unable to generate HL7 header, creating header template that needs to be filled in")
-                        hl7_header = generate_header("<PATIENT NAME>", "<HIN>", "<DOB>", "<SEX>", "<MESSAGE DATE>", "<OBSERVATION DATE>")
-
-
-                    if prompt_type == "Auto":
-                        prompt = ai_prompts.get(doc_type)
-                        prompt_type = doc_type
-                    else: 
-                        prompt = ai_prompts.get(prompt_type)
-
-                    if "{prompt_addon}" in prompt:
-                        loinc_codes = loinc_code_detector(filename)
-                        print("Extra LOINC", loinc_codes)
-                        prompt = prompt.format(prompt_addon=extra_loinc_prompt(loinc_codes, EXTRA_LOINC_START_IDX.get(prompt_type, ""), prompt_type))
-                    
-                    if prompt_type == "LAB":
-                        print("Here")
-                        ai_response = generate_lab_hl7(formatted_message)
-                    else:
-                        ai_response = send_text_to_chatgpt(f"{prompt}\n\n{formatted_message}", context_length=context_length)
-                    update_gui_with_response(hl7_header + ai_response)
+def compose_note(formatted_message, prompt_type, on_token=None, cancel_event=None, list_of_facts=None, source_path=None, source_text=None):
+    """
+    Generate the note text for a transcript without touching the GUI.
+
+    :param formatted_message: The (scrubbed) transcript or document text.
+    :type formatted_message: str
+    :param prompt_type: The selected prompt, e.g. ``Scribe``, ``None`` or an HL7 prompt.
+    :type prompt_type: str
+    :param on_token: Optional callable receiving the final pass of the note as it streams in.
+    :type on_token: callable or None
+    :param cancel_event: Optional event, the note stops at the next request, token or chunk once it is set.
+    :type cancel_event: threading.Event or None
+    :param list_of_facts: Facts already extracted from the transcript while recording,
+        they replace the pre-processing pass of the Scribe note.
+    :type list_of_facts: str or None
+    :param source_path: File the text came from, used for the HL7 header and document
+        type. Defaults to the document opened in the main window.
+    :type source_path: str or None
+    :param source_text: Full text of ``source_path``, used for the observation date.
+        Defaults to the text of the document opened in the main window.
+    :type source_text: str or None
+    :return: The generated note.
+    :rtype: str
+    """
+    sex = oscar.get_patients_sex()
+    # If note generation is on
+    if prompt_type == "Scribe":
+        # If pre-processing is enabled
+        if app_settings.editable_settings["Use Pre-Processing"]:
+            #Generate Facts List, unless it was extracted while recording
+            if list_of_facts is None:
+                list_of_facts = send_document_to_chatgpt(
+                    lambda text: f"{app_settings.editable_settings['Pre-Processing']} {text}",
+                    formatted_message, merge=MERGE_CONCATENATE, cancel_event=cancel_event, route=prompt_type)
+
+            #Make a note from the facts, only streamed when it is the final pass
+            note_on_token = None if app_settings.editable_settings["Use Post-Processing"] else on_token
+            medical_note = send_document_to_chatgpt(
+                lambda text: f"{app_settings.AISCRIBE} {text} {app_settings.AISCRIBE2}",
+                list_of_facts, on_token=note_on_token, cancel_event=cancel_event, route=prompt_type)
+
+            # If post-processing is enabled check the note over
+            if app_settings.editable_settings["Use Post-Processing"]:
+                post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nFacts:{list_of_facts}\nNotes:{medical_note}", on_token=on_token, cancel_event=cancel_event, route=prompt_type)
+                return post_processed_note
+            else:
+                return medical_note
 
-                
-                else:
-                    prompt = ai_prompts.get(prompt_type)
-                    ai_response = send_text_to_chatgpt(f"{prompt}\nPATIENT'S SEX: {sex}\n\n{formatted_message}")
-                    update_gui_with_response(ai_response)
+        else: # If pre-processing is not enabled thhen just generate the note
+            note_on_token = None if app_settings.editable_settings["Use Post-Processing"] else on_token
+            medical_note = send_document_to_chatgpt(
+                lambda text: f"{app_settings.AISCRIBE} {text} {app_settings.AISCRIBE2}",
+                formatted_message, on_token=note_on_token, cancel_event=cancel_event, route=prompt_type)
+
+            if app_settings.editable_settings["Use Post-Processing"]:
+                post_processed_note = send_text_to_chatgpt(f"{app_settings.editable_settings['Post-Processing']}\nNotes:{medical_note}", on_token=on_token, cancel_event=cancel_event, route=prompt_type)
+                return post_processed_note
+            else:
+                return medical_note
+
+
+    elif prompt_type == "None":
+        ai_response = send_text_to_chatgpt(formatted_message, on_token=on_token, cancel_event=cancel_event, route=prompt_type)
+        return ai_response
+
+    elif prompt_type in HL7_PROMPTS or prompt_type == "Auto":
+        if source_path is None:
+            # Use the document opened in the main window
+            source_path = globals().get('file_path')
+            source_text = globals().get('ocr_text', "")
+
+        if not source_path:
+            prompt = ai_prompts.get(prompt_type)
+            ai_response = send_document_to_chatgpt(lambda text: f"{prompt}\n{text}", formatted_message, merge=MERGE_HL7_OBX, on_token=on_token, cancel_event=cancel_event, route=prompt_type)
+            return ai_response
+        
+        # Set max context length to 8192
+        context_length = 8192
 
+        # Extract document type and patient name from file
+        filename = os.path.basename(source_path)
+        first_name, last_name = None, None
+        try:
+            doc_type = detect_type(filename).upper()
+            first_name, last_name, _ = extract_patient_name(filename)
+            print(f"Document type: {doc_type}")
+            print(f"Patient Name: {first_name} {last_name}")
+        except Exception as e:
+            print(f"An unknown error occurred while trying to extract document type and patient name: {e}")
+
+        # Generate HL7 Header
+        if first_name and last_name:
+            res = find_details(app_settings.editable_settings['ReportMasterPath'], last_name, first_name)
+            if res:
+                sex, hin, dob, name, _ = res
+                obs_date = extract_observation_date(source_text or "", doc_type)
+                hl7_header = generate_header(name, hin, dob, sex, obs_date, obs_date)
+            else:
+                print("Unable to generate HL7 header, creating header template that needs to be filled in")
+                hl7_header = generate_header("<PATIENT NAME>", "<HIN>", "<DOB>", "<SEX>", "<MESSAGE DATE>", "<OBSERVATION DATE>")
+
+        else:
+            print("Unable to generate HL7 header, creating header template that needs to be filled in")
+            hl7_header = generate_header("<PATIENT NAME>", "<HIN>", "<DOB>", "<SEX>", "<MESSAGE DATE>", "<OBSERVATION DATE>")
+
+
+        if prompt_type == "Auto":
+            prompt = ai_prompts.get(doc_type)
+            prompt_type = doc_type
+        else: 
+            prompt = ai_prompts.get(prompt_type)
+
+        if "{prompt_addon}" in prompt:
+            loinc_codes = loinc_code_detector(filename)
+            print("Extra LOINC", loinc_codes)
+            prompt = prompt.format(prompt_addon=extra_loinc_prompt(loinc_codes, EXTRA_LOINC_START_IDX.get(prompt_type, ""), prompt_type))
+
+        if prompt_type == "LAB":
+            print("Here")
+            ai_response = generate_lab_hl7(formatted_message)
+        else:
+            ai_response = send_document_to_chatgpt(lambda text: f"{prompt}\n\n{text}", formatted_message, merge=MERGE_HL7_OBX, context_length=context_length, cancel_event=cancel_event, route=prompt_type)
+        return hl7_header + ai_response
+
+
+    else:
+        prompt = ai_prompts.get(prompt_type)
+        ai_response = send_document_to_chatgpt(lambda text: f"{prompt}\nPATIENT'S SEX: {sex}\n\n{text}", formatted_message, on_token=on_token, cancel_event=cancel_event, route=prompt_type)
+        return ai_response
+
+def generate_note(formatted_message, cancel_event=None, use_realtime_facts=True):
+            stream = create_response_stream()
+            try:
+                prompt_type = selected_prompt.get()
+                list_of_facts = None
+                if use_realtime_facts and prompt_type == "Scribe" and app_settings.editable_settings["Use Pre-Processing"]:
+                    list_of_facts = get_realtime_facts(user_message, cancel_event)
+                note = compose_note(formatted_message, prompt_type, on_token=stream.push if stream else None, cancel_event=cancel_event, list_of_facts=list_of_facts)
+                if stream:
+                    stream.close()
+                if cancel_event is not None and cancel_event.is_set():
+                    # Cancelled by the user, do not show a partial note
+                    return False
+                update_gui_with_response(note)
                 return True
+            except OperationCancelledError:
+                if stream:
+                    stream.close()
+                return False
             except Exception as e:
+                if stream:
+                    stream.close()
                 #Logg
                 #TODO: Implement proper logging to system event logger
                 print(f"An error occurred: {e}")
@@ -1124,45 +1692,54 @@ def show_edit_transcription_popup(formatted_message):
     if selected_prompt.get() == "OSCAR_FEEDBACK":
         # Use unscrubbed message for OSCAR_FEEDBACK
         cleaned_message = formatted_message
+        phi_spans = []
     else:
-        scrubber = scrubadub.Scrubber()
-
-        scrubbed_message = scrubadub.clean(formatted_message)
-
-        # Additional regex scrubbing 
-        cleaned_message = scrubbed_message
-        re_ohip_plain = re.compile(r'\b\d{10}\b')  # 10 digit OHIP
-        re_ohip_dashed = re.compile(r'\b(\d{4})-(\d{3})-(\d{3})(?:[- ]?[A-Za-z]{2})?\b')  # OHIP with dashes
-        re_postal = re.compile(r'\b[ABCEGHJ-NPRSTVXY]\d[ABCEGHJ-NPRSTV-Z][ -]?\d[ABCEGHJ-NPRSTV-Z]\d\b', re.IGNORECASE)  # Canadian postal codes
-        re_address = re.compile(r'\b\d+ [A-Z][a-z]+ (Street|St|Avenue|Ave|Road|Rd|Drive|Dr)\b', re.IGNORECASE)  # Street addresses
+        # A realtime transcript was scrubbed while it was recorded, unless it was edited since
+        scrub_result = realtime_scrubber.result(formatted_message) if realtime_scrubber is not None else None
+        if scrub_result is None:
+            scrub_result = get_phi_scrubber().scrub(formatted_message)
+        cleaned_message = scrub_result.text
+        phi_spans = scrub_result.spans
+
+    if not needs_phi_review():
+        generate_note_thread(cleaned_message)
+        return
 
-        scrub_patterns = [
-            (re_ohip_plain, '{{OHIP}}'),
-            (re_ohip_dashed, '{{OHIP}}'),
-            (re_postal, '{{POSTAL_CODE}}'),
-            (re_address, '{{ADDRESS}}'),
-        ]
+    def on_proceed(edited_text):
+        generate_note_thread(edited_text, use_realtime_facts=edited_text == cleaned_message.strip())
 
-        for regex, replacement in scrub_patterns:
-            cleaned_message = regex.sub(replacement, cleaned_message)
+    show_phi_review_popup(cleaned_message, phi_spans, on_proceed, oscar_feedback=selected_prompt.get() == "OSCAR_FEEDBACK")
 
-    if (app_settings.editable_settings["Use Local LLM"] or is_private_ip(app_settings.editable_settings["Model Endpoint"])) and not app_settings.editable_settings["Show Scrub PHI"]:
-        generate_note_thread(cleaned_message)
-        return
-    
+def show_phi_review_popup(cleaned_message, phi_spans, on_proceed, oscar_feedback=False):
+    """
+    Show the scrubbed text for review before it is sent.
+
+    :param cleaned_message: The scrubbed text.
+    :type cleaned_message: str
+    :param phi_spans: Replaced spans to highlight.
+    :type phi_spans: list
+    :param on_proceed: Called with the reviewed text when Proceed is clicked.
+    :type on_proceed: callable
+    :param oscar_feedback: True if the text is sent as OSCAR patient notes.
+    :type oscar_feedback: bool
+    """
     popup = tk.Toplevel(root)
-    popup.title("Send Patient Notes" if selected_prompt.get() == "OSCAR_FEEDBACK" else "Scrub PHI Prior to GPT")
+    popup.title("Send Patient Notes" if oscar_feedback else "Scrub PHI Prior to GPT")
     popup.iconbitmap(get_file_path('assets','logo.ico'))
     text_area = scrolledtext.ScrolledText(popup, height=20, width=80)
     text_area.pack(padx=10, pady=10)
     text_area.insert(tk.END, cleaned_message)
+    # Highlight what was replaced so it can be reviewed
+    text_area.tag_configure("phi", background="#fff2a8")
+    for span in phi_spans:
+        text_area.tag_add("phi", f"1.0+{span.out_start}c", f"1.0+{span.out_end}c")
 
-    def on_proceed():
+    def proceed():
         edited_text = text_area.get("1.0", tk.END).strip()
         popup.destroy()
-        generate_note_thread(edited_text)        
+        on_proceed(edited_text)
 
-    proceed_button = tk.Button(popup, text="Send Patient Notes" if selected_prompt.get() == "OSCAR_FEEDBACK" else "Proceed", command=on_proceed)
+    proceed_button = tk.Button(popup, text="Send Patient Notes" if oscar_feedback else "Proceed", command=proceed)
     proceed_button.pack(side=tk.RIGHT, padx=10, pady=10)
 
     # Cancel button
@@ -1171,37 +1748,26 @@ def show_edit_transcription_popup(formatted_message):
 
 
 
-def generate_note_thread(text: str):
+def generate_note_thread(text: str, use_realtime_facts=True):
     """
     Generate a note from the given text and update the GUI with the response.
 
     :param text: The text to generate a note from.
     :type text: str
+    :param use_realtime_facts: False if the text was edited after scrubbing, so the facts
+        extracted while recording no longer match it.
+    :type use_realtime_facts: bool
     """
-    global GENERATION_THREAD_ID
+    global GENERATION_CANCEL_TOKEN
 
-    thread = threading.Thread(target=generate_note, args=(text,))
+    # Stops a queued request, local generation at the next token and remote requests
+    # right away, the thread then exits by itself
+    cancel_token = CancellationToken()
+    GENERATION_CANCEL_TOKEN = cancel_token
+    thread = threading.Thread(target=generate_note, args=(text, cancel_token, use_realtime_facts))
     thread.start()
 
-    GENERATION_THREAD_ID = thread.ident
-
-    def cancel_note_generation(thread_id):
-        """Cancels any ongoing note generation.
-        
-        Sets the global flag to stop note generation operations.
-        """
-        global GENERATION_THREAD_ID
-
-        try:
-            kill_thread(thread_id)
-        except Exception as e:
-            # Log the error message
-            # TODO implment system logger
-            print(f"An error occurred: {e}")
-        finally:
-            GENERATION_THREAD_ID = None
-
-    loading_window = LoadingWindow(root, "Generating Note.", "Generating Note. Please wait.", on_cancel=lambda: cancel_note_generation(GENERATION_THREAD_ID))
+    loading_window = LoadingWindow(root, "Generating Note.", "Generating Note. Please wait.", on_cancel=cancel_token.cancel)
     
 
     def check_thread_status(thread, loading_window):
@@ -1213,13 +1779,165 @@ def generate_note_thread(text: str):
     root.after(500, lambda: check_thread_status(thread, loading_window))
 
 def upload_file():
-    global uploaded_file_path
-    file_path = filedialog.askopenfilename(filetypes=(("Audio files", "*.wav *.mp3"),))
-    if file_path:
-        uploaded_file_path = file_path
-        threaded_send_audio_to_server()  # Add this line to process the file immediately
+    file_paths = filedialog.askopenfilenames(filetypes=(("Audio files", AUDIO_FILE_TYPES),))
+    if len(file_paths) > 1:
+        start_batch_transcription(list(file_paths))
+        return
+    if file_paths:
+        threaded_send_audio_to_server(file_paths[0])  # Add this line to process the file immediately
     start_flashing()
 
+def upload_recordings_folder(event=None):
+    """Ask for a folder and transcribe every audio file in it as a batch."""
+    folder = filedialog.askdirectory()
+    if not folder:
+        return
+
+    extensions = tuple(pattern.lstrip("*") for pattern in AUDIO_FILE_TYPES.split())
+    file_paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(extensions)
+    )
+    if not file_paths:
+        messagebox.showinfo("Batch Transcription", "No audio files found in the selected folder.")
+        return
+
+    start_batch_transcription(file_paths)
+
+def start_batch_transcription(file_paths):
+    """
+    Transcribe several recordings and generate a note for each on a bounded worker pool.
+
+    Every finished file is added to the response history with its own transcript and note.
+
+    :param file_paths: Paths of the audio files to process.
+    :type file_paths: list[str]
+    """
+    # A batch has no Scrub PHI popup, so its transcripts may only go where they need no review
+    if needs_phi_review():
+        messagebox.showwarning(
+            "Batch Transcription",
+            "Batch transcription sends transcripts without the Scrub PHI review. It needs the local LLM "
+            "or endpoints on a private network, with Show Scrub PHI turned off."
+        )
+        return
+
+    # Read the prompt once so every file in the batch uses the same one
+    prompt_type = selected_prompt.get()
+
+    def make_note(transcript, path):
+        # OSCAR_FEEDBACK is sent unscrubbed, same as a single upload
+        message = transcript if prompt_type == "OSCAR_FEEDBACK" else scrub_phi(transcript, cancel_token=batch_queue.cancel_event)
+        # HL7 prompts take their header from this recording, not the document open in the main window
+        return compose_note(message, prompt_type, cancel_event=batch_queue.cancel_event, source_path=path, source_text=transcript)
+
+    def on_update(job):
+        batch_window.update_job(job)
+        # Recorded here rather than by the window so files finishing after it is closed are kept
+        if job.status == STATUS_DONE:
+            transcript, note = job.transcript, job.note
+            root.after(0, lambda: add_to_response_history(transcript, note))
+
+    if app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value] and app_settings.editable_settings["Use Local LLM"]:
+        # Everything runs on the local models, which process one request at a time
+        max_workers = 1
+    else:
+        try:
+            max_workers = int(app_settings.editable_settings["Batch Transcription Workers"])
+        except (TypeError, ValueError):
+            max_workers = 2
+
+    print(f"Starting batch transcription of {len(file_paths)} file(s) with {max_workers} worker(s).")
+
+    batch_queue = BatchTranscriptionQueue(
+        lambda path: transcribe_audio_file(path, cancel_event=batch_queue.cancel_event),
+        make_note,
+        on_update=on_update,
+        max_workers=max_workers,
+    )
+    batch_window = BatchTranscriptionWindow(root, batch_queue)
+    batch_window.add_jobs(batch_queue.start(file_paths))
+
+def open_note_fanout(event=None):
+    """
+    Generate several notes from the transcript in the input box at the same time.
+
+    Remote notes are generated concurrently, up to Max Concurrent Notes at a time. The
+    local model processes one request at a time, so its notes are generated one after
+    the other. Every finished note is added to the response history.
+    """
+    transcript = user_input.scrolled_text.get("1.0", tk.END).strip()
+    if not transcript:
+        messagebox.showinfo("Generate Multiple Notes", "There is no transcript to generate notes from.")
+        return
+
+    # Endpoints that need the Scrub PHI review get the transcript reviewed once, and every
+    # note is generated from the reviewed text
+    if needs_phi_review():
+        scrub_result = get_phi_scrubber().scrub(transcript)
+        show_phi_review_popup(scrub_result.text, scrub_result.spans, lambda reviewed: open_note_fanout_window(transcript, reviewed))
+        return
+
+    open_note_fanout_window(transcript)
+
+def open_note_fanout_window(transcript, reviewed=None):
+    """
+    Open the window that generates several notes from one transcript.
+
+    :param transcript: The transcript from the input box.
+    :type transcript: str
+    :param reviewed: The transcript after the Scrub PHI review, sent as is to every prompt.
+        None if no review was needed, the transcript is then scrubbed here.
+    :type reviewed: str or None
+    """
+    scrub_lock = threading.Lock()
+    scrubbed = []
+
+    def get_message(prompt_type, cancel_event):
+        # OSCAR_FEEDBACK is sent unscrubbed, same as a single note
+        if prompt_type == "OSCAR_FEEDBACK":
+            source = transcript if reviewed is None else reviewed
+            try:
+                return extract_patient_notes(source)
+            except Exception:
+                return source
+        if reviewed is not None:
+            return reviewed
+        # Scrub once for all the other prompts
+        with scrub_lock:
+            if not scrubbed:
+                scrubbed.append(scrub_phi(transcript, cancel_token=cancel_event))
+            return scrubbed[0]
+
+    def generate(prompt_type, on_token, cancel_event):
+        return compose_note(get_message(prompt_type, cancel_event), prompt_type, on_token=on_token, cancel_event=cancel_event)
+
+    def create_fanout(prompt_types):
+        if app_settings.editable_settings["Use Local LLM"]:
+            # Queued in the scheduler one after the other anyway
+            max_workers = 1
+        else:
+            try:
+                max_workers = int(app_settings.editable_settings["Max Concurrent Notes"])
+            except (TypeError, ValueError):
+                max_workers = 4
+
+        print(f"Generating {len(prompt_types)} note(s) with {max_workers} worker(s).")
+        stream = app_settings.editable_settings["Stream Responses"]
+        return NoteFanout(
+            generate,
+            on_update=lambda output: fanout_window.update_output(output),
+            on_token=(lambda output, text: fanout_window.push_token(output, text)) if stream else None,
+            max_workers=max_workers,
+        )
+
+    fanout_window = NoteFanoutWindow(
+        root,
+        ["Auto", "None", "Scribe"] + ai_prompts.list_prompts(),
+        create_fanout,
+        on_output_done=lambda output: add_to_response_history(transcript, output.note),
+    )
+
 
 
 def start_flashing():
@@ -1435,7 +2153,7 @@ def toggle_auto_process():
     global stop_auto_processing, auto_processor
 
     if current_view == "auto":
-        # Stop auto processing after current file completes
+        # Stop auto processing, the current file stops at its next cancellation check
         stop_auto_processing = True
         if auto_processor:
             auto_processor.stop()
@@ -1495,7 +2213,7 @@ def start_auto_processing_thread():
     """
     global auto_process_thread, auto_processor
     
-    auto_processor = AutoProcessor(app_settings, send_text_to_chatgpt, ai_prompts, append_log)
+    auto_processor = AutoProcessor(app_settings, functools.partial(send_text_to_chatgpt, priority=PRIORITY_AUTO), ai_prompts, append_log)
     
     auto_process_thread = threading.Thread(
         target=auto_processor.run, 
@@ -1535,18 +2253,22 @@ def load_stt_model(event=None):
 def _load_stt_model_thread():
     global stt_local_model
     
-    if not WHISPER_AVAILABLE:
-        messagebox.showerror("Error", "openai-whisper is not installed. Cannot use Local Whisper. Please install it or use Remote Whisper.")
+    try:
+        backend = create_stt_backend(app_settings)
+    except Exception as e:
+        messagebox.showerror("Error", f"An error occurred while loading the STT model: {e}")
         return
     
-    model = app_settings.editable_settings["Whisper Model"].strip()
     # Create a loading window to display the loading message
     stt_loading_window = LoadingWindow(root, "Speech to Text", "Loading Speech to Text. Please wait.")
-    print(f"Loading STT model: {model}")
+    print(f"Loading STT model: {backend.describe()}")
     try:
-        # Load the specified Whisper model
-        stt_local_model = whisper.load_model(model)
-        print("STT model loaded successfully.")
+        # Load the model once, it is reused for every chunk and file
+        load_start = time.perf_counter()
+        backend.load()
+        print(f"STT model loaded successfully in {time.perf_counter() - load_start:.1f}s.")
+
+        stt_local_model = backend
     except Exception as e:
         # Log the error message
         print(f"An error occurred while loading STT: {e}")
@@ -1860,9 +2582,9 @@ root.minsize(900, 400)
 
 
 
-#Wait for the UI root to be intialized then load the model. If using local llm.
+# Preload the local model in the background so the window stays usable while it loads
 if app_settings.editable_settings["Use Local LLM"]:
-    root.after(100, lambda:(ModelManager.setup_model(app_settings=app_settings, root=root)))  
+    ModelManager.preload_model(app_settings)
 
 if app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value]:
     # Inform the user that Local Whisper is being used for transcription
@@ -1870,10 +2592,14 @@ if app_settings.editable_settings[SettingsKeys.LOCAL_WHISPER.value]:
     root.after(100, lambda: (load_stt_model()))
 
 root.bind("<<LoadSttModel>>", load_stt_model)
+root.bind("<<BatchUploadFolder>>", upload_recordings_folder)
+root.bind("<<GenerateMultipleNotes>>", open_note_fanout)
 
 # Uncomment to start app in auto process mode rather than client mode
 #toggle_auto_process()
 
 root.mainloop()
 
-p.terminate()
+audio_bus.close()
+response_cache.close()
+llm_scheduler.shutdown()
@@ -425,13 +425,25 @@ def upload_file():
         threaded_send_audio_to_server()  # Add this line to process the file immediately
     start_flashing()
 
+# Loaded WhisperModel, reused across transcriptions until the model setting changes
+whisper_model = None
+whisper_model_name = None
+
+def get_whisper_model():
+    global whisper_model, whisper_model_name
+    model_name = editable_settings["Whisper Model"].strip()
+    if whisper_model is None or whisper_model_name != model_name:
+        # model = WhisperModel(model_size, device="cuda", compute_type="float16")
+        # model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
+        whisper_model = WhisperModel(model_name, device="cpu", compute_type="int8")
+        whisper_model_name = model_name
+    return whisper_model
+
 def send_audio_to_server():
     global uploaded_file_path
     if editable_settings["Local Whisper"] == "True":
         print("Using Local Whisper for transcription.")
-        # model = WhisperModel(model_size, device="cuda", compute_type="float16")
-        # model = WhisperModel(model_size, device="cuda", compute_type="int8_float16")
-        model = WhisperModel(editable_settings["Whisper Model"].strip(), device="cpu", compute_type="int8")
+        model = get_whisper_model()
         file_to_send = uploaded_file_path if uploaded_file_path else 'recording.wav'
         uploaded_file_path = None
         segments, info = model.transcribe(file_to_send, beam_size=5)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The client modules import each other as top level packages (utils, UI), like when
+# client.py is run from its folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,68 @@
+"""
+Tests for utils/audio_ingest.py.
+
+WAV files decoded without ffmpeg are downsampled to 16 kHz. Tones above the new 8 kHz
+Nyquist frequency must be filtered out rather than aliased into the speech band, and
+the result must not depend on where the file is cut into chunks.
+"""
+
+import wave
+
+import numpy as np
+import pytest
+
+from utils.audio_ingest import TARGET_RATE, _iter_wav
+
+
+SOURCE_RATE = 48000
+
+
+def write_tone(path, frequency, seconds=1.0, rate=SOURCE_RATE):
+    t = np.arange(int(rate * seconds)) / rate
+    samples = (np.sin(2 * np.pi * frequency * t) * 16000).astype(np.int16)
+    with wave.open(str(path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.tobytes())
+
+
+def decode(path, chunk_frames=TARGET_RATE):
+    return np.concatenate(list(_iter_wav(str(path), chunk_frames))).astype(np.float32)
+
+
+def rms(samples):
+    # Skip the edges, where the filter starts from silence
+    middle = samples[len(samples) // 10:-len(samples) // 10]
+    return float(np.sqrt(np.mean(middle ** 2)))
+
+
+def test_speech_band_tone_is_kept(tmp_path):
+    path = tmp_path / "tone.wav"
+    write_tone(path, 1000)
+
+    output = decode(path)
+
+    assert len(output) == pytest.approx(TARGET_RATE, abs=2)
+    assert rms(output) == pytest.approx(16000 / np.sqrt(2), rel=0.02)
+
+
+def test_tone_above_nyquist_is_not_aliased(tmp_path):
+    path = tmp_path / "tone.wav"
+    # Would fold back to 4 kHz without the low-pass filter
+    write_tone(path, 12000)
+
+    output = decode(path)
+
+    assert rms(output) < 16000 / np.sqrt(2) * 0.01
+
+
+def test_chunking_does_not_change_the_output(tmp_path):
+    path = tmp_path / "tone.wav"
+    write_tone(path, 3000)
+
+    whole = decode(path, chunk_frames=10 * TARGET_RATE)
+    chunked = decode(path, chunk_frames=997)
+
+    assert len(whole) == len(chunked)
+    assert np.max(np.abs(whole - chunked)) <= 1
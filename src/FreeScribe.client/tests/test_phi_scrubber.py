@@ -0,0 +1,66 @@
+"""
+Tests for utils/phi_scrubber.py.
+
+Incremental scrubbing of a realtime transcript must give exactly the same text and
+spans as one full scrub of the finished transcript, wherever the segments are cut.
+"""
+
+import pytest
+
+from utils.phi_scrubber import IncrementalScrubber, get_phi_scrubber
+
+
+SENTENCES = [
+    "The patient reports a dry cough for the last two weeks and mild fever at night.",
+    "Her OHIP number is 1234567890 and she lives at 42 Maple Street in Ottawa.",
+    "You can reach her at 613-555-0199 or by email at jane.doe@example.com.",
+    "She has no known drug allergies and takes metformin 500 mg twice a day.",
+    "The postal code on file is K1A 0B1, the card reads 1234-567-890-AB.",
+    "Blood pressure was 128 over 82, heart rate 76, oxygen saturation 98 percent.",
+]
+
+# About three minutes of speech
+TRANSCRIPT = " ".join(SENTENCES[i % len(SENTENCES)] for i in range(32))
+
+
+def scrub_incrementally(segments, scrubber):
+    """Scrub segments joined the way the realtime transcript box joins them, one per line."""
+    incremental = IncrementalScrubber(scrubber)
+    for segment in segments:
+        incremental.add_text(segment + "\n")
+    transcript = "".join(segment + "\n" for segment in segments).strip()
+    return transcript, incremental.result(transcript)
+
+
+def span_tuples(result):
+    return [(s.start, s.end, s.kind, s.out_start, s.out_end) for s in result.spans]
+
+
+FIXTURES = [
+    ("sentences", [sentence.strip() + "." for sentence in TRANSCRIPT.split(".") if sentence.strip()]),
+    # Cut every few characters too, so PHI is split across segments
+    *[(f"every {size} characters", [TRANSCRIPT[i:i + size] for i in range(0, len(TRANSCRIPT), size)]) for size in (7, 23, 64, 150)],
+    ("phone split over segments", ["call me at 613", "555 0199 after", "five, postal K1A", "0B1 thanks"]),
+    ("no PHI", ["The patient is well.", "Follow up in two weeks."]),
+    ("leading spaces", ["  OHIP 1234567890", "  lives at 12 King St"]),
+]
+
+
+@pytest.mark.parametrize("segments", [segments for _, segments in FIXTURES], ids=[name for name, _ in FIXTURES])
+def test_incremental_scrub_matches_full_scrub(segments):
+    scrubber = get_phi_scrubber()
+    transcript, actual = scrub_incrementally(segments, scrubber)
+    expected = scrubber.scrub(transcript)
+
+    assert actual.text == expected.text
+    assert span_tuples(actual) == span_tuples(expected)
+
+
+def test_scrub_replaces_phi():
+    cleaned = get_phi_scrubber().clean("OHIP 1234567890, postal code K1A 0B1, 42 Maple Street.")
+
+    assert "1234567890" not in cleaned
+    assert "K1A 0B1" not in cleaned
+    assert "Maple Street" not in cleaned
+    assert "{{OHIP}}" in cleaned
+    assert "{{POSTAL_CODE}}" in cleaned
@@ -0,0 +1,312 @@
+"""
+async_http.py
+
+HTTP client for the LLM and speech to text servers, with timeouts and cancellation.
+
+Requests run on a single asyncio event loop thread with ``httpx.AsyncClient``. Worker
+threads call the blocking wrappers below, which wait for the request while watching a
+cancel event. Setting the event cancels the request task: httpx closes the connection
+immediately, the server sees the client disconnect and stops generating, and the
+waiting thread gets ``RequestCancelledError`` instead of blocking in a socket read.
+
+Every request has a connect and a read timeout, the read timeout being the longest
+wait for the next bytes from the server.
+"""
+
+import asyncio
+import json
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import httpx
+
+from utils.cancellation import OperationCancelledError
+
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0
+
+MAX_CONNECTIONS = 20
+# How often a waiting thread checks its cancel event
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class RequestCancelledError(OperationCancelledError):
+    """Raised in the calling thread when its request was cancelled."""
+
+
+def make_timeout(connect=DEFAULT_CONNECT_TIMEOUT, read=DEFAULT_READ_TIMEOUT):
+    """
+    Build request timeouts.
+
+    :param connect: Seconds to establish the connection.
+    :type connect: float
+    :param read: Seconds to wait for the next bytes of the response, None for no limit.
+    :type read: float or None
+    :rtype: httpx.Timeout
+    """
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+
+class StreamingResponse:
+    """
+    A response whose body is read incrementally, returned by ``AsyncHTTPClient.stream``.
+
+    Use as a context manager, leaving it closes the connection if the body was not read
+    to the end.
+
+    Attributes:
+        status_code: HTTP status code
+        headers: Response headers
+    """
+
+    def __init__(self, client, context, response, cancel_event):
+        self.client = client
+        self.context = context
+        self.response = response
+        self.cancel_event = cancel_event
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.closed = False
+
+    def raise_for_status(self):
+        """Raise ``httpx.HTTPStatusError`` for 4xx and 5xx responses."""
+        if self.status_code >= 400:
+            self.client._run(self.response.aread(), self.cancel_event)
+        self.response.raise_for_status()
+
+    def iter_lines(self, decode_unicode=True):
+        """
+        Yield the lines of the body as they arrive.
+
+        :param decode_unicode: Accepted for compatibility with ``requests``, lines are always text.
+        :type decode_unicode: bool
+        :raises RequestCancelledError: If the cancel event is set while waiting for a line.
+        """
+        lines = self.response.aiter_lines()
+        while True:
+            try:
+                yield self.client._run(lines.__anext__(), self.cancel_event)
+            except StopAsyncIteration:
+                return
+            except RequestCancelledError:
+                with self.client.stats_lock:
+                    self.client.cancelled += 1
+                raise
+
+    def json(self):
+        """Read the rest of the body and parse it as JSON."""
+        return json.loads(self.client._run(self.response.aread(), self.cancel_event))
+
+    def close(self):
+        """Close the response, releasing the connection."""
+        if not self.closed:
+            self.closed = True
+            try:
+                self.client._run(self.context.__aexit__(None, None, None))
+            except Exception as e:
+                # The connection is dropped either way
+                print(f"Error closing HTTP stream ({e.__class__.__name__}): {str(e)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncHTTPClient:
+    """
+    Runs HTTP requests on a dedicated event loop thread.
+
+    One ``httpx.AsyncClient`` is kept per certificate verification setting so
+    connections to the servers are reused.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.clients = {}
+        self.lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+
+    def _ensure_loop(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="http-event-loop", daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def _get_client(self, verify):
+        # Only called on the event loop thread, so no lock is needed
+        client = self.clients.get(verify)
+        if client is None:
+            client = httpx.AsyncClient(
+                verify=verify,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS),
+            )
+            self.clients[verify] = client
+        return client
+
+    def _run(self, coroutine, cancel_event=None, on_discard=None):
+        """
+        Run a coroutine on the event loop and wait for its result.
+
+        The coroutine is cancelled if ``cancel_event`` is set or the waiting thread is
+        interrupted, so no request outlives its caller. If it finished just before it
+        could be cancelled, its result is passed to ``on_discard`` for clean up.
+
+        The event is checked before every wait and after every result, not only when a
+        wait times out, so a stream that keeps delivering lines faster than the poll
+        interval still stops at the next line.
+        """
+        def cancelled():
+            return cancel_event is not None and cancel_event.is_set()
+
+        if cancelled():
+            coroutine.close()
+            raise RequestCancelledError("The request was cancelled.")
+
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop())
+        try:
+            while not cancelled():
+                try:
+                    result = future.result(timeout=CANCEL_POLL_INTERVAL)
+                except FutureTimeoutError:
+                    continue
+                if not cancelled():
+                    return result
+                break
+            raise RequestCancelledError("The request was cancelled.")
+        except BaseException:
+            if not future.cancel() and on_discard is not None and future.done() and future.exception() is None:
+                on_discard(future.result())
+            raise
+
+    def _track(self, fn):
+        """Count a request in the statistics while it runs."""
+        with self.stats_lock:
+            self.in_flight += 1
+        try:
+            result = fn()
+        except RequestCancelledError:
+            with self.stats_lock:
+                self.cancelled += 1
+            raise
+        except httpx.TimeoutException:
+            with self.stats_lock:
+                self.timed_out += 1
+            raise
+        except BaseException:
+            with self.stats_lock:
+                self.failed += 1
+            raise
+        else:
+            with self.stats_lock:
+                self.completed += 1
+            return result
+        finally:
+            with self.stats_lock:
+                self.in_flight -= 1
+
+    def request(self, method, url, verify=True, timeout=None, cancel_event=None, **kwargs):
+        """
+        Send a request and read the whole response.
+
+        :param method: HTTP method, e.g. ``POST``.
+        :type method: str
+        :param url: The URL.
+        :type url: str
+        :param verify: Verify the server certificate.
+        :type verify: bool
+        :param timeout: Timeouts from ``make_timeout``, defaults to the module defaults.
+        :type timeout: httpx.Timeout or None
+        :param cancel_event: Optional event, the request is aborted once it is set.
+        :type cancel_event: threading.Event or None
+        :param kwargs: Passed to ``httpx.AsyncClient.request``, e.g. ``headers``, ``json``, ``files``.
+        :return: The response, with the body read.
+        :rtype: httpx.Response
+        :raises RequestCancelledError: If the request was cancelled.
+        :raises httpx.TimeoutException: If connecting or reading timed out.
+        :raises httpx.TransportError: If the connection failed.
+        """
+        timeout = timeout or make_timeout()
+
+        async def send():
+            return await self._get_client(verify).request(method, url, timeout=timeout, **kwargs)
+
+        return self._track(lambda: self._run(send(), cancel_event))
+
+    def stream(self, method, url, verify=True, timeout=None, cancel_event=None, **kwargs):
+        """
+        Send a request and return once the response headers arrived.
+
+        :param method: HTTP method, e.g. ``POST``.
+        :type method: str
+        :param url: The URL.
+        :type url: str
+        :param verify: Verify the server certificate.
+        :type verify: bool
+        :param timeout: Timeouts from ``make_timeout``, defaults to the module defaults.
+        :type timeout: httpx.Timeout or None
+        :param cancel_event: Optional event, the request is aborted once it is set, also
+            while the body is being read.
+        :type cancel_event: threading.Event or None
+        :param kwargs: Passed to ``httpx.AsyncClient.stream``.
+        :rtype: StreamingResponse
+        :raises RequestCancelledError: If the request was cancelled.
+        :raises httpx.TimeoutException: If connecting or reading timed out.
+        :raises httpx.TransportError: If the connection failed.
+        """
+        timeout = timeout or make_timeout()
+
+        async def open_stream():
+            # A cancelled __aenter__ closes its own response
+            context = self._get_client(verify).stream(method, url, timeout=timeout, **kwargs)
+            return context, await context.__aenter__()
+
+        def release(opened):
+            # Opened just before the caller gave up, close it without waiting
+            asyncio.run_coroutine_threadsafe(opened[0].__aexit__(None, None, None), self.loop)
+
+        context, response = self._track(lambda: self._run(open_stream(), cancel_event, on_discard=release))
+        return StreamingResponse(self, context, response, cancel_event)
+
+    def get_stats(self):
+        """
+        Get request statistics for the debug window.
+
+        :rtype: dict
+        """
+        with self.stats_lock:
+            return {
+                "in flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timed out": self.timed_out,
+                "cancelled": self.cancelled,
+            }
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Get the shared HTTP client.
+
+    :rtype: AsyncHTTPClient
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = AsyncHTTPClient()
+        return _http_client
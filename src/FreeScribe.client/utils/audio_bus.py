@@ -0,0 +1,272 @@
+"""
+audio_bus.py
+
+Shared microphone capture for the client.
+
+A single ``AudioBus`` owns the one PyAudio input stream on the selected microphone
+and fans every captured frame out to any number of subscribers (recorder, level
+meter, voice activity detection, realtime chunker). Each subscriber receives its
+own bounded queue, so a slow consumer can never stall the device read or the
+other consumers.
+"""
+
+import queue
+import threading
+import pyaudio
+from UI.Widgets.MicrophoneSelector import MicrophoneState
+
+
+CHUNK = 1024
+FORMAT = pyaudio.paInt16
+CHANNELS = 1
+RATE = 16000
+
+
+class AudioSubscription:
+    """
+    A subscriber's view onto the audio bus.
+
+    Frames are delivered through a bounded queue. When the queue is full the oldest
+    frame is discarded so the most recent audio is always available.
+
+    :param bus: The bus that owns this subscription.
+    :type bus: AudioBus
+    :param name: A descriptive name used in log messages.
+    :type name: str
+    :param maxsize: Maximum number of frames buffered for this subscriber.
+    :type maxsize: int
+    """
+
+    def __init__(self, bus, name, maxsize):
+        self.bus = bus
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped_frames = 0
+        self.error = None
+
+    def _publish(self, data):
+        """Push a frame onto the subscriber queue, dropping the oldest frame if full."""
+        while True:
+            try:
+                self.queue.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped_frames += 1
+                except queue.Empty:
+                    pass
+
+    def read(self, timeout=None):
+        """
+        Get the next frame for this subscriber.
+
+        :param timeout: Seconds to wait for a frame, None to block forever.
+        :type timeout: float or None
+        :return: Raw int16 PCM bytes, or None if no frame arrived before the timeout.
+        :rtype: bytes or None
+        :raises OSError: If the device stream failed, e.g. because the microphone was unplugged.
+        """
+        if self.error is not None:
+            raise OSError(f"Audio stream failed: {self.error}")
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            if self.error is not None:
+                raise OSError(f"Audio stream failed: {self.error}")
+            return None
+
+    def _fail(self, error):
+        """End the subscription after a stream failure, the next ``read()`` raises it."""
+        self.error = error
+        self.clear()
+
+    def clear(self):
+        """Discard any frames already buffered for this subscriber."""
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        """Stop receiving frames. The device stream closes once nobody is subscribed."""
+        self.bus.unsubscribe(self)
+
+
+class AudioBus:
+    """
+    Owns the single microphone input stream and publishes frames to subscribers.
+
+    The stream is opened when the first subscriber joins and closed when the last
+    one leaves, so the device is only held while something is listening.
+
+    Attributes:
+        shared_instance (AudioBus): Process wide bus used by the client and widgets.
+    """
+
+    shared_instance = None
+
+    def __init__(self, chunk=CHUNK, rate=RATE, audio_format=FORMAT, channels=CHANNELS):
+        self.chunk = chunk
+        self.rate = rate
+        self.format = audio_format
+        self.channels = channels
+        self.p = None
+        self.stream = None
+        self.device_index = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.reader_thread = None
+
+    @staticmethod
+    def shared():
+        """
+        Get the process wide audio bus, creating it on first use.
+
+        :return: The shared bus.
+        :rtype: AudioBus
+        """
+        if AudioBus.shared_instance is None:
+            AudioBus.shared_instance = AudioBus()
+        return AudioBus.shared_instance
+
+    def subscribe(self, name, maxsize=64):
+        """
+        Register a new subscriber and make sure the device stream is running.
+
+        :param name: A descriptive name used in log messages.
+        :type name: str
+        :param maxsize: Maximum number of frames buffered for this subscriber.
+        :type maxsize: int
+        :return: The new subscription.
+        :rtype: AudioSubscription
+        :raises OSError: If the microphone stream cannot be opened.
+        """
+        subscription = AudioSubscription(self, name, maxsize)
+        with self.lock:
+            wanted_device = MicrophoneState.SELECTED_MICROPHONE_INDEX
+            if self.running and wanted_device != self.device_index:
+                # The microphone changed since the stream was opened, reopen on the new device
+                self._stop_stream_locked()
+            if not self.running:
+                # Also reopens the stream after a read error
+                self._start_stream_locked(wanted_device)
+            self.subscribers.append(subscription)
+        print(f"Audio bus: '{name}' subscribed ({len(self.subscribers)} active)")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Remove a subscriber and close the device stream if it was the last one.
+
+        :param subscription: The subscription to remove.
+        :type subscription: AudioSubscription
+        """
+        with self.lock:
+            if subscription not in self.subscribers:
+                return
+            self.subscribers.remove(subscription)
+            if not self.subscribers:
+                self._stop_stream_locked()
+
+        if subscription.dropped_frames:
+            print(f"Audio bus: '{subscription.name}' dropped {subscription.dropped_frames} frame(s)")
+        print(f"Audio bus: '{subscription.name}' unsubscribed ({len(self.subscribers)} active)")
+
+    def get_sample_size(self):
+        """
+        Get the sample width in bytes for the bus audio format.
+
+        :rtype: int
+        """
+        return pyaudio.get_sample_size(self.format)
+
+    def _start_stream_locked(self, device_index):
+        """Open the device stream and start the reader thread. Caller holds the lock."""
+        if self.p is None:
+            self.p = pyaudio.PyAudio()
+
+        self.stream = self.p.open(
+            format=self.format,
+            channels=self.channels,
+            rate=self.rate,
+            input=True,
+            frames_per_buffer=self.chunk,
+            input_device_index=None if device_index is None else int(device_index))
+        self.device_index = device_index
+        self.running = True
+        self.reader_thread = threading.Thread(target=self._read_loop, args=(self.stream,), daemon=True)
+        self.reader_thread.start()
+
+    def _stop_stream_locked(self):
+        """Stop the reader thread and close the device stream. Caller holds the lock."""
+        self.running = False
+        stream = self.stream
+        self.stream = None
+        self.device_index = None
+
+        if self.reader_thread is not None and self.reader_thread is not threading.current_thread():
+            self.reader_thread.join(timeout=1.0)
+        self.reader_thread = None
+
+        if stream is not None:
+            try:
+                stream.stop_stream()
+                stream.close()
+            except OSError as e:
+                print(f"Audio bus: error closing stream: {e}")
+
+    def _read_loop(self, stream):
+        """Read frames from the device and publish them to every subscriber."""
+        while self.running and stream is self.stream:
+            try:
+                data = stream.read(self.chunk, exception_on_overflow=False)
+            except (OSError, IOError) as e:
+                print(f"Audio bus: error reading audio stream: {e}")
+                self._reset_failed_stream(stream, e)
+                break
+
+            # Copy the list so subscribers can come and go while we publish
+            for subscription in list(self.subscribers):
+                subscription._publish(data)
+
+    def _reset_failed_stream(self, stream, error):
+        """
+        Forget a stream that failed, e.g. because the microphone was unplugged.
+
+        The bus goes back to the stopped state so the next ``subscribe()`` reopens the
+        device. The current subscriptions are ended with the error, their ``read()``
+        raises it so the subscribers can stop instead of waiting for audio forever.
+        """
+        if stream is not self.stream:
+            # The stream was already replaced or stopped by someone else
+            return
+
+        with self.lock:
+            if stream is not self.stream:
+                return
+            self.running = False
+            self.stream = None
+            self.device_index = None
+            self.reader_thread = None
+            subscribers = self.subscribers
+            self.subscribers = []
+
+        for subscription in subscribers:
+            subscription._fail(error)
+
+        try:
+            stream.close()
+        except OSError as e:
+            print(f"Audio bus: error closing stream: {e}")
+
+    def close(self):
+        """Close the stream and release the PyAudio instance."""
+        with self.lock:
+            self.subscribers = []
+            self._stop_stream_locked()
+            if self.p is not None:
+                self.p.terminate()
+                self.p = None
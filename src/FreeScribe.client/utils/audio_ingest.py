@@ -0,0 +1,337 @@
+"""
+audio_ingest.py
+
+Client side decoding of uploaded recordings before transcription.
+
+Uploaded dictations are often 44.1/48 kHz stereo, compressed or not, while Whisper
+only ever works on 16 kHz mono. This module streams a file through a decoder into
+16 kHz mono int16 PCM in fixed size chunks, so memory stays bounded regardless of the
+recording length, and then either:
+
+- writes a compact FLAC (or 16 kHz mono WAV) file for the remote Speech2Text upload, or
+- returns the samples as a float32 array for the local Whisper backend.
+
+ffmpeg is used for decoding when it is on the PATH. Without it, WAV files are still
+handled natively with a streaming downmix, anti-aliasing low-pass filter and resampler.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import wave
+import numpy as np
+
+try:
+    import soundfile # optional, used to write FLAC uploads
+    SOUNDFILE_AVAILABLE = True
+except ImportError:
+    soundfile = None
+    SOUNDFILE_AVAILABLE = False
+
+
+TARGET_RATE = 16000
+CHUNK_SECONDS = 10
+CHUNK_FRAMES = TARGET_RATE * CHUNK_SECONDS
+# Anti-aliasing cutoff as a fraction of the target rate, below its Nyquist frequency of 0.5
+LOW_PASS_CUTOFF = 0.45
+AUDIO_FILE_TYPES = "*.wav *.mp3 *.m4a *.flac *.ogg *.webm"
+
+# Keep ffmpeg from flashing a console window in the packaged Windows client
+POPEN_CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+
+class AudioIngestError(Exception):
+    """Raised when an audio file cannot be decoded."""
+
+
+class IngestResult:
+    """
+    Result of preparing an audio file for upload.
+
+    :ivar path: Path of the file to upload.
+    :ivar original_bytes: Size of the source file in bytes.
+    :ivar output_bytes: Size of the file to upload in bytes.
+    :ivar duration: Audio duration in seconds.
+    :ivar is_temporary: True if ``path`` is a temporary file the caller must delete.
+    """
+
+    def __init__(self, path, original_bytes, output_bytes, duration, is_temporary):
+        self.path = path
+        self.original_bytes = original_bytes
+        self.output_bytes = output_bytes
+        self.duration = duration
+        self.is_temporary = is_temporary
+
+    @property
+    def bytes_saved(self):
+        return max(0, self.original_bytes - self.output_bytes)
+
+    def cleanup(self):
+        """Delete the prepared file if it is a temporary file."""
+        if self.is_temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _LowPassFilter:
+    """
+    Streaming windowed-sinc FIR low-pass filter.
+
+    Applied before downsampling, so content above the new Nyquist frequency is removed
+    instead of folding back into the speech band. Keeps the last input samples between
+    chunks and drops the filter delay, so the output lines up with the input.
+    """
+
+    def __init__(self, cutoff, rate, taps):
+        offsets = np.arange(taps) - (taps - 1) / 2
+        kernel = np.sinc(2 * cutoff / rate * offsets) * np.blackman(taps)
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.delay = (taps - 1) // 2
+
+    def process(self, samples):
+        buffer = np.concatenate([self.history, samples.astype(np.float32)])
+        output = np.convolve(buffer, self.kernel, mode="valid").astype(np.float32)
+        self.history = buffer[len(buffer) - len(self.history):]
+
+        if self.delay:
+            dropped = min(self.delay, len(output))
+            output = output[dropped:]
+            self.delay -= dropped
+        return output
+
+    def flush(self):
+        """Get the output still held back by the filter delay at the end of the input."""
+        return self.process(np.zeros(len(self.history) // 2, dtype=np.float32))
+
+
+class _LinearResampler:
+    """
+    Streaming linear interpolation resampler.
+
+    Keeps the fractional read position and the tail of the previous chunk so that
+    consecutive chunks resample exactly as if the whole signal was processed at once.
+    """
+
+    def __init__(self, in_rate, out_rate):
+        self.step = in_rate / out_rate
+        self.position = 0.0
+        self.carry = np.zeros(0, dtype=np.float32)
+
+    def process(self, samples):
+        buffer = np.concatenate([self.carry, samples.astype(np.float32)])
+        last_index = len(buffer) - 1
+        if last_index < 1 or self.position > last_index:
+            self.carry = buffer
+            return np.zeros(0, dtype=np.float32)
+
+        count = int(np.floor((last_index - self.position) / self.step)) + 1
+        indices = self.position + np.arange(count) * self.step
+        output = np.interp(indices, np.arange(len(buffer)), buffer).astype(np.float32)
+
+        next_position = self.position + count * self.step
+        keep_from = min(int(np.floor(next_position)), last_index)
+        self.carry = buffer[keep_from:]
+        self.position = next_position - keep_from
+        return output
+
+
+def _ffmpeg_path():
+    return shutil.which("ffmpeg")
+
+
+def _is_target_wav(path):
+    """Check if a file is already a 16 kHz mono 16-bit WAV."""
+    try:
+        with wave.open(path, 'rb') as wf:
+            return wf.getframerate() == TARGET_RATE and wf.getnchannels() == 1 and wf.getsampwidth() == 2
+    except (wave.Error, EOFError, OSError):
+        return False
+
+
+def _iter_ffmpeg(path, chunk_frames):
+    """Decode any ffmpeg readable file into 16 kHz mono int16 chunks."""
+    command = [
+        _ffmpeg_path(), "-nostdin", "-loglevel", "error",
+        "-i", path,
+        "-f", "s16le", "-ac", "1", "-ar", str(TARGET_RATE), "-",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=POPEN_CREATION_FLAGS)
+    try:
+        chunk_bytes = chunk_frames * 2
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            # Guard against an odd trailing byte
+            usable = len(data) - (len(data) % 2)
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.int16)
+        process.wait()
+        if process.returncode != 0:
+            error = process.stderr.read().decode(errors="replace").strip()
+            raise AudioIngestError(f"ffmpeg could not decode {os.path.basename(path)}: {error}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def _iter_wav(path, chunk_frames):
+    """Decode a PCM WAV file into 16 kHz mono int16 chunks without ffmpeg."""
+    try:
+        wf = wave.open(path, 'rb')
+    except (wave.Error, EOFError) as e:
+        raise AudioIngestError(f"Unsupported WAV file {os.path.basename(path)}: {e}")
+
+    with wf:
+        channels = wf.getnchannels()
+        sample_width = wf.getsampwidth()
+        rate = wf.getframerate()
+        dtypes = {1: np.uint8, 2: np.int16, 4: np.int32}
+        if sample_width not in dtypes:
+            raise AudioIngestError(f"Unsupported WAV sample width ({sample_width * 8} bit). Install ffmpeg to decode this file.")
+
+        resampler = _LinearResampler(rate, TARGET_RATE) if rate != TARGET_RATE else None
+        low_pass = None
+        if rate > TARGET_RATE:
+            # Cut off a little below the 8 kHz Nyquist frequency, sharper for higher source rates
+            taps = 2 * int(16 * rate / TARGET_RATE) + 1
+            low_pass = _LowPassFilter(LOW_PASS_CUTOFF * TARGET_RATE, rate, taps)
+        # Read enough source frames to produce roughly chunk_frames output frames
+        source_frames = max(1, int(chunk_frames * rate / TARGET_RATE))
+
+        while True:
+            data = wf.readframes(source_frames)
+            if data:
+                samples = np.frombuffer(data, dtype=dtypes[sample_width]).astype(np.float32)
+                if sample_width == 1:
+                    samples = (samples - 128.0) * 256.0
+                elif sample_width == 4:
+                    samples = samples / 65536.0
+
+                if channels > 1:
+                    samples = samples.reshape(-1, channels).mean(axis=1)
+
+                if low_pass is not None:
+                    samples = low_pass.process(samples)
+            elif low_pass is not None:
+                # The filter still holds back the end of the file
+                samples, low_pass = low_pass.flush(), None
+            else:
+                break
+
+            if resampler is not None:
+                samples = resampler.process(samples)
+
+            if samples.size:
+                yield np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+
+
+def iter_pcm_chunks(path, chunk_frames=CHUNK_FRAMES):
+    """
+    Stream an audio file as 16 kHz mono int16 chunks.
+
+    :param path: Path to the audio file.
+    :type path: str
+    :param chunk_frames: Approximate number of output samples per chunk.
+    :type chunk_frames: int
+    :return: Generator of int16 NumPy arrays.
+    :raises AudioIngestError: If the file cannot be decoded.
+    """
+    if _ffmpeg_path():
+        return _iter_ffmpeg(path, chunk_frames)
+    if path.lower().endswith(".wav"):
+        return _iter_wav(path, chunk_frames)
+    raise AudioIngestError(f"ffmpeg is required to decode {os.path.basename(path)}. Please install ffmpeg or upload a WAV file.")
+
+
+def load_audio_for_transcription(path):
+    """
+    Decode an audio file into the float32 16 kHz mono array the local Whisper backends expect.
+
+    Without ffmpeg only WAV files can be decoded here. Other formats are returned as the
+    path so the backend decodes them itself, faster-whisper can do that through PyAV.
+
+    :param path: Path to the audio file.
+    :type path: str
+    :return: Samples scaled to [-1, 1], or the path if the file cannot be decoded here.
+    :rtype: numpy.ndarray or str
+    """
+    if not _ffmpeg_path() and not path.lower().endswith(".wav"):
+        print(f"ffmpeg not found, leaving {os.path.basename(path)} for the speech to text backend to decode")
+        return path
+
+    chunks = list(iter_pcm_chunks(path))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks).astype(np.float32) / 32768.0
+
+
+def prepare_audio_upload(path):
+    """
+    Re-encode an audio file as compact 16 kHz mono for the remote Speech2Text server.
+
+    FLAC is used when the optional ``soundfile`` package is installed, otherwise a
+    16 kHz mono WAV. Files that are already 16 kHz mono WAV and cannot be made smaller
+    are uploaded as-is.
+
+    :param path: Path to the audio file.
+    :type path: str
+    :return: Description of the prepared file.
+    :rtype: IngestResult
+    """
+    original_bytes = os.path.getsize(path)
+
+    if _is_target_wav(path) and not SOUNDFILE_AVAILABLE:
+        with wave.open(path, 'rb') as wf:
+            duration = wf.getnframes() / TARGET_RATE
+        return IngestResult(path, original_bytes, original_bytes, duration, is_temporary=False)
+
+    suffix = ".flac" if SOUNDFILE_AVAILABLE else ".wav"
+    fd, output_path = tempfile.mkstemp(prefix="freescribe_upload_", suffix=suffix)
+    os.close(fd)
+
+    total_frames = 0
+    try:
+        if SOUNDFILE_AVAILABLE:
+            with soundfile.SoundFile(output_path, 'w', samplerate=TARGET_RATE, channels=1, format='FLAC', subtype='PCM_16') as out:
+                for chunk in iter_pcm_chunks(path):
+                    out.write(chunk)
+                    total_frames += len(chunk)
+        else:
+            with wave.open(output_path, 'wb') as out:
+                out.setnchannels(1)
+                out.setsampwidth(2)
+                out.setframerate(TARGET_RATE)
+                for chunk in iter_pcm_chunks(path):
+                    out.writeframes(chunk.tobytes())
+                    total_frames += len(chunk)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    output_bytes = os.path.getsize(output_path)
+    duration = total_frames / TARGET_RATE
+
+    # Never upload something bigger than the original
+    if output_bytes >= original_bytes:
+        os.remove(output_path)
+        return IngestResult(path, original_bytes, original_bytes, duration, is_temporary=False)
+
+    return IngestResult(output_path, original_bytes, output_bytes, duration, is_temporary=True)
+
+
+def format_bytes(size):
+    """
+    Format a byte count for log messages.
+
+    :rtype: str
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
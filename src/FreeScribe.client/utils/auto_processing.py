@@ -8,14 +8,14 @@ Supports two processing modes:
 """
 
 import os
-import time
 import re
 from datetime import datetime
 import shutil
 from utils.read_files import file_reader, extract_patient_name, detect_type, extract_patient_notes
 from utils.hl7 import find_details, extract_observation_date, generate_header, loinc_code_detector, extra_loinc_prompt, lab_detector, EXTRA_LOINC_START_IDX
 from utils.lab_processor import generate_lab_hl7
-import scrubadub
+from utils.cancellation import CancellationToken, OperationCancelledError
+from utils.phi_scrubber import get_phi_scrubber
 
 
 class AutoProcessor:
@@ -41,42 +41,35 @@ class AutoProcessor:
         self.ai_callback = ai_callback
         self.prompts = prompts
         self.log_callback = log_callback or print
-        self.stop_processing = False
+        self.cancel_token = CancellationToken()
         self.prompt_type = None
         
     def log(self, message, new_line=True):
         """Log a message using the callback."""
         self.log_callback(message, new_line)
         
+    @property
+    def stop_processing(self):
+        """True once the processor was asked to stop."""
+        return self.cancel_token.cancelled
+
     def stop(self):
-        """Signal the processor to stop after the current file."""
-        self.stop_processing = True
+        """
+        Signal the processor to stop.
+
+        The current file stops at its next cancellation check (between OCR pages, before
+        scrubbing or while the AI request runs) and is left in the input folder.
+        """
+        self.cancel_token.cancel("Auto processing was stopped.")
         
     def scrub_message(self, text):
-        """Remove PHI from text using scrubadub and regex patterns."""
+        """Remove PHI from text with the shared PHI scrubber."""
         # Skip scrubbing for OSCAR_FEEDBACK since extract_patient_notes already removes sensitive info
         if self.prompt_type == "OSCAR_FEEDBACK":
             return text
-            
-        scrubbed_message = scrubadub.clean(text)
-        
-        cleaned_message = scrubbed_message
-        re_ohip_plain = re.compile(r'\b\d{10}\b')
-        re_ohip_dashed = re.compile(r'\b(\d{4})-(\d{3})-(\d{3})(?:[- ]?[A-Za-z]{2})?\b')
-        re_postal = re.compile(r'\b[ABCEGHJ-NPRSTVXY]\d[ABCEGHJ-NPRSTV-Z][ -]?\d[ABCEGHJ-NPRSTV-Z]\d\b', re.IGNORECASE)
-        re_address = re.compile(r'\b\d+ [A-Z][a-z]+ (Street|St|Avenue|Ave|Road|Rd|Drive|Dr)\b', re.IGNORECASE)
-        
-        scrub_patterns = [
-            (re_ohip_plain, '{{OHIP}}'),
-            (re_ohip_dashed, '{{OHIP}}'),
-            (re_postal, '{{POSTAL_CODE}}'),
-            (re_address, '{{ADDRESS}}'),
-        ]
-        
-        for regex, replacement in scrub_patterns:
-            cleaned_message = regex.sub(replacement, cleaned_message)
-            
-        return cleaned_message
+
+        # The scrubber checks the token before it starts, it cannot stop half way
+        return get_phi_scrubber().clean(text, self.cancel_token)
     
     def move_file(self, curr_dir, move_dir, file):
         """
@@ -176,7 +169,7 @@ class AutoProcessor:
         self.log(f"Watching HL7 folder: {hl7_in_folder}")
         self.log(f"Watching Feedback folder: {feedback_in_folder}")
         
-        time.sleep(3)
+        self.cancel_token.wait(3)
         
         # Main processing loop
         while not self.stop_processing:
@@ -195,9 +188,9 @@ class AutoProcessor:
             # If no files in either folder, wait
             if not hl7_files and not feedback_files:
                 self.log("\nNo files in either folder, waiting...")
-                time.sleep(15)
+                self.cancel_token.wait(15)
             else:
-                time.sleep(2)  # Brief pause between checks
+                self.cancel_token.wait(2)  # Brief pause between checks
     
     def process_hl7_files(self, in_folder, out_folder, fin_folder, fail_folder, files):
         """Process a batch of HL7 files."""
@@ -208,7 +201,7 @@ class AutoProcessor:
             try:
                 self.log(f"{50*'='}\nProcessing HL7: {file}\n{50*'='}")
                 
-                text = file_reader(os.path.join(in_folder, file))
+                text = file_reader(os.path.join(in_folder, file), cancel_token=self.cancel_token)
                 doc_type = detect_type(file).upper()
                 if doc_type == "UNKNOWN":
                     # See if file is lab
@@ -258,7 +251,7 @@ class AutoProcessor:
                     ai_response = generate_lab_hl7(text)
                 else:
                     clean_text = self.scrub_message(text)
-                    ai_response = self.ai_callback(f"{prompt}\n{clean_text}")
+                    ai_response = self.ai_callback(f"{prompt}\n{clean_text}", cancel_event=self.cancel_token)
                     self.log("Received AI response")
                 
                 output_name = file.replace(".pdf", ".hl7") if file.endswith(".pdf") else file.replace(".txt", ".hl7")
@@ -269,13 +262,16 @@ class AutoProcessor:
                 self.move_file(in_folder, fin_folder, file)
                 self.log(f"Moved file to {fin_folder}")
                 
+            except OperationCancelledError:
+                self.log(f"Stopped processing {file}, it stays in {in_folder}")
+                break
             except Exception as e:
                 self.log(f"Error processing HL7 file {file}: {e}")
                 self.log(f"Moving {file} to {fail_folder}")
                 self.move_file(in_folder, fail_folder, file)
             
             self.log(f"{50*'-'}\n\n")
-            time.sleep(2)
+            self.cancel_token.wait(2)
     
     def extract_feedback_patient_info(self, text):
         """
@@ -312,7 +308,7 @@ class AutoProcessor:
             try:
                 self.log(f"{50*'='}\nProcessing Feedback: {file}\n{50*'='}")
                 
-                text = file_reader(os.path.join(in_folder, file))
+                text = file_reader(os.path.join(in_folder, file), cancel_token=self.cancel_token)
                 
                 first_name, last_name, demographic_num, patient_notes = self.extract_feedback_patient_info(text)
                 
@@ -331,7 +327,7 @@ class AutoProcessor:
                 
                 prompt = self.prompts.get("OSCAR_FEEDBACK")
                 clean_text = self.scrub_message(patient_notes)
-                ai_response = self.ai_callback(f"{prompt}\n{clean_text}")
+                ai_response = self.ai_callback(f"{prompt}\n{clean_text}", cancel_event=self.cancel_token)
                 self.log("Received AI response")
                 
                 self.save_feedback(
@@ -345,11 +341,14 @@ class AutoProcessor:
                 self.move_file(in_folder, fin_folder, file)
                 self.log(f"Moved file to {fin_folder}")
                 
+            except OperationCancelledError:
+                self.log(f"Stopped processing {file}, it stays in {in_folder}")
+                break
             except Exception as e:
                 self.log(f"Error processing OSCAR file {file}: {e}")
                 self.log(f"Moving {file} to {fail_folder}")
                 self.move_file(in_folder, fail_folder, file)
             
             self.log(f"{50*'-'}\n\n")
-            time.sleep(2)
+            self.cancel_token.wait(2)
 
@@ -0,0 +1,187 @@
+"""
+batch_transcription.py
+
+Bounded concurrent queue for transcribing many uploaded recordings at once.
+
+Each file goes through transcription and note generation on a small worker pool.
+The caller supplies the actual work as callables, so the queue itself knows nothing
+about Whisper, the LLM or Tkinter. Progress is reported through a callback that is
+invoked from the worker threads.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cancellation import OperationCancelledError
+
+
+STATUS_QUEUED = "Queued"
+STATUS_TRANSCRIBING = "Transcribing"
+STATUS_GENERATING = "Generating Note"
+STATUS_DONE = "Done"
+STATUS_FAILED = "Failed"
+STATUS_CANCELLED = "Cancelled"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class BatchJob:
+    """
+    State of one file in a batch.
+
+    :ivar index: Position of the file in the batch.
+    :ivar path: Path of the audio file.
+    :ivar status: One of the ``STATUS_*`` constants.
+    :ivar transcript: The transcribed text, once available.
+    :ivar note: The generated note, once available.
+    :ivar error: Error message if the job failed.
+    :ivar elapsed: Seconds spent processing the file.
+    """
+
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        self.name = os.path.basename(path)
+        self.status = STATUS_QUEUED
+        self.transcript = None
+        self.note = None
+        self.error = None
+        self.elapsed = 0.0
+
+
+class BatchTranscriptionQueue:
+    """
+    Transcribe and generate notes for a list of audio files on a bounded worker pool.
+
+    :param transcribe: Callable taking a file path and returning the transcript.
+    :type transcribe: callable
+    :param generate_note: Callable ``generate_note(transcript, path)`` returning the note text.
+    :type generate_note: callable
+    :param on_update: Callable invoked with a ``BatchJob`` whenever its status changes.
+    :type on_update: callable or None
+    :param max_workers: Maximum number of files processed at the same time.
+    :type max_workers: int
+    """
+
+    def __init__(self, transcribe, generate_note, on_update=None, max_workers=2):
+        self.transcribe = transcribe
+        self.generate_note = generate_note
+        self.on_update = on_update
+        self.max_workers = max(1, int(max_workers))
+        self.jobs = []
+        self.cancel_event = threading.Event()
+        self.executor = None
+        self.futures = []
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self.finished_event = threading.Event()
+
+    def start(self, paths):
+        """
+        Queue the files and start processing them.
+
+        :param paths: Paths of the audio files to process.
+        :type paths: list[str]
+        :return: The jobs created for the files, in order.
+        :rtype: list[BatchJob]
+        """
+        self.jobs = [BatchJob(index, path) for index, path in enumerate(paths)]
+        self._remaining = len(self.jobs)
+        self.start_time = time.perf_counter()
+
+        if not self.jobs:
+            self._finish()
+            return self.jobs
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-transcription")
+        self.futures = [self.executor.submit(self._run_job, job) for job in self.jobs]
+        # Let the workers exit once the queue drains without blocking the caller
+        self.executor.shutdown(wait=False)
+        return self.jobs
+
+    def cancel(self):
+        """
+        Cancel the batch.
+
+        Queued files are skipped. Files already being processed stop at the next
+        cancellation check of their current step and are marked cancelled.
+        """
+        self.cancel_event.set()
+        for future, job in zip(self.futures, self.jobs):
+            if future.cancel():
+                self._set_status(job, STATUS_CANCELLED)
+                self._job_finished()
+
+    def is_finished(self):
+        return self.finished_event.is_set()
+
+    def summary(self):
+        """
+        Get a one line summary of the batch.
+
+        :rtype: str
+        """
+        counts = {status: 0 for status in FINISHED_STATUSES}
+        for job in self.jobs:
+            if job.status in counts:
+                counts[job.status] += 1
+
+        end = self.end_time or time.perf_counter()
+        elapsed = end - self.start_time if self.start_time else 0.0
+        return (f"{counts[STATUS_DONE]} of {len(self.jobs)} file(s) done, "
+                f"{counts[STATUS_FAILED]} failed, {counts[STATUS_CANCELLED]} cancelled "
+                f"in {elapsed:.1f}s")
+
+    def _run_job(self, job):
+        start = time.perf_counter()
+        try:
+            if self.cancel_event.is_set():
+                self._set_status(job, STATUS_CANCELLED)
+                return
+
+            self._set_status(job, STATUS_TRANSCRIBING)
+            job.transcript = self.transcribe(job.path)
+
+            if self.cancel_event.is_set():
+                self._set_status(job, STATUS_CANCELLED)
+                return
+
+            self._set_status(job, STATUS_GENERATING)
+            job.note = self.generate_note(job.transcript, job.path)
+
+            job.elapsed = time.perf_counter() - start
+            self._set_status(job, STATUS_DONE)
+        except OperationCancelledError:
+            job.elapsed = time.perf_counter() - start
+            self._set_status(job, STATUS_CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            job.elapsed = time.perf_counter() - start
+            print(f"Batch transcription of {job.name} failed: {e}")
+            self._set_status(job, STATUS_FAILED)
+        finally:
+            self._job_finished()
+
+    def _set_status(self, job, status):
+        job.status = status
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                print(f"Batch transcription update failed: {e}")
+
+    def _job_finished(self):
+        with self._lock:
+            self._remaining -= 1
+            done = self._remaining <= 0
+        if done:
+            self._finish()
+
+    def _finish(self):
+        self.end_time = time.perf_counter()
+        print(f"Batch transcription finished: {self.summary()}")
+        self.finished_event.set()
@@ -0,0 +1,94 @@
+"""
+cancellation.py
+
+Cooperative cancellation for long running work.
+
+A ``CancellationToken`` is created for an operation, e.g. a note generation, and
+passed down to every step. Steps check it at safe points (between tokens, pages or
+transcription segments) and raise ``OperationCancelledError``, so files, sockets and
+the llama.cpp context are released normally instead of the thread being killed.
+
+The token is a ``threading.Event``, so it can be passed wherever a ``cancel_event`` is
+expected.
+"""
+
+import threading
+from concurrent.futures import CancelledError
+
+
+class OperationCancelledError(CancelledError):
+    """Raised at a cancellation check once the operation was cancelled."""
+
+
+def check_cancelled(token):
+    """
+    Raise if a token or event was cancelled.
+
+    :param token: The token to check, None is never cancelled.
+    :type token: threading.Event or None
+    :raises OperationCancelledError: If the token is set.
+    """
+    if token is not None and token.is_set():
+        raise OperationCancelledError(getattr(token, "reason", None) or "The operation was cancelled.")
+
+
+class CancellationToken(threading.Event):
+    """
+    Signals that an operation should stop.
+
+    Callbacks registered with ``register`` run once when the token is cancelled, e.g.
+    to close a file or wake a thread blocked on a queue.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reason = None
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def cancel(self, reason=None):
+        """
+        Cancel the operation.
+
+        :param reason: Optional message of the ``OperationCancelledError``.
+        :type reason: str or None
+        """
+        if reason is not None and self.reason is None:
+            self.reason = reason
+        self.set()
+
+    def set(self):
+        super().set()
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancellation callback failed ({e.__class__.__name__}): {str(e)}")
+
+    @property
+    def cancelled(self):
+        """True once the operation was cancelled."""
+        return self.is_set()
+
+    def raise_if_cancelled(self):
+        """
+        Raise if the operation was cancelled.
+
+        :raises OperationCancelledError: If the token was cancelled.
+        """
+        check_cancelled(self)
+
+    def register(self, callback):
+        """
+        Run a callback when the token is cancelled, right away if it already was.
+
+        :param callback: Callable without arguments.
+        :type callback: callable
+        """
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
@@ -0,0 +1,232 @@
+"""
+chunking.py
+
+Map-reduce processing of documents that do not fit in the model context.
+
+The document is split at page boundaries first, then at section headings, paragraphs,
+lines, sentences and finally words, so a chunk only ends mid-section when a single
+section is larger than the budget. Every chunk is sent with the same prompt (map) and
+the partial results are combined (reduce) with a strategy that fits the prompt type:
+
+- ``MERGE_HL7_OBX``: OBX segments are merged by LOINC code and renumbered. Measurements
+  keep the first value, free text such as summaries and histories is joined.
+- ``MERGE_CONCATENATE``: results are joined, e.g. facts lists.
+- ``MERGE_LLM``: the model merges the partial results, used for free text notes.
+"""
+
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+
+MERGE_HL7_OBX = "hl7_obx"
+MERGE_CONCATENATE = "concatenate"
+MERGE_LLM = "llm"
+
+# Tesseract ends every OCR'd page with a form feed
+PAGE_BREAK = "\f"
+
+# Split points from coarsest to finest. The patterns are zero-width so no text is lost.
+SPLIT_LEVELS = [
+    re.compile(r"(?<=\f)"),                                    # pages
+    re.compile(r"(?<=\n)(?=[A-Z][A-Z0-9 /&()\-]{2,}:)"),       # section headings, e.g. "HISTORY:"
+    re.compile(r"(?<=\n\n)"),                                  # paragraphs
+    re.compile(r"(?<=\n)"),                                    # lines
+    re.compile(r"(?<=[.!?] )"),                                # sentences
+    re.compile(r"(?<= )"),                                     # words
+]
+
+# OBX values that are a single measurement, e.g. "72", "120/80" or "55 %"
+SCALAR_OBX_VALUE = re.compile(r"^[<>~]?\s*\d+(?:\.\d+)?(?:\s*/\s*\d+(?:\.\d+)?)?\s*[%a-zA-Z/]{0,6}$")
+
+LLM_MERGE_PROMPT = (
+    "The following are partial results of the same task, each produced from one part of a "
+    "long document. Combine them into a single response in the same format. Keep every "
+    "distinct finding, remove duplicates and do not add anything that is not in the parts."
+)
+
+
+def build_merge_prompt(task, parts):
+    """
+    Build the prompt that merges partial results with the LLM.
+
+    The original task is repeated so the merged response still follows its note format
+    and instructions.
+
+    :param task: The original prompt without the document.
+    :type task: str
+    :param parts: The partial results, joined.
+    :type parts: str
+    :rtype: str
+    """
+    return f"{LLM_MERGE_PROMPT}\n\nORIGINAL TASK:\n{task}\n\nPARTIAL RESULTS:\n{parts}"
+
+
+def heuristic_token_count(text):
+    """
+    Estimate the number of tokens in a text without a tokenizer.
+
+    Medical OCR text has many numbers, units and abbreviations, which tokenize worse
+    than prose, so this assumes 3.5 characters per token rather than the usual 4.
+
+    :param text: The text to measure.
+    :type text: str
+    :rtype: int
+    """
+    return math.ceil(len(text) / 3.5)
+
+
+def split_into_chunks(text, max_tokens, count_tokens=heuristic_token_count):
+    """
+    Split a text into chunks of at most ``max_tokens`` tokens at the coarsest possible boundaries.
+
+    :param text: The document.
+    :type text: str
+    :param max_tokens: Token budget of a chunk.
+    :type max_tokens: int
+    :param count_tokens: Callable returning the token count of a string.
+    :type count_tokens: callable
+    :return: The chunks, in document order. Joined they give back the text, less any
+        whitespace-only chunks.
+    :rtype: list[str]
+    """
+    chunks = [chunk for chunk in _split(text, max_tokens, count_tokens, 0) if chunk.strip()]
+    return chunks or [text]
+
+
+def _split(text, max_tokens, count_tokens, level):
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    if level >= len(SPLIT_LEVELS):
+        # A single "word" larger than the budget, cut it by characters
+        size = max(1, len(text) * max_tokens // max(1, count_tokens(text)))
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    pieces = [piece for piece in SPLIT_LEVELS[level].split(text) if piece]
+    if len(pieces) == 1:
+        return _split(text, max_tokens, count_tokens, level + 1)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+
+        if piece_tokens > max_tokens:
+            sub_chunks = _split(piece, max_tokens, count_tokens, level + 1)
+            if current:
+                # Keep e.g. a section heading together with the start of its section
+                if current_tokens + count_tokens(sub_chunks[0]) <= max_tokens:
+                    sub_chunks[0] = "".join(current) + sub_chunks[0]
+                else:
+                    chunks.append("".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(sub_chunks)
+            continue
+
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+
+        current.append(piece)
+        current_tokens += piece_tokens
+
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def map_chunks(chunks, fn, max_workers=1, cancel_event=None):
+    """
+    Run ``fn`` on every chunk.
+
+    With one worker the chunks run in order on the calling thread. This is what the
+    local model wants: the prompt before the chunk is identical every time, so
+    llama.cpp reuses its KV cache and only evaluates the new chunk.
+
+    :param chunks: The chunks to process.
+    :type chunks: list[str]
+    :param fn: Called with each chunk, returns the partial result.
+    :type fn: callable
+    :param max_workers: Number of chunks processed concurrently.
+    :type max_workers: int
+    :param cancel_event: Optional event, chunks that have not started are skipped once it is set.
+    :type cancel_event: threading.Event or None
+    :return: Partial results in chunk order. Skipped chunks are left out.
+    :rtype: list[str]
+    """
+    def run(chunk):
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        return fn(chunk)
+
+    if max_workers <= 1 or len(chunks) == 1:
+        results = [run(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)), thread_name_prefix="chunk") as executor:
+            results = list(executor.map(run, chunks))
+
+    return [result for result in results if result is not None]
+
+
+def merge_hl7_obx(results):
+    """
+    Merge the OBX segments generated for each chunk.
+
+    The prompts ask for one segment per LOINC code. For scalar fields, i.e. segments
+    with a unit or a measurement as the value (HR, BP, EF, ...), the first non-empty
+    value wins. Free text fields such as summaries, histories and risk factors describe
+    different parts of the document in every chunk, so their distinct values are joined
+    in document order. Segments are renumbered from 0. Other lines are dropped, the
+    header is generated separately.
+
+    :param results: Partial HL7 outputs, in document order.
+    :type results: list[str]
+    :return: The merged OBX segments, one per line.
+    :rtype: str
+    """
+    segments = {}
+    for result in results:
+        for line in result.splitlines():
+            line = line.strip()
+            if not line.startswith("OBX|"):
+                continue
+
+            fields = line.split("|")
+            code = fields[3] if len(fields) > 3 and fields[3] else line
+            value = fields[5].strip() if len(fields) > 5 else ""
+            unit = fields[6].strip() if len(fields) > 6 else ""
+
+            segment = segments.get(code)
+            if segment is None:
+                segment = segments[code] = {"fields": fields, "values": [], "scalar": False}
+            if value and ((unit and unit.upper() != "N/A") or SCALAR_OBX_VALUE.match(value)):
+                segment["scalar"] = True
+            if value and value not in segment["values"]:
+                if not segment["values"]:
+                    # Keep the unit and other fields of the first segment with a value
+                    segment["fields"] = fields
+                segment["values"].append(value)
+
+    lines = []
+    for index, segment in enumerate(segments.values()):
+        fields = list(segment["fields"])
+        if len(fields) > 1:
+            fields[1] = str(index)
+        if segment["values"] and len(fields) > 5:
+            values = segment["values"]
+            fields[5] = values[0] if segment["scalar"] else " ".join(values)
+        lines.append("|".join(fields))
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def merge_concatenate(results):
+    """
+    Join partial results in document order.
+
+    :param results: Partial outputs.
+    :type results: list[str]
+    :rtype: str
+    """
+    return "\n".join(result.strip() for result in results if result and result.strip())
@@ -0,0 +1,320 @@
+"""
+endpoint_router.py
+
+Load balancing and failover across several OpenAI compatible endpoints.
+
+Every request goes to the healthiest, least busy endpoint:
+
+- ``Least Outstanding``: the endpoint with the fewest requests in flight, ties broken
+  by latency.
+- ``EWMA Latency``: the endpoint with the lowest exponentially weighted moving average
+  latency, weighted by its requests in flight so a fast endpoint is not flooded.
+
+Connection errors, timeouts, 429 and 5xx responses fail over to the next endpoint. After
+``failure_threshold`` consecutive failures an endpoint's circuit opens and it is skipped
+until a health check or, after ``reset_timeout`` seconds, a single trial request
+succeeds. With a single endpoint there is nothing to fail over to, so its circuit never
+opens and every request is tried.
+"""
+
+import threading
+import time
+
+import httpx
+import requests
+
+
+ROUTING_LEAST_OUTSTANDING = "Least Outstanding"
+ROUTING_EWMA = "EWMA Latency"
+ROUTING_MODES = [ROUTING_LEAST_OUTSTANDING, ROUTING_EWMA]
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+HEALTH_CHECK_TIMEOUT = 5
+
+
+class EndpointUnavailableError(Exception):
+    """Raised when every endpoint failed or is unavailable."""
+
+
+def parse_endpoints(text):
+    """
+    Parse a list of endpoint URLs separated by ``;``, ``,`` or new lines.
+
+    :param text: The setting value.
+    :type text: str
+    :return: The URLs without trailing slashes, in order, without duplicates.
+    :rtype: list[str]
+    """
+    endpoints = []
+    for part in str(text or "").replace(",", ";").replace("\n", ";").split(";"):
+        url = part.strip().rstrip("/")
+        if url and url not in endpoints:
+            endpoints.append(url)
+    return endpoints
+
+
+def is_failover_error(error):
+    """
+    Whether a request error is the endpoint's fault, so another endpoint may succeed.
+
+    Client errors such as 400 or 401 would fail on every endpoint and are not retried.
+
+    :param error: The exception raised by the request.
+    :type error: Exception
+    :rtype: bool
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+class Endpoint:
+    """
+    An endpoint and its load, latency and circuit breaker state.
+
+    Attributes:
+        url: Base URL, e.g. ``http://10.0.0.5:5001/v1``
+        outstanding: Requests in flight
+        ewma_latency: Smoothed request latency in seconds, None until the first success
+        state: One of the ``CIRCUIT_*`` constants
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.last_failure_at = 0.0
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+
+class EndpointRouter:
+    """
+    Picks an endpoint for each request and fails over to the others.
+
+    :param mode: One of ``ROUTING_MODES``.
+    :type mode: str
+    :param failure_threshold: Consecutive failures that open an endpoint's circuit.
+    :type failure_threshold: int
+    :param reset_timeout: Seconds before an open circuit lets a trial request through.
+    :type reset_timeout: float
+    :param ewma_alpha: Weight of the newest latency sample.
+    :type ewma_alpha: float
+    """
+
+    def __init__(self, mode=ROUTING_LEAST_OUTSTANDING, failure_threshold=3, reset_timeout=30.0, ewma_alpha=0.3):
+        self.mode = mode
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ewma_alpha = ewma_alpha
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.health_thread = None
+        self.health_interval = None
+        self.health_stop = threading.Event()
+
+    def configure(self, urls, mode=None):
+        """
+        Set the endpoints. Statistics of endpoints that stay configured are kept.
+
+        :param urls: Endpoint base URLs, in order of preference.
+        :type urls: list[str]
+        :param mode: Optional routing mode, one of ``ROUTING_MODES``.
+        :type mode: str or None
+        """
+        with self.lock:
+            if mode is not None:
+                if mode not in ROUTING_MODES:
+                    print(f"Unknown endpoint routing mode '{mode}', using {ROUTING_LEAST_OUTSTANDING}.")
+                    mode = ROUTING_LEAST_OUTSTANDING
+                self.mode = mode
+            if list(self.endpoints) != list(urls):
+                self.endpoints = {url: self.endpoints.get(url) or Endpoint(url) for url in urls}
+
+    def _uses_circuit_breaker(self):
+        # Skipping the only endpoint would fail requests it might have answered
+        return len(self.endpoints) > 1
+
+    def _is_available(self, endpoint, now):
+        if endpoint.state == CIRCUIT_CLOSED or not self._uses_circuit_breaker():
+            return True
+        if endpoint.state == CIRCUIT_OPEN and now - endpoint.opened_at >= self.reset_timeout:
+            # Let a single trial request through
+            endpoint.state = CIRCUIT_HALF_OPEN
+            return True
+        return False
+
+    def _score(self, endpoint, now):
+        # Endpoints that just failed go last, those without a latency sample yet first.
+        # A failure older than reset_timeout no longer counts, the endpoint may be back.
+        failing = endpoint.consecutive_failures > 0 and now - endpoint.last_failure_at < self.reset_timeout
+        latency = endpoint.ewma_latency or 0.0
+        if self.mode == ROUTING_EWMA:
+            return (failing, latency * (endpoint.outstanding + 1), endpoint.outstanding)
+        return (failing, endpoint.outstanding, latency)
+
+    def _acquire(self, exclude):
+        with self.lock:
+            now = time.monotonic()
+            candidates = [
+                endpoint for url, endpoint in self.endpoints.items()
+                if url not in exclude and self._is_available(endpoint, now)
+            ]
+            if not candidates:
+                return None
+            # min() keeps the configured order on ties, so the first endpoint is preferred
+            endpoint = min(candidates, key=lambda candidate: self._score(candidate, now))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _record_success(self, endpoint, elapsed):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.successes += 1
+            endpoint.consecutive_failures = 0
+            if endpoint.state != CIRCUIT_CLOSED:
+                print(f"Endpoint {endpoint.url} recovered.")
+            endpoint.state = CIRCUIT_CLOSED
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = elapsed
+            else:
+                endpoint.ewma_latency += self.ewma_alpha * (elapsed - endpoint.ewma_latency)
+
+    def _record_failure(self, endpoint, error, counts_as_failure=True):
+        with self.lock:
+            endpoint.outstanding -= 1
+            if not counts_as_failure:
+                # Not the endpoint's fault, e.g. a rejected request
+                endpoint.state = CIRCUIT_CLOSED
+                endpoint.consecutive_failures = 0
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_failure_at = time.monotonic()
+            endpoint.last_error = f"{error.__class__.__name__}: {str(error)}"
+            if not self._uses_circuit_breaker():
+                return
+            if endpoint.state == CIRCUIT_HALF_OPEN or endpoint.consecutive_failures >= self.failure_threshold:
+                if endpoint.state != CIRCUIT_OPEN:
+                    print(f"Endpoint {endpoint.url} is unavailable, skipping it for {self.reset_timeout:.0f}s.")
+                endpoint.state = CIRCUIT_OPEN
+                endpoint.opened_at = time.monotonic()
+
+    def call(self, fn, can_retry=None):
+        """
+        Run a request on the best endpoint, failing over to the others.
+
+        :param fn: Called with the endpoint URL, performs the request and returns its result.
+        :type fn: callable
+        :param can_retry: Optional callable, failover only happens while it returns True,
+            e.g. until the first streamed token was shown.
+        :type can_retry: callable or None
+        :return: The result of ``fn``.
+        :raises EndpointUnavailableError: If every endpoint failed or is unavailable.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint.url)
+
+            start = time.perf_counter()
+            try:
+                result = fn(endpoint.url)
+            except BaseException as e:
+                failover = is_failover_error(e)
+                self._record_failure(endpoint, e, counts_as_failure=failover)
+                if not failover or (can_retry is not None and not can_retry()):
+                    raise
+                print(f"Request to {endpoint.url} failed ({e.__class__.__name__}): {str(e)}. Trying the next endpoint.")
+                last_error = e
+                continue
+
+            self._record_success(endpoint, time.perf_counter() - start)
+            return result
+
+        if last_error is not None:
+            raise EndpointUnavailableError(f"All model endpoints failed. Last error ({last_error.__class__.__name__}): {str(last_error)}") from last_error
+        raise EndpointUnavailableError("No model endpoint is available. All endpoints failed recently and are being skipped.")
+
+    def check_health(self, check):
+        """
+        Run a health check on every endpoint and update the circuit breakers.
+
+        :param check: Called with an endpoint URL, raises if the endpoint is unhealthy.
+        :type check: callable
+        """
+        with self.lock:
+            endpoints = list(self.endpoints.values())
+
+        for endpoint in endpoints:
+            try:
+                check(endpoint.url)
+            except Exception as e:
+                with self.lock:
+                    endpoint.last_error = f"health check {e.__class__.__name__}: {str(e)}"
+                    if not self._uses_circuit_breaker():
+                        continue
+                    if endpoint.state != CIRCUIT_OPEN:
+                        print(f"Endpoint {endpoint.url} failed its health check, skipping it.")
+                    endpoint.state = CIRCUIT_OPEN
+                    endpoint.opened_at = time.monotonic()
+            else:
+                with self.lock:
+                    if endpoint.state != CIRCUIT_CLOSED:
+                        print(f"Endpoint {endpoint.url} passed its health check.")
+                    endpoint.state = CIRCUIT_CLOSED
+                    endpoint.consecutive_failures = 0
+
+    def start_health_checks(self, check, interval):
+        """
+        Run ``check_health`` periodically on a background thread.
+
+        :param check: Called with an endpoint URL, raises if the endpoint is unhealthy.
+        :type check: callable
+        :param interval: Seconds between health checks.
+        :type interval: float
+        """
+        self.stop_health_checks()
+        self.health_stop = threading.Event()
+        self.health_interval = interval
+        stop = self.health_stop
+
+        def run():
+            while not stop.wait(interval):
+                self.check_health(check)
+
+        self.health_thread = threading.Thread(target=run, name="endpoint-health", daemon=True)
+        self.health_thread.start()
+
+    def stop_health_checks(self):
+        """Stop the background health checks."""
+        self.health_stop.set()
+        self.health_thread = None
+        self.health_interval = None
+
+    def get_stats(self):
+        """
+        Get per-endpoint statistics for the debug window.
+
+        :rtype: dict
+        """
+        with self.lock:
+            stats = {"routing": self.mode}
+            for url, endpoint in self.endpoints.items():
+                latency = f"{endpoint.ewma_latency:.1f}s" if endpoint.ewma_latency is not None else "n/a"
+                stats[url] = (f"{endpoint.state}, {endpoint.outstanding} in flight, latency {latency}, "
+                              f"{endpoint.successes} ok / {endpoint.failures} failed")
+            return stats
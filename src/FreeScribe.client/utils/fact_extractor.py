@@ -0,0 +1,223 @@
+"""
+fact_extractor.py
+
+Incremental fact extraction for the pre-processing step of the Scribe note.
+
+With pre-processing enabled the note is made from a list of facts that the LLM
+extracts from the transcript. In realtime mode the transcript arrives in segments
+while the visit is still going, so the facts are extracted from each new piece of the
+transcript as soon as enough of it has arrived. The facts of all pieces are merged
+into one list without duplicates. When recording stops only the last piece is left to
+process before the note pass, instead of a pass over the whole transcript.
+
+The facts are only reused for the transcript they were extracted from. If the
+transcript was edited before the note is generated, the caller falls back to a full
+pre-processing pass.
+"""
+
+import queue
+import re
+import threading
+import time
+
+from utils.cancellation import CancellationToken, OperationCancelledError
+
+
+# Characters of transcript collected before a piece is sent for extraction
+DEFAULT_CHUNK_CHARS = 1200
+
+_BULLET = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s*')
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def parse_facts(text):
+    """
+    Split an LLM facts list into single facts.
+
+    Bullets and numbering are removed, blank lines and headings ending with ``:`` are
+    dropped.
+
+    :param text: The facts list returned by the LLM.
+    :type text: str
+    :return: The facts, in order.
+    :rtype: list[str]
+    """
+    facts = []
+    for line in str(text or "").splitlines():
+        fact = _BULLET.sub("", line).strip()
+        if fact and not fact.endswith(":"):
+            facts.append(fact)
+    return facts
+
+
+def fact_key(fact):
+    """
+    Normalize a fact for duplicate detection, ignoring case, punctuation and spacing.
+
+    :param fact: The fact.
+    :type fact: str
+    :rtype: str
+    """
+    return _NON_WORD.sub(" ", fact.lower()).strip()
+
+
+def normalize_transcript(text):
+    """Collapse whitespace so re-wrapped text still compares equal."""
+    return " ".join(str(text or "").split())
+
+
+class IncrementalFactExtractor:
+    """
+    Extract facts from a transcript while it is being recorded.
+
+    Segments are collected until ``chunk_chars`` characters arrived and then processed
+    one piece at a time on a background thread.
+
+    :param extract: Callable ``extract(text, cancel_event)`` returning the facts list
+        for a piece of the transcript.
+    :type extract: callable
+    :param chunk_chars: Characters collected before a piece is processed.
+    :type chunk_chars: int
+    """
+
+    def __init__(self, extract, chunk_chars=DEFAULT_CHUNK_CHARS):
+        self.extract = extract
+        self.chunk_chars = max(1, int(chunk_chars))
+        self.cancel_token = CancellationToken()
+        self.segments = []
+        self.pending = []
+        self.pending_chars = 0
+        self.facts = []
+        self.fact_keys = set()
+        self.duplicates = 0
+        self.chunks_done = 0
+        self.extract_time = 0.0
+        self.failed = False
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="fact-extractor", daemon=True)
+        self.worker.start()
+
+    def add_segment(self, text):
+        """
+        Add a transcribed segment. Safe to call from any thread.
+
+        :param text: The segment as shown in the transcript box.
+        :type text: str
+        """
+        if self.cancel_token.cancelled or not text or not text.strip():
+            return
+
+        with self.lock:
+            self.segments.append(text)
+            self.pending.append(text)
+            self.pending_chars += len(text)
+            if self.pending_chars < self.chunk_chars:
+                return
+            piece = self._take_pending()
+        self.queue.put(piece)
+
+    def matches(self, transcript):
+        """
+        Whether the facts belong to this transcript, i.e. it was not edited.
+
+        :param transcript: The transcript the note is generated from.
+        :type transcript: str
+        :rtype: bool
+        """
+        with self.lock:
+            recorded = "\n".join(self.segments)
+        return bool(recorded.strip()) and normalize_transcript(recorded) == normalize_transcript(transcript)
+
+    def finish(self, cancel_event=None):
+        """
+        Process the rest of the transcript and return the merged facts list.
+
+        :param cancel_event: Optional event that stops the wait once it is set.
+        :type cancel_event: threading.Event or None
+        :return: The facts as a bulleted list, None if a piece failed, in which case the
+            caller should extract the facts from the whole transcript.
+        :rtype: str or None
+        :raises OperationCancelledError: If ``cancel_event`` was set.
+        """
+        with self.lock:
+            piece = self._take_pending()
+        if piece:
+            self.queue.put(piece)
+
+        done = threading.Event()
+        self.queue.put(done)
+        while not done.wait(0.1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise OperationCancelledError("Waiting for the facts was cancelled.")
+            if self.cancel_token.cancelled:
+                return None
+
+        with self.lock:
+            if self.failed or not self.facts:
+                return None
+            return "\n".join(f"- {fact}" for fact in self.facts)
+
+    def cancel(self):
+        """Stop extracting, e.g. when the recording is cleared."""
+        self.cancel_token.cancel("Fact extraction was cancelled.")
+        self.queue.put(None)
+
+    def get_stats(self):
+        """
+        Get extraction statistics for the debug window.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "pieces processed": self.chunks_done,
+                "pieces waiting": self.queue.qsize(),
+                "facts": len(self.facts),
+                "duplicates dropped": self.duplicates,
+                "extraction time": f"{self.extract_time:.1f}s",
+                "failed": self.failed,
+            }
+
+    def _take_pending(self):
+        piece = "\n".join(self.pending)
+        self.pending = []
+        self.pending_chars = 0
+        return piece
+
+    def _merge(self, facts_text):
+        with self.lock:
+            for fact in parse_facts(facts_text):
+                key = fact_key(fact)
+                if not key:
+                    continue
+                if key in self.fact_keys:
+                    self.duplicates += 1
+                    continue
+                self.fact_keys.add(key)
+                self.facts.append(fact)
+            self.chunks_done += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            if self.failed or self.cancel_token.cancelled:
+                continue
+
+            start = time.perf_counter()
+            try:
+                facts_text = self.extract(item, self.cancel_token)
+            except OperationCancelledError:
+                continue
+            except Exception as e:
+                print(f"Incremental fact extraction failed, the facts will be extracted after recording ({e.__class__.__name__}): {str(e)}")
+                with self.lock:
+                    self.failed = True
+                continue
+            self.extract_time += time.perf_counter() - start
+            self._merge(facts_text)
@@ -6,9 +6,13 @@ Separated from client.py to keep code organized.
 """
 
 import json
+import re
+import time
 
+from utils.lab_checkbox_mapping import EFORM_TO_UI_LABEL, PLAN_KEYWORD_PATTERNS, get_eform_checkbox_name, get_ui_label
 
-LAB_CHECKBOX_ANALYSIS_PROMPT = """Analyze the medical PLAN section and identify which lab test checkboxes should be checked on a requisition form. Return a JSON array of eform checkbox code names.
+
+LAB_CHECKBOX_ANALYSIS_PROMPT = """Analyze the medical PLAN section and identify which lab test checkboxes should be checked on a requisition form. Return a JSON object with the eform checkbox code names in "labs".
 
 Available checkboxes by section (use the CODE NAME, not the description):
 
@@ -72,26 +76,214 @@ OTHERS:
 - UrineC&S (Urine C&S - UTI)
 
 CRITICAL RULES:
-1. Return ONLY a JSON array. Do NOT include any explanatory text, comments, or additional content before or after the JSON array.
-2. Your response must start with [ and end with ]. No other text.
-3. ONLY use code names from the list above. Do NOT invent new code names or use descriptions.
-4. If a term in the PLAN doesn't match any checkbox code name in the list above, do NOT include it in your response.
+1. Return ONLY a JSON object of the form {"labs": [...]}. Do NOT include any explanatory text, comments, or additional content.
+2. ONLY use code names from the list above. Do NOT invent new code names or use descriptions.
+3. If a term in the PLAN doesn't match any checkbox code name in the list above, do NOT include it in your response.
+4. Do NOT select labs the PLAN says not to order, to stop or hold, or only to consider under a condition.
+5. If no checkbox applies, return {"labs": []}.
 
 Example PLAN snippet: "Check lipid profile and CBC."
-Correct response: ["DyslipidemiaOnStatin", "CompleteBloodCount"]
+Correct response: {"labs": ["DyslipidemiaOnStatin", "CompleteBloodCount"]}
 
 Example PLAN snippet: "repeat chf follow-up labs in 2 weeks to recheck renal function and electrolytes while patient remains on Lasix."
-Correct response: ["RenalFunction ", "CHFFollowUp"]
+Correct response: {"labs": ["RenalFunction", "CHFFollowUp"]}
 """
 
+# Code names the model may return. FastingInfo is added automatically, never selected.
+LAB_CODE_NAMES = [code for code in EFORM_TO_UI_LABEL if code != "FastingInfo"]
+
+# JSON schema for structured output. The local model turns it into a grammar, remote
+# endpoints receive it as response_format, so the answer can only contain known codes.
+LAB_CHECKBOX_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "labs": {
+            "type": "array",
+            "items": {"type": "string", "enum": LAB_CODE_NAMES},
+        },
+    },
+    "required": ["labs"],
+    "additionalProperties": False,
+}
+
+# Longest code names are ~10 tokens, a realistic plan selects well under 20 of them
+LAB_ANALYSIS_MAX_TOKENS = 200
+
+
+def parse_lab_response(response: str) -> list:
+    """
+    Extract the list of code names from the model response.
+
+    Accepts the ``{"labs": [...]}`` object returned by structured output and, for
+    endpoints that ignore ``response_format``, a bare array or JSON wrapped in text.
+
+    Args:
+        response: The raw model response
+
+    Returns:
+        List of code names, empty if the response could not be parsed
+    """
+    response = response.strip()
+    try:
+        data = json.loads(response)
+    except json.JSONDecodeError:
+        # Endpoint without structured output support, e.g. a markdown fenced answer
+        start = min((i for i in (response.find("{"), response.find("[")) if i != -1), default=-1)
+        end = max(response.rfind("}"), response.rfind("]")) + 1
+        if start == -1 or end <= start:
+            print(f"Failed to parse LLM response as JSON: {response}")
+            return []
+        try:
+            data = json.loads(response[start:end])
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error in analyze_plan_for_labs: {e}")
+            print(f"Response was: {response}")
+            return []
+
+    if isinstance(data, dict):
+        data = data.get("labs", [])
+    if not isinstance(data, list):
+        print(f"Unexpected lab analysis response: {response}")
+        return []
+    return data
+
+
+# Individual tests without an unambiguous checkbox, the LLM decides where they belong
+LAB_TEST_CUES = [
+    "a1c", "hba1c", "tsh", "potassium", "creatinine", "egfr", "acr", "ferritin", "b12", "vitamin d",
+    "troponin", "bnp", "nt-probnp", "ck", "esr", "crp", "glucose", "urinalysis", "digoxin", "thyroid",
+]
+
+# Generic ordering words, covered when the same sentence already matched a checkbox
+LAB_GENERIC_CUES = [
+    "labs", "lab work", "bloodwork", "blood work", "blood test", "blood tests", "panel", "level", "levels",
+    "workup", "work-up", "electrolytes", "serology", "screen",
+]
+
+# Words that negate or make an order conditional, e.g. "no need to repeat CBC",
+# "hold INR monitoring" or "consider lipids if LDL rises". Sentences containing them
+# are left to the LLM, the matcher would otherwise select the labs they mention.
+LAB_NEGATION_CUES = [
+    "no", "not", "never", "none", "without", "decline", "declined", "declines", "refuse",
+    "refused", "refuses", "hold", "held", "holding", "stop", "stopped", "stopping", "discontinue",
+    "discontinued", "cancel", "cancelled", "canceled", "defer", "deferred", "avoid", "if", "unless",
+    "consider", "considering", "possibly", "may",
+]
+
+
+def _build_lab_matcher():
+    """
+    Compile every keyword pattern and cue into a single case-insensitive alternation.
+
+    Patterns written with capitals, e.g. "ANA", only match in that case. The returned
+    codes are keyed by the lowercase term.
+    """
+    term_codes = {}
+    terms = []
+    for ui_label, ui_terms in PLAN_KEYWORD_PATTERNS.items():
+        code = get_eform_checkbox_name(ui_label)
+        for term in ui_terms:
+            term_codes[term.lower()] = code
+            terms.append(term)
+    for term in LAB_TEST_CUES + LAB_GENERIC_CUES:
+        if term not in term_codes:
+            term_codes[term] = LAB_TEST_CUE if term in LAB_TEST_CUES else LAB_GENERIC_CUE
+            terms.append(term)
+
+    def term_pattern(term):
+        return re.escape(term) if term == term.lower() else f"(?-i:{re.escape(term)})"
+
+    # Longest terms first so "kidney function and electrolytes" wins over "kidney function"
+    alternation = "|".join(term_pattern(term) for term in sorted(terms, key=len, reverse=True))
+    pattern = re.compile(rf"(?<![\w&+-])(?:{alternation})(?![\w&+])", re.IGNORECASE)
+    return pattern, term_codes
+
+
+LAB_TEST_CUE = "test"
+LAB_GENERIC_CUE = "generic"
+LAB_MATCHER, LAB_TERM_CODES = _build_lab_matcher()
+# "n't" is matched separately, it ends a word instead of being one, e.g. "don't"
+LAB_NEGATION_MATCHER = re.compile(
+    r"\b(?:" + "|".join(re.escape(cue) for cue in LAB_NEGATION_CUES) + r")\b|n't\b",
+    re.IGNORECASE)
+SENTENCE_SPLIT = re.compile(r"[.;\n]+")
+
+
+class LabMatchResult:
+    """
+    Result of the keyword pre-classification of a PLAN section.
+
+    Attributes:
+        code_names: Checkbox code names matched by unambiguous keyword patterns
+        unmatched_terms: Lab related terms that could not be mapped to a checkbox
+    """
+
+    def __init__(self, code_names, unmatched_terms):
+        self.code_names = code_names
+        self.unmatched_terms = unmatched_terms
+
+    @property
+    def needs_llm(self):
+        """True when the PLAN mentions labs the matcher could not place."""
+        return bool(self.unmatched_terms)
+
+
+def preclassify_plan_for_labs(plan_text: str) -> LabMatchResult:
+    """
+    Match the PLAN text against ``PLAN_KEYWORD_PATTERNS``.
+
+    Test names without a pattern (e.g. "TSH") are always unmatched. Generic words
+    such as "labs" are only unmatched when nothing else in their sentence matched,
+    e.g. "repeat bloodwork in 3 months". Every lab term of a sentence with a negation
+    or condition, e.g. "patient declined lipid panel", is unmatched so the LLM decides.
+
+    Args:
+        plan_text: The PLAN section text from a medical note
+
+    Returns:
+        LabMatchResult with the matched code names and the unmatched terms
+    """
+    code_names = []
+    unmatched_terms = []
+
+    for sentence in SENTENCE_SPLIT.split(plan_text):
+        if LAB_NEGATION_MATCHER.search(sentence):
+            unmatched_terms.extend(match.group(0) for match in LAB_MATCHER.finditer(sentence))
+            continue
+
+        generic_terms = []
+        sentence_matched = False
+        for match in LAB_MATCHER.finditer(sentence):
+            term = match.group(0)
+            code = LAB_TERM_CODES[term.lower()]
+            if code == LAB_TEST_CUE:
+                unmatched_terms.append(term)
+            elif code == LAB_GENERIC_CUE:
+                generic_terms.append(term)
+            else:
+                sentence_matched = True
+                if code not in code_names:
+                    code_names.append(code)
+        if generic_terms and not sentence_matched:
+            unmatched_terms.extend(generic_terms)
+
+    return LabMatchResult(code_names, unmatched_terms)
+
 
 def analyze_plan_for_labs(plan_text: str, send_text_to_chatgpt_func) -> list[str]:
     """
-    Analyze PLAN section text using LLM to identify which lab checkboxes should be checked.
+    Identify which lab checkboxes should be checked for a PLAN section.
+
+    The PLAN is first matched against the keyword patterns, which handle the common
+    phrasings ("CBC", "lipid profile", "renal function", "INR") in well under a
+    millisecond. The LLM is only asked when lab related terms remain that the
+    matcher could not place; it is constrained to a JSON schema listing the
+    checkbox code names, so the response is valid JSON and short.
     
     Args:
         plan_text: The PLAN section text from a medical note
-        send_text_to_chatgpt_func: Function to call LLM (e.g., send_text_to_chatgpt)
+        send_text_to_chatgpt_func: Function to call LLM (e.g., send_text_to_chatgpt), must accept
+            ``json_schema`` and ``max_tokens`` keyword arguments
         
     Returns:
         List of UI label strings for checkboxes that should be checked
@@ -100,75 +292,33 @@ def analyze_plan_for_labs(plan_text: str, send_text_to_chatgpt_func) -> list[str
         return []
     
     try:
-        # Call LLM with the prompt and plan text
-        full_prompt = f"{LAB_CHECKBOX_ANALYSIS_PROMPT}\n\nPLAN text:\n{plan_text}"
-        response = send_text_to_chatgpt_func(full_prompt)
-        
-        # Parse JSON response
-        # Try to extract JSON from response (handle cases where LLM adds extra text)
-        response = response.strip()
-        
-        # Remove markdown code blocks if present
-        if response.startswith("```"):
-            # Find the first newline after ```
-            start_idx = response.find("\n") + 1
-            # Find the last ```
-            end_idx = response.rfind("```")
-            if end_idx > start_idx:
-                response = response[start_idx:end_idx].strip()
-        elif response.startswith("```json"):
-            start_idx = response.find("\n") + 1
-            end_idx = response.rfind("```")
-            if end_idx > start_idx:
-                response = response[start_idx:end_idx].strip()
-        
-        # Try to find JSON array in the response
-        # Look for the last complete JSON array (in case LLM provides multiple)
-        json_start = response.rfind("[")
-        json_end = response.rfind("]") + 1
-        
-        if json_start != -1 and json_end > json_start:
-            json_str = response[json_start:json_end]
-            try:
-                checkbox_code_names = json.loads(json_str)
-            except json.JSONDecodeError:
-                # If that fails, try finding all JSON arrays and use the longest one
-                import re
-                json_arrays = re.findall(r'\[[^\]]*\]', response)
-                if json_arrays:
-                    # Use the longest array (most likely to be complete)
-                    json_str = max(json_arrays, key=len)
-                    checkbox_code_names = json.loads(json_str)
-                else:
-                    raise
-            
-            # Validate that it's a list of strings
-            if isinstance(checkbox_code_names, list):
-                # Convert eform code names back to UI labels
-                from utils.lab_checkbox_mapping import get_ui_label
-                ui_labels = []
-                for code_name in checkbox_code_names:
-                    code_name_str = str(code_name).strip()
-                    ui_label = get_ui_label(code_name_str)
-                    if ui_label:
-                        ui_labels.append(ui_label)
-                    else:
-                        # If code name not found, warn and skip
-                        print(f"Warning: Could not map code name '{code_name}' to UI label")
-                return ui_labels
-                return ui_labels
-        
-        print(f"Failed to parse LLM response as JSON: {response}")
-        return []
+        start_time = time.perf_counter()
+        match_result = preclassify_plan_for_labs(plan_text)
+        code_names = list(match_result.code_names)
+        print(f"Lab pre-classifier matched {code_names} in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+        if match_result.needs_llm:
+            print(f"Asking the LLM about unmatched lab terms: {match_result.unmatched_terms}")
+            full_prompt = f"{LAB_CHECKBOX_ANALYSIS_PROMPT}\n\nPLAN text:\n{plan_text}"
+            response = send_text_to_chatgpt_func(
+                full_prompt,
+                json_schema=LAB_CHECKBOX_SCHEMA,
+                max_tokens=LAB_ANALYSIS_MAX_TOKENS,
+            )
+            code_names.extend(parse_lab_response(response))
+
+        ui_labels = []
+        for code_name in code_names:
+            ui_label = get_ui_label(str(code_name).strip())
+            if ui_label and ui_label not in ui_labels:
+                ui_labels.append(ui_label)
+            elif not ui_label:
+                # If code name not found, warn and skip
+                print(f"Warning: Could not map code name '{code_name}' to UI label")
+        return ui_labels
         
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error in analyze_plan_for_labs: {e}")
-        if 'response' in locals():
-            print(f"Response was: {response}")
-        return []
     except Exception as e:
         print(f"Error in analyze_plan_for_labs: {e}")
         import traceback
         traceback.print_exc()
         return []
-
@@ -172,90 +172,58 @@ def get_all_ui_labels() -> list[str]:
         labels.extend(category_labels)
     return labels
 
-# The following is for KEYWORD extraction, we are currently not using this as we are using the LLM analysis --------------------------------------------
-
-# Keyword patterns for automatic checkbox detection from PLAN text
+# Keyword patterns for the pre-classification of PLAN text in lab_analysis.py
 # Format: {ui_label: [list of keyword patterns]}
+# Only phrasings that name exactly one checkbox belong here, anything vaguer (e.g.
+# "statin", "thyroid", "hypertension") is left to the LLM analysis. Fasting
+# Instructions is added automatically and never matched. Patterns are matched
+# case-insensitively, except ones with capitals, e.g. "ANA" so "Dr. Ana" is not a lab.
 PLAN_KEYWORD_PATTERNS = {
-    "Fasting Instructions": ["fasting", "fast", "nothing to eat", "npo"],
-    
-    "pre-cath": ["pre-cath", "pre cath", "precatheterization", "before cath", "prior to cath"],
-    "pre-EP procedure": ["pre-ep", "pre ep", "pre-electrophysiology", "before ep", "prior to ep"],
-    
-    "Amiodarone follow up": ["amiodarone", "amiodarone monitoring", "amiodarone follow"],
-    "Digoxin level": ["digoxin", "digoxin level", "digoxin monitoring"],
-    
-    "comprehensive": ["comprehensive cardiac", "comprehensive blood work", "full cardiac panel"],
-    "minicomprehensive": ["mini comprehensive", "minicomprehensive"],
-    "RR": ["rr", "comrr", "renal risk"],
-    "Cardiomyopathy": ["cardiomyopathy", "new cardiomyopathy", "ihd"],
-    
-    "CHF Baseline": ["chf baseline", "heart failure baseline", "congestive heart failure baseline"],
-    "CHF Follow-up": ["chf follow", "heart failure follow", "chf follow-up", "chf follow up"],
-    "CHF Standing Order Q3M": ["chf standing", "chf q3", "standing order q3"],
-    "CHF Follow-up post thiazide": ["post thiazide", "after thiazide", "thiazide follow"],
-    "CHF Follow-up post SGLT2": ["post sglt2", "after sglt2", "sglt2 follow"],
-    "CHF Follow-up post high K+": ["post high k", "after high potassium", "high k+ follow", "hyperkalemia follow"],
-    
-    "CKD Annual": ["ckd annual", "chronic kidney disease annual", "ckd stage 3"],
-    "eGFR/ACR Q6M": ["egfr/acr q6", "egfr acr q6", "egfr q6", "acr q6"],
-    
-    "DM Annual": ["dm annual", "diabetes annual", "diabetic annual"],
-    "A1C Q3M": ["a1c q3", "hba1c q3", "a1c q3month", "diabetes q3"],
-    
-    "Screening": ["cholesterol screening", "lipid screening", "dyslipidemia screening"],
-    "On Statin": ["on statin", "statin", "lipid profile", "lipids", "cholesterol"],
-    
-    "Hypertension Annual": ["hypertension annual", "htn annual", "high blood pressure annual"],
-    "New Hypertension": ["hypertension", "htn", "high blood pressure", "new hypertension"],
-    "New Hypotension": ["hypotension", "low blood pressure"],
-    
-    "Autoimmune ANA, RF": ["autoimmune", "ana", "rf", "rheumatoid factor", "antinuclear antibody"],
-    "CBC": ["cbc", "complete blood count", "blood count"],
-    "Pericarditis follow up": ["pericarditis", "pericarditis follow"],
-    "CTD Workup": ["ctd", "connective tissue disease", "ctd workup"],
-    "Dementia": ["dementia", "memory issues", "cognitive"],
-    "Eating disorder workup": ["eating disorder", "anorexia", "bulimia"],
-    "Fatigue": ["fatigue", "tiredness", "lethargy"],
-    "INR - Standing Order": ["inr standing", "warfarin", "inr prn", "inr monitoring"],
-    "LFTs": ["lft", "lfts", "liver function", "liver function test"],
-    "LFT Elevation Acute": ["acute elevated lft", "acute liver", "acute lft elevation"],
-    "LFT Elevation Chronic": ["chronic elevated lft", "chronic liver", "chronic lft elevation"],
-    "Renal Function (RAAS start)": ["renal function", "kidney function", "raas start", "raas inhibitor"],
-    "Thrombosis screen": ["thrombosis", "thrombophilia", "clotting disorder"],
-    "TSH Standing Order": ["tsh standing", "tsh annually", "hypothyroidism", "thyroid"],
-    "Urine C&S": ["urine c&s", "urine culture", "uti", "urinary tract infection"],
-}
+    "pre-cath": ["pre-cath", "pre cath", "precath", "pre-catheterization", "pre catheterization"],
+    "pre-EP procedure": ["pre-ep", "pre ep", "pre-electrophysiology", "pre electrophysiology"],
 
+    "Amiodarone follow up": ["amiodarone follow up", "amiodarone follow-up", "amiodarone monitoring", "amiodarone labs"],
+    "Digoxin level": ["digoxin level", "digoxin levels", "dig level", "digoxin monitoring"],
 
-def extract_lab_checkboxes_from_plan(plan_text: str) -> list[str]:
-    """
-    Extract lab checkbox UI labels from PLAN text using keyword matching.
-    
-    This function analyzes the PLAN text and matches keywords to determine
-    which lab checkboxes should be checked. Similar to the eform's JavaScript
-    checkLetterPlan() function but more comprehensive.
-    
-    Args:
-        plan_text: The PLAN section text from a medical note
-        
-    Returns:
-        List of UI label strings for checkboxes that should be checked
-    """
-    if not plan_text or not plan_text.strip():
-        return []
-    
-    plan_lower = plan_text.lower()
-    matched_labels = []
-    
-    # Check each checkbox pattern
-    for ui_label, keywords in PLAN_KEYWORD_PATTERNS.items():
-        for keyword in keywords:
-            if keyword.lower() in plan_lower:
-                # Found a match - add to list if not already added
-                if ui_label not in matched_labels:
-                    matched_labels.append(ui_label)
-                break  # Only need one keyword match per checkbox
-    
-    return matched_labels
+    "comprehensive": ["comprehensive cardiac panel", "comprehensive panel", "comprehensive bloodwork",
+                      "comprehensive blood work", "comprehensive labs", "full cardiac panel"],
+    "minicomprehensive": ["minicomprehensive", "mini comprehensive", "mini-comprehensive"],
+    "RR": ["renal risk"],
+    "Cardiomyopathy": ["cardiomyopathy workup", "cardiomyopathy work-up", "ihd workup", "ihd work-up"],
 
+    "CHF Baseline": ["chf baseline", "heart failure baseline", "baseline chf labs"],
+    "CHF Follow-up": ["chf follow-up", "chf follow up", "chf followup", "heart failure follow-up", "heart failure follow up"],
+    "CHF Standing Order Q3M": ["chf standing order", "chf q3 months", "chf q3m"],
+    "CHF Follow-up post thiazide": ["post thiazide", "post-thiazide", "thiazide follow-up", "thiazide follow up"],
+    "CHF Follow-up post SGLT2": ["post sglt2", "post-sglt2", "sglt2 follow-up", "sglt2 follow up"],
+    "CHF Follow-up post high K+": ["post high k", "post high k+", "high k+ follow-up", "hyperkalemia follow-up", "hyperkalemia follow up"],
+
+    "CKD Annual": ["ckd annual", "annual ckd labs", "ckd labs annually"],
+    "eGFR/ACR Q6M": ["egfr/acr", "egfr and acr", "egfr acr", "acr q6 months", "egfr q6 months"],
+
+    "DM Annual": ["dm annual", "diabetes annual", "annual diabetes labs", "annual dm labs"],
+    "A1C Q3M": ["a1c q3 months", "a1c q3m", "hba1c q3 months", "a1c every 3 months", "hba1c every 3 months"],
+
+    "Screening": ["cholesterol screening", "lipid screening", "dyslipidemia screening"],
+    "On Statin": ["lipid profile", "lipid panel", "lipids", "fasting lipids"],
+
+    "Hypertension Annual": ["hypertension annual", "htn annual", "annual hypertension labs"],
+    "New Hypertension": ["new hypertension", "new onset hypertension", "new htn"],
+    "New Hypotension": ["new hypotension", "new onset hypotension"],
+
+    "Autoimmune ANA, RF": ["ANA", "ana titre", "ana titer", "ana test", "ana panel", "antinuclear antibody", "rheumatoid factor"],
+    "CBC": ["cbc", "complete blood count"],
+    "Pericarditis follow up": ["pericarditis follow-up", "pericarditis follow up", "pericarditis labs"],
+    "CTD Workup": ["ctd workup", "ctd work-up", "ctd serology", "connective tissue disease workup"],
+    "Dementia": ["dementia workup", "dementia work-up", "dementia screen", "dementia labs"],
+    "Eating disorder workup": ["eating disorder workup", "eating disorder work-up"],
+    "Fatigue": ["fatigue workup", "fatigue work-up", "fatigue labs"],
+    "INR - Standing Order": ["inr", "inr standing order"],
+    "LFTs": ["lft", "lfts", "liver function test", "liver function tests", "liver enzymes"],
+    "LFT Elevation Acute": ["acute lft elevation", "acutely elevated lfts", "acute elevated lft", "acute elevated lfts"],
+    "LFT Elevation Chronic": ["chronic lft elevation", "chronically elevated lfts", "chronic elevated lft", "chronic elevated lfts"],
+    "Renal Function (RAAS start)": ["renal function", "kidney function", "kidney function and electrolytes", "renal panel"],
+    "Thrombosis screen": ["thrombosis screen", "thrombophilia screen", "thrombophilia workup"],
+    "TSH Standing Order": ["tsh standing order"],
+    "Urine C&S": ["urine c&s", "urine c and s", "urine culture"],
+}
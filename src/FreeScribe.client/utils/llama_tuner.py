@@ -0,0 +1,407 @@
+"""
+llama_tuner.py
+
+Benchmarks llama.cpp settings for the local model on the machine it runs on.
+
+The fastest thread count, batch size and KV cache type depend on the CPU (hyperthreads,
+efficiency cores), the GPU and the model, so they are measured instead of guessed:
+
+1. Thread counts are tried on one loaded model. Generation and prompt evaluation are
+   timed separately, since generation is memory bound and usually fastest on the
+   physical cores while prompt evaluation can use more threads.
+2. Batch sizes are tried with the best thread counts.
+3. KV cache types (f16, f16 with flash attention, q8_0 with flash attention) are tried
+   last. Settings a build does not support are skipped.
+
+Each candidate is scored by the estimated time of a typical note request. The best
+profile is saved per model in ``llama_profile.json`` next to the settings and applied
+whenever the model is loaded.
+"""
+
+import json
+import os
+import threading
+import time
+
+from utils.file_utils import get_resource_path
+
+try:
+    import llama_cpp
+    from llama_cpp import Llama
+    LLAMA_AVAILABLE = True
+except ImportError:
+    llama_cpp = None
+    Llama = None
+    LLAMA_AVAILABLE = False
+
+
+PROFILE_FILE = "llama_profile.json"
+PROFILE_VERSION = 1
+
+# KV cache type name to ggml type, quantized V caches need flash attention
+KV_CACHE_TYPES = {"f16": 1, "q8_0": 8}
+KV_CACHE_CANDIDATES = [
+    ("f16", False),
+    ("f16", True),
+    ("q8_0", True),
+]
+
+CPU_BATCH_SIZES = [128, 256, 512]
+GPU_BATCH_SIZES = [256, 512, 1024]
+DEFAULT_BATCH_SIZE = 512
+
+BENCH_GENERATED_TOKENS = 32
+BENCH_WARM_UP_TOKENS = 8
+
+# A typical note request, used to weigh prompt against generation speed
+WORKLOAD_PROMPT_TOKENS = 1500
+WORKLOAD_GENERATED_TOKENS = 400
+
+DEFAULT_TIME_BUDGET = 180
+
+BENCH_TEXT = (
+    "Patient is a 54 year old presenting with two weeks of intermittent chest tightness on exertion, "
+    "relieved by rest. No syncope. History of hypertension and type 2 diabetes, on metformin 500 mg "
+    "twice daily and ramipril 10 mg daily. BP 148/92, HR 84, SpO2 97% on room air. ECG shows sinus "
+    "rhythm without acute changes. Plan: CBC, HbA1c, lipid profile, troponin, exercise stress test, "
+    "follow up in two weeks. "
+)
+
+
+def default_thread_count():
+    """
+    Thread count used before the model was tuned: an estimate of the physical cores.
+
+    ``os.cpu_count()`` counts hyperthreads, which slow down token generation.
+
+    :rtype: int
+    """
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def candidate_thread_counts(logical_cores=None):
+    """
+    Thread counts worth benchmarking on this machine.
+
+    :param logical_cores: Number of logical cores, defaults to ``os.cpu_count()``.
+    :type logical_cores: int or None
+    :rtype: list[int]
+    """
+    logical_cores = logical_cores or os.cpu_count() or 2
+    physical = max(1, logical_cores // 2)
+    candidates = {
+        max(1, physical // 2),
+        max(1, physical - 1),
+        physical,
+        max(1, logical_cores * 3 // 4),
+        logical_cores,
+    }
+    return sorted(candidates)
+
+
+def profile_key(model_path, gpu_layers):
+    """
+    Key of a model's profile: the file, its size and whether it runs on the GPU.
+
+    :param model_path: Path to the GGUF file.
+    :type model_path: str
+    :param gpu_layers: Layers offloaded to the GPU.
+    :type gpu_layers: int
+    :rtype: str
+    """
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    device = "gpu" if gpu_layers else "cpu"
+    return f"{os.path.basename(model_path)}|{size}|{device}"
+
+
+class LlamaProfileStore:
+    """
+    Tuned profiles saved in ``llama_profile.json``.
+
+    :param path: Path to the profile file, defaults to the file next to the settings.
+    :type path: str or None
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_resource_path(PROFILE_FILE)
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Could not read {self.path}, the local model will be re-tuned: {e}")
+            return {}
+        if data.get("version") != PROFILE_VERSION:
+            return {}
+        return data.get("profiles", {})
+
+    def _write(self, profiles):
+        with open(self.path, "w") as f:
+            json.dump({"version": PROFILE_VERSION, "profiles": profiles}, f, indent=2)
+
+    def get(self, key):
+        """
+        Get the profile of a model.
+
+        :param key: Key from ``profile_key``.
+        :type key: str
+        :return: The profile, or None if the model was not tuned.
+        :rtype: dict or None
+        """
+        with self.lock:
+            return self._read().get(key)
+
+    def get_device_threads(self, device):
+        """
+        Get the thread counts of the most recently tuned model on a device.
+
+        Thread counts depend mostly on the machine, so they are a better default for an
+        untuned model than a guess.
+
+        :param device: ``cpu`` or ``gpu``.
+        :type device: str
+        :return: ``n_threads`` and ``n_threads_batch``, or None if no model was tuned on the device.
+        :rtype: dict or None
+        """
+        with self.lock:
+            profiles = [profile for key, profile in self._read().items() if key.endswith(f"|{device}")]
+        if not profiles:
+            return None
+        latest = max(profiles, key=lambda profile: profile.get("tuned_at", 0))
+        return {"n_threads": latest["n_threads"], "n_threads_batch": latest["n_threads_batch"]}
+
+    def put(self, key, profile):
+        """
+        Save the profile of a model.
+
+        :param key: Key from ``profile_key``.
+        :type key: str
+        :param profile: The tuned settings.
+        :type profile: dict
+        """
+        with self.lock:
+            profiles = self._read()
+            profiles[key] = profile
+            try:
+                self._write(profiles)
+            except OSError as e:
+                print(f"Could not save the llama.cpp profile to {self.path}: {e}")
+
+    def remove(self, key):
+        """
+        Forget the profile of a model so it is tuned again on the next load.
+
+        :param key: Key from ``profile_key``.
+        :type key: str
+        """
+        with self.lock:
+            profiles = self._read()
+            if profiles.pop(key, None) is not None:
+                try:
+                    self._write(profiles)
+                except OSError as e:
+                    print(f"Could not update {self.path}: {e}")
+
+
+class BenchmarkResult:
+    """
+    Measured speed of one configuration.
+
+    Attributes:
+        prompt_tps: Prompt evaluation speed in tokens per second
+        generation_tps: Generation speed in tokens per second
+    """
+
+    def __init__(self, prompt_tps, generation_tps):
+        self.prompt_tps = prompt_tps
+        self.generation_tps = generation_tps
+
+    @property
+    def workload_seconds(self):
+        """Estimated time of a typical note request with this configuration."""
+        return (WORKLOAD_PROMPT_TOKENS / max(self.prompt_tps, 1e-6)
+                + WORKLOAD_GENERATED_TOKENS / max(self.generation_tps, 1e-6))
+
+    def __str__(self):
+        return f"prompt {self.prompt_tps:.1f} tok/s, generation {self.generation_tps:.1f} tok/s, ~{self.workload_seconds:.0f}s per note"
+
+
+class LlamaTuner:
+    """
+    Finds the fastest llama.cpp settings for a model.
+
+    Only one model instance is loaded at a time, so tuning needs no more memory than
+    running the model.
+
+    :param model_path: Path to the GGUF file.
+    :type model_path: str
+    :param context_size: Context size the model will run with.
+    :type context_size: int
+    :param gpu_layers: Layers offloaded to the GPU.
+    :type gpu_layers: int
+    :param time_budget: Seconds after which no new candidates are tried.
+    :type time_budget: float
+    :param should_stop: Optional callable, tuning stops early once it returns True.
+    :type should_stop: callable or None
+    """
+
+    def __init__(self, model_path, context_size=4096, gpu_layers=0, time_budget=DEFAULT_TIME_BUDGET, should_stop=None):
+        self.model_path = model_path
+        self.context_size = context_size
+        self.gpu_layers = gpu_layers
+        self.time_budget = time_budget
+        self.should_stop = should_stop or (lambda: False)
+        self.batch_sizes = GPU_BATCH_SIZES if gpu_layers else CPU_BATCH_SIZES
+        self.start_time = None
+        self.bench_tokens = None
+
+    def _out_of_time(self):
+        return self.should_stop() or time.perf_counter() - self.start_time > self.time_budget
+
+    def _load(self, n_batch, kv_cache, flash_attn, n_threads, n_threads_batch):
+        return Llama(
+            model_path=self.model_path,
+            n_ctx=self.context_size,
+            n_gpu_layers=self.gpu_layers,
+            n_batch=n_batch,
+            n_threads=n_threads,
+            n_threads_batch=n_threads_batch,
+            flash_attn=flash_attn,
+            type_k=KV_CACHE_TYPES[kv_cache],
+            type_v=KV_CACHE_TYPES[kv_cache],
+            verbose=False,
+        )
+
+    def _prompt_tokens(self, llama):
+        if self.bench_tokens is None:
+            # Long enough to fill the largest batch, so batch sizes make a difference
+            length = max(self.batch_sizes)
+            tokens = llama.tokenize(BENCH_TEXT.encode("utf-8"), add_bos=True)
+            while len(tokens) < length:
+                tokens += llama.tokenize(BENCH_TEXT.encode("utf-8"), add_bos=False)
+            self.bench_tokens = tokens[:length]
+        return self.bench_tokens
+
+    def _benchmark(self, llama, n_threads, n_threads_batch, measure_generation=True):
+        llama_cpp.llama_set_n_threads(llama._ctx.ctx, n_threads, n_threads_batch)
+        tokens = self._prompt_tokens(llama)
+
+        # The first evaluation after loading pages in the weights, keep it out of the timings
+        llama.reset()
+        llama.eval(tokens[:BENCH_WARM_UP_TOKENS])
+
+        llama.reset()
+        start = time.perf_counter()
+        llama.eval(tokens)
+        prompt_tps = len(tokens) / (time.perf_counter() - start)
+
+        generation_tps = 0.0
+        if measure_generation:
+            start = time.perf_counter()
+            for _ in range(BENCH_GENERATED_TOKENS):
+                llama.eval([llama.sample(top_k=1, temp=0.0)])
+            generation_tps = BENCH_GENERATED_TOKENS / (time.perf_counter() - start)
+
+        llama.reset()
+        return BenchmarkResult(prompt_tps, generation_tps)
+
+    def _try_load(self, **config):
+        try:
+            return self._load(**config)
+        except Exception as e:
+            print(f"Tuner: configuration {config} is not supported ({e.__class__.__name__}): {str(e)}")
+            return None
+
+    def tune(self):
+        """
+        Benchmark the candidate settings.
+
+        :return: The best profile, with the arguments to pass to ``Model``.
+        :rtype: dict
+        :raises RuntimeError: If llama-cpp-python is missing or the model cannot be loaded.
+        """
+        if not LLAMA_AVAILABLE:
+            raise RuntimeError("llama-cpp-python is not installed.")
+
+        self.start_time = time.perf_counter()
+        print(f"Tuning llama.cpp settings for {os.path.basename(self.model_path)} "
+              f"({'GPU' if self.gpu_layers else 'CPU'}, up to {self.time_budget:.0f}s)")
+
+        threads = default_thread_count()
+        config = dict(n_batch=DEFAULT_BATCH_SIZE, kv_cache="f16", flash_attn=False,
+                      n_threads=threads, n_threads_batch=os.cpu_count() or threads)
+
+        # 1. Thread counts, on a single loaded model
+        llama = self._try_load(**config)
+        if llama is None:
+            raise RuntimeError("The model could not be loaded for tuning.")
+        try:
+            best_generation = None
+            best_prompt = None
+            for count in candidate_thread_counts():
+                if best_generation is not None and self._out_of_time():
+                    break
+                result = self._benchmark(llama, count, count)
+                print(f"Tuner: {count} threads: {result}")
+                if best_generation is None or result.generation_tps > best_generation[1]:
+                    best_generation = (count, result.generation_tps)
+                if best_prompt is None or result.prompt_tps > best_prompt[1]:
+                    best_prompt = (count, result.prompt_tps)
+            config["n_threads"] = best_generation[0]
+            config["n_threads_batch"] = best_prompt[0]
+            best = self._benchmark(llama, config["n_threads"], config["n_threads_batch"])
+        finally:
+            llama.close()
+
+        # 2. Batch sizes, only prompt evaluation depends on them
+        for n_batch in self.batch_sizes:
+            if n_batch == config["n_batch"] or self._out_of_time():
+                continue
+            candidate = dict(config, n_batch=n_batch)
+            llama = self._try_load(**candidate)
+            if llama is None:
+                continue
+            try:
+                result = self._benchmark(llama, candidate["n_threads"], candidate["n_threads_batch"], measure_generation=False)
+            finally:
+                llama.close()
+            print(f"Tuner: batch {n_batch}: prompt {result.prompt_tps:.1f} tok/s")
+            if result.prompt_tps > best.prompt_tps:
+                config = candidate
+                best = BenchmarkResult(result.prompt_tps, best.generation_tps)
+
+        # 3. KV cache type and flash attention
+        for kv_cache, flash_attn in KV_CACHE_CANDIDATES:
+            if (kv_cache, flash_attn) == (config["kv_cache"], config["flash_attn"]) or self._out_of_time():
+                continue
+            candidate = dict(config, kv_cache=kv_cache, flash_attn=flash_attn)
+            llama = self._try_load(**candidate)
+            if llama is None:
+                continue
+            try:
+                result = self._benchmark(llama, candidate["n_threads"], candidate["n_threads_batch"])
+            finally:
+                llama.close()
+            print(f"Tuner: KV cache {kv_cache}{' + flash attention' if flash_attn else ''}: {result}")
+            if result.workload_seconds < best.workload_seconds:
+                config = candidate
+                best = result
+
+        elapsed = time.perf_counter() - self.start_time
+        print(f"Tuner: best settings {config} ({best}), tuned in {elapsed:.0f}s")
+        return dict(
+            config,
+            # Not benchmarked: they change load time and memory pressure, not speed
+            use_mmap=True,
+            use_mlock=False,
+            prompt_tps=round(best.prompt_tps, 1),
+            generation_tps=round(best.generation_tps, 1),
+            tuned_at=time.time(),
+        )
@@ -0,0 +1,175 @@
+"""
+llm_scheduler.py
+
+Priority scheduler in front of the local LLM.
+
+A llama.cpp context can only run one generation at a time. Rather than letting the
+note generation, lab analysis and auto-processing threads race for it, every request
+is queued here and run by a single executor thread that owns the model. Interactive
+requests jump ahead of background work, callers get a ``Future`` back and queued
+requests can be cancelled before they start.
+"""
+
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from utils.cancellation import OperationCancelledError
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_LAB = 1
+PRIORITY_AUTO = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_LAB: "lab analysis",
+    PRIORITY_AUTO: "auto-processing",
+}
+
+
+class _Job:
+    """A queued call. Ordered by priority, then submission order."""
+
+    def __init__(self, priority, sequence, fn, args, kwargs):
+        self.priority = priority
+        self.sequence = sequence
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class LLMScheduler:
+    """
+    Runs submitted calls one at a time on a dedicated thread, highest priority first.
+
+    :param name: Name of the executor thread, used in log messages.
+    :type name: str
+    """
+
+    def __init__(self, name="local-llm"):
+        self.name = name
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.running_job = None
+
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Queue a call to run on the scheduler thread.
+
+        :param fn: The callable to run.
+        :type fn: callable
+        :param priority: One of the ``PRIORITY_*`` constants, lower runs first.
+        :type priority: int
+        :return: A future for the result of ``fn``.
+        :rtype: concurrent.futures.Future
+        """
+        job = _Job(priority, next(self.sequence), fn, args, kwargs)
+        self._ensure_worker()
+        self.queue.put(job)
+        return job.future
+
+    def run(self, fn, *args, priority=PRIORITY_INTERACTIVE, cancel_event=None, **kwargs):
+        """
+        Queue a call and wait for its result.
+
+        If ``cancel_event`` is set while the call is still queued, the call is removed
+        from the queue and ``OperationCancelledError`` is raised.
+
+        :param fn: The callable to run.
+        :type fn: callable
+        :param priority: One of the ``PRIORITY_*`` constants, lower runs first.
+        :type priority: int
+        :param cancel_event: Optional event used to cancel the queued call.
+        :type cancel_event: threading.Event or None
+        :return: The result of ``fn``.
+        :raises OperationCancelledError: If the call was cancelled before it started.
+        """
+        future = self.submit(fn, *args, priority=priority, **kwargs)
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except FutureTimeoutError:
+                if cancel_event is not None and cancel_event.is_set() and future.cancel():
+                    raise OperationCancelledError("The queued request was cancelled.")
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+                self.worker.start()
+
+    def _run_loop(self):
+        while True:
+            job = self.queue.get()
+            if isinstance(job, _ShutdownSentinel):
+                return
+
+            # Returns False if the job was cancelled while it was queued
+            if not job.future.set_running_or_notify_cancel():
+                self.cancelled += 1
+                continue
+
+            wait = time.perf_counter() - job.submitted
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait >= 1.0:
+                print(f"LLM scheduler: {PRIORITY_NAMES.get(job.priority, job.priority)} request waited {wait:.1f}s in the queue")
+
+            self.running_job = job
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                self.failed += 1
+                job.future.set_exception(e)
+            else:
+                self.completed += 1
+                job.future.set_result(result)
+            finally:
+                self.running_job = None
+
+    def get_stats(self):
+        """
+        Get scheduler statistics for the debug window.
+
+        :rtype: dict
+        """
+        started = self.completed + self.failed
+        running = self.running_job
+        return {
+            "queued": self.queue.qsize(),
+            "running": PRIORITY_NAMES.get(running.priority, running.priority) if running else "idle",
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "avg wait": f"{self.total_wait / started:.2f}s" if started else "n/a",
+            "max wait": f"{self.max_wait:.2f}s",
+        }
+
+    def shutdown(self):
+        """Stop the executor thread once the jobs already queued have run."""
+        with self.lock:
+            if self.worker is not None and self.worker.is_alive():
+                self.queue.put(_ShutdownSentinel())
+
+
+class _ShutdownSentinel(_Job):
+    """Queued last so the worker exits after the pending jobs."""
+
+    def __init__(self):
+        super().__init__(float("inf"), float("inf"), None, (), {})
@@ -0,0 +1,414 @@
+"""
+model_registry.py
+
+Registry of the local GGUF models and the pool of models kept in memory.
+
+- ``read_gguf_metadata`` reads the context length, architecture and quantization from
+  the GGUF header without loading the model.
+- ``ModelRegistry`` scans the models folder and resolves model names.
+- ``parse_model_routes`` reads the prompt type to model mapping from the settings, so
+  e.g. lab analysis can run on a small fast model and SOAP notes on a larger one.
+- ``ResidentModelPool`` keeps routed models loaded under a memory budget, unloading
+  the least recently used model when a new one does not fit.
+"""
+
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_MODELS_DIR = "./models"
+DEFAULT_LOCAL_MODEL = "mistral-7b-instruct-v0.2.Q4_K_M.gguf"
+
+# Route name of the lab checkbox analysis, the other routes are prompt types
+ROUTE_LAB_ANALYSIS = "Lab Analysis"
+
+GGUF_MAGIC = b"GGUF"
+
+# GGUF metadata value types
+_GGUF_UINT8, _GGUF_INT8, _GGUF_UINT16, _GGUF_INT16, _GGUF_UINT32, _GGUF_INT32, _GGUF_FLOAT32, \
+    _GGUF_BOOL, _GGUF_STRING, _GGUF_ARRAY, _GGUF_UINT64, _GGUF_INT64, _GGUF_FLOAT64 = range(13)
+
+_GGUF_SCALAR_FORMATS = {
+    _GGUF_UINT8: "<B", _GGUF_INT8: "<b", _GGUF_UINT16: "<H", _GGUF_INT16: "<h",
+    _GGUF_UINT32: "<I", _GGUF_INT32: "<i", _GGUF_FLOAT32: "<f", _GGUF_BOOL: "<?",
+    _GGUF_UINT64: "<Q", _GGUF_INT64: "<q", _GGUF_FLOAT64: "<d",
+}
+
+# llama.cpp ``general.file_type`` values
+GGUF_FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+# Weights plus compute buffers and a 4k KV cache, relative to the file size
+MEMORY_OVERHEAD = 1.15
+
+
+class GGUFReadError(Exception):
+    """Raised when a file is not a readable GGUF model."""
+
+
+def read_gguf_metadata(path, keys=None):
+    """
+    Read metadata values from a GGUF file header.
+
+    Only the header is read. Array values (e.g. the tokenizer vocabulary) are skipped
+    without being decoded.
+
+    :param path: Path to the GGUF file.
+    :type path: str
+    :param keys: Optional set of keys to read. Reading stops once all of them were found.
+    :type keys: set[str] or None
+    :return: Metadata key to value.
+    :rtype: dict
+    :raises GGUFReadError: If the file is not a GGUF file.
+    """
+    metadata = {}
+    with open(path, "rb") as f:
+        if f.read(4) != GGUF_MAGIC:
+            raise GGUFReadError(f"{path} is not a GGUF file")
+
+        version = struct.unpack("<I", f.read(4))[0]
+        # Version 1 used 32 bit counts and string lengths
+        count_format = "<I" if version == 1 else "<Q"
+        count_size = struct.calcsize(count_format)
+
+        def read_count():
+            data = f.read(count_size)
+            if len(data) != count_size:
+                raise GGUFReadError(f"{path} ended inside the header")
+            return struct.unpack(count_format, data)[0]
+
+        def read_string():
+            return f.read(read_count()).decode("utf-8", errors="replace")
+
+        def read_value(value_type):
+            if value_type == _GGUF_STRING:
+                return read_string()
+            fmt = _GGUF_SCALAR_FORMATS.get(value_type)
+            if fmt is None:
+                raise GGUFReadError(f"Unknown GGUF value type {value_type} in {path}")
+            return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+
+        def skip_array():
+            item_type = struct.unpack("<I", f.read(4))[0]
+            length = read_count()
+            if item_type == _GGUF_STRING:
+                for _ in range(length):
+                    f.seek(read_count(), os.SEEK_CUR)
+            elif item_type == _GGUF_ARRAY:
+                for _ in range(length):
+                    skip_array()
+            else:
+                fmt = _GGUF_SCALAR_FORMATS.get(item_type)
+                if fmt is None:
+                    raise GGUFReadError(f"Unknown GGUF array type {item_type} in {path}")
+                f.seek(struct.calcsize(fmt) * length, os.SEEK_CUR)
+
+        read_count()  # tensor count
+        kv_count = read_count()
+        for _ in range(kv_count):
+            key = read_string()
+            value_type = struct.unpack("<I", f.read(4))[0]
+            if value_type == _GGUF_ARRAY:
+                skip_array()
+                continue
+
+            value = read_value(value_type)
+            if keys is None or key in keys:
+                metadata[key] = value
+            if keys is not None and keys.issubset(metadata):
+                break
+
+    return metadata
+
+
+class ModelInfo:
+    """
+    A local GGUF model and its header metadata.
+
+    Attributes:
+        path: Path to the file
+        file_name: File name, used as the model name in the settings
+        size_bytes: File size
+        architecture: Model architecture, e.g. ``llama`` or ``gemma2``
+        context_length: Context length the model was trained with, None if unknown
+        quantization: Quantization type, e.g. ``Q4_K_M``
+    """
+
+    def __init__(self, path, size_bytes, architecture=None, context_length=None, quantization=None):
+        self.path = path
+        self.file_name = os.path.basename(path)
+        self.size_bytes = size_bytes
+        self.architecture = architecture
+        self.context_length = context_length
+        self.quantization = quantization
+
+    @property
+    def estimated_memory_bytes(self):
+        """Rough RAM/VRAM needed once loaded."""
+        return int(self.size_bytes * MEMORY_OVERHEAD)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Read a model's metadata from its GGUF header.
+
+        :param path: Path to the GGUF file.
+        :type path: str
+        :rtype: ModelInfo
+        """
+        size_bytes = os.path.getsize(path)
+        try:
+            # general.architecture comes first, the other keys are named after it
+            architecture = read_gguf_metadata(path, {"general.architecture"}).get("general.architecture")
+            wanted = {"general.file_type"}
+            if architecture:
+                wanted.add(f"{architecture}.context_length")
+            metadata = read_gguf_metadata(path, wanted)
+        except (OSError, struct.error, GGUFReadError) as e:
+            print(f"Could not read GGUF metadata from {path}: {e}")
+            return cls(path, size_bytes)
+
+        file_type = metadata.get("general.file_type")
+        return cls(
+            path,
+            size_bytes,
+            architecture=architecture,
+            context_length=metadata.get(f"{architecture}.context_length"),
+            quantization=GGUF_FILE_TYPES.get(file_type, str(file_type) if file_type is not None else None),
+        )
+
+    def describe(self):
+        """Short human readable summary, e.g. for logs and the debug window."""
+        context = f"{self.context_length} ctx" if self.context_length else "ctx unknown"
+        quantization = self.quantization or "unknown quantization"
+        return f"{self.file_name} ({quantization}, {context}, {self.size_bytes / (1024 ** 3):.1f} GB)"
+
+
+class ModelRegistry:
+    """
+    Scans a folder for GGUF models.
+
+    Metadata is cached per file and only re-read when the file changes.
+
+    :param models_dir: Folder containing the GGUF files.
+    :type models_dir: str
+    """
+
+    def __init__(self, models_dir=DEFAULT_MODELS_DIR):
+        self.models_dir = models_dir
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def scan(self):
+        """
+        List the GGUF models in the models folder.
+
+        :return: Models sorted by file name.
+        :rtype: list[ModelInfo]
+        """
+        if not os.path.isdir(self.models_dir):
+            return []
+
+        models = []
+        for file_name in sorted(os.listdir(self.models_dir)):
+            if not file_name.lower().endswith(".gguf"):
+                continue
+            path = os.path.join(self.models_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            with self.lock:
+                cached = self.cache.get(path)
+                if cached is not None and cached[0] == (stat.st_mtime, stat.st_size):
+                    models.append(cached[1])
+                    continue
+
+            info = ModelInfo.from_file(path)
+            with self.lock:
+                self.cache[path] = ((stat.st_mtime, stat.st_size), info)
+            models.append(info)
+        return models
+
+    def find(self, file_name):
+        """
+        Look up a model by file name.
+
+        :param file_name: The model's file name.
+        :type file_name: str
+        :rtype: ModelInfo or None
+        """
+        for info in self.scan():
+            if info.file_name == file_name:
+                return info
+        return None
+
+    def resolve(self, file_name):
+        """
+        Resolve the model to load for a model name from the settings.
+
+        Falls back to the default model and then to the first model found, so a remote
+        model name left in the settings still loads something sensible.
+
+        :param file_name: The model's file name.
+        :type file_name: str
+        :return: The model. It may not exist if the folder has no models, loading it then
+            reports the missing file.
+        :rtype: ModelInfo
+        """
+        models = self.scan()
+        by_name = {info.file_name: info for info in models}
+        if file_name in by_name:
+            return by_name[file_name]
+        if DEFAULT_LOCAL_MODEL in by_name:
+            return by_name[DEFAULT_LOCAL_MODEL]
+        if models:
+            return models[0]
+        return ModelInfo(os.path.join(self.models_dir, DEFAULT_LOCAL_MODEL), 0)
+
+
+def parse_model_routes(text):
+    """
+    Parse the prompt type to model mapping from the settings.
+
+    Entries are separated by ``;`` or new lines, e.g.
+    ``Lab Analysis=gemma-2-2b-it-Q8_0.gguf; Scribe=mistral-7b-instruct-v0.2.Q4_K_M.gguf``.
+
+    :param text: The setting value.
+    :type text: str
+    :return: Prompt type to model file name.
+    :rtype: dict
+    """
+    routes = {}
+    for entry in str(text or "").replace("\n", ";").split(";"):
+        if "=" not in entry:
+            continue
+        route, model = entry.split("=", 1)
+        if route.strip() and model.strip():
+            routes[route.strip()] = model.strip()
+    return routes
+
+
+class ResidentModelPool:
+    """
+    Keeps loaded models under a memory budget, unloading the least recently used first.
+
+    Models are only used from the local LLM scheduler thread, so a model is never
+    unloaded while it generates.
+
+    :param loader: Called with a ``ModelInfo``, returns the loaded model.
+    :type loader: callable
+    :param budget_bytes: Memory available to the pool.
+    :type budget_bytes: int
+    """
+
+    def __init__(self, loader, budget_bytes):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self.lock = threading.RLock()
+        self.resident = OrderedDict()
+
+        self.loads = 0
+        self.unloads = 0
+        self.load_times = {}
+        self.unload_times = {}
+
+    def acquire(self, info):
+        """
+        Get a loaded model, loading it and unloading others to make room if needed.
+
+        :param info: The model to load.
+        :type info: ModelInfo
+        :return: The loaded model.
+        """
+        with self.lock:
+            entry = self.resident.get(info.path)
+            if entry is not None:
+                self.resident.move_to_end(info.path)
+                return entry[0]
+
+            needed = info.estimated_memory_bytes
+            while self.resident and self._used_bytes() + needed > self.budget_bytes:
+                self._unload(next(iter(self.resident)))
+            if needed > self.budget_bytes:
+                print(f"Warning: {info.describe()} needs about {needed / (1024 ** 2):.0f} MB, "
+                      f"more than the local model memory budget of {self.budget_bytes / (1024 ** 2):.0f} MB.")
+
+            start_time = time.perf_counter()
+            model = self.loader(info)
+            elapsed = time.perf_counter() - start_time
+            self.load_times[info.file_name] = elapsed
+            self.loads += 1
+            self.resident[info.path] = (model, info)
+            print(f"Loaded {info.describe()} in {elapsed:.1f}s")
+            return model
+
+    def peek(self, info):
+        """
+        Get a model if it is already loaded, without loading it or changing the LRU order.
+
+        :param info: The model to look up.
+        :type info: ModelInfo
+        :return: The loaded model, or None.
+        """
+        with self.lock:
+            entry = self.resident.get(info.path)
+            return entry[0] if entry is not None else None
+
+    def configure(self, budget_bytes):
+        """
+        Change the memory budget, unloading models that no longer fit.
+
+        :param budget_bytes: Memory available to the pool.
+        :type budget_bytes: int
+        """
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            while self.resident and self._used_bytes() > self.budget_bytes:
+                self._unload(next(iter(self.resident)))
+
+    def release_all(self):
+        """
+        Unload every model in the pool.
+
+        Each model waits for its generation in progress before it is closed.
+        """
+        with self.lock:
+            for path in list(self.resident):
+                self._unload(path)
+
+    def _used_bytes(self):
+        return sum(info.estimated_memory_bytes for _, info in self.resident.values())
+
+    def _unload(self, path):
+        model, info = self.resident.pop(path)
+        start_time = time.perf_counter()
+        model.close()
+        elapsed = time.perf_counter() - start_time
+        self.unload_times[info.file_name] = elapsed
+        self.unloads += 1
+        print(f"Unloaded {info.file_name} in {elapsed:.2f}s")
+
+    def get_stats(self):
+        """
+        Get pool statistics for the debug window.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "resident": ", ".join(info.file_name for _, info in self.resident.values()) or "none",
+                "memory": f"{self._used_bytes() / (1024 ** 2):.0f} / {self.budget_bytes / (1024 ** 2):.0f} MB",
+                "loads": self.loads,
+                "unloads": self.unloads,
+                "load times": ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.load_times.items()) or "n/a",
+            }
@@ -0,0 +1,187 @@
+"""
+note_fanout.py
+
+Generate several notes from one transcript at the same time.
+
+Each selected prompt, e.g. a SOAP note, a consult letter and a patient summary, becomes
+an output that is generated on a small worker pool. Against remote endpoints the outputs
+run concurrently, so the total wait is the slowest output instead of the sum of all of
+them. The local model processes one request at a time, its outputs are queued in the
+LLM scheduler and run one after the other.
+
+Like the batch transcription queue, the caller supplies the actual work as a callable,
+so this module knows nothing about the LLM or Tkinter.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.cancellation import CancellationToken, OperationCancelledError
+
+
+STATUS_QUEUED = "Queued"
+STATUS_GENERATING = "Generating"
+STATUS_DONE = "Done"
+STATUS_FAILED = "Failed"
+STATUS_CANCELLED = "Cancelled"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class FanoutOutput:
+    """
+    State of one prompt in a fan-out.
+
+    :ivar index: Position of the prompt in the fan-out.
+    :ivar prompt_type: The prompt, e.g. ``Scribe``.
+    :ivar status: One of the ``STATUS_*`` constants.
+    :ivar note: The generated note, once available.
+    :ivar error: Error message if the output failed.
+    :ivar first_token: Seconds until the first streamed token, None if nothing was streamed.
+    :ivar elapsed: Seconds spent generating the output.
+    """
+
+    def __init__(self, index, prompt_type):
+        self.index = index
+        self.prompt_type = prompt_type
+        self.status = STATUS_QUEUED
+        self.note = None
+        self.error = None
+        self.first_token = None
+        self.elapsed = 0.0
+
+
+class NoteFanout:
+    """
+    Generate a note for each of several prompts on a bounded worker pool.
+
+    :param generate: Callable ``generate(prompt_type, on_token, cancel_event)`` returning
+        the note text. ``on_token`` receives the streamed text of the note.
+    :type generate: callable
+    :param on_update: Callable invoked with a ``FanoutOutput`` whenever its status changes.
+    :type on_update: callable or None
+    :param on_token: Callable invoked as ``on_token(output, text)`` with each streamed fragment.
+    :type on_token: callable or None
+    :param max_workers: Maximum number of outputs generated at the same time.
+    :type max_workers: int
+    """
+
+    def __init__(self, generate, on_update=None, on_token=None, max_workers=4):
+        self.generate = generate
+        self.on_update = on_update
+        self.on_token = on_token
+        self.max_workers = max(1, int(max_workers))
+        self.outputs = []
+        self.cancel_token = CancellationToken()
+        self.futures = []
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self.finished_event = threading.Event()
+
+    def start(self, prompt_types):
+        """
+        Start generating a note for each prompt.
+
+        :param prompt_types: The prompts, in display order.
+        :type prompt_types: list[str]
+        :return: The outputs created for the prompts, in order.
+        :rtype: list[FanoutOutput]
+        """
+        self.outputs = [FanoutOutput(index, prompt_type) for index, prompt_type in enumerate(prompt_types)]
+        self._remaining = len(self.outputs)
+        self.start_time = time.perf_counter()
+
+        if not self.outputs:
+            self._finish()
+            return self.outputs
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.outputs)), thread_name_prefix="note-fanout")
+        self.futures = [executor.submit(self._run_output, output) for output in self.outputs]
+        # Let the workers exit once the queue drains without blocking the caller
+        executor.shutdown(wait=False)
+        return self.outputs
+
+    def cancel(self):
+        """
+        Cancel the fan-out.
+
+        Queued outputs are skipped, outputs being generated stop at their next
+        cancellation check. Finished outputs are kept.
+        """
+        self.cancel_token.cancel("The note generation was cancelled.")
+        for future, output in zip(self.futures, self.outputs):
+            if future.cancel():
+                self._set_status(output, STATUS_CANCELLED)
+                self._output_finished()
+
+    def is_finished(self):
+        return self.finished_event.is_set()
+
+    def summary(self):
+        """
+        Get a one line summary of the fan-out.
+
+        The sum of the output times next to the wall time shows what running the
+        prompts concurrently saved.
+
+        :rtype: str
+        """
+        done = sum(1 for output in self.outputs if output.status == STATUS_DONE)
+        total = sum(output.elapsed for output in self.outputs)
+        end = self.end_time or time.perf_counter()
+        wall = end - self.start_time if self.start_time else 0.0
+        return (f"{done} of {len(self.outputs)} note(s) done in {wall:.1f}s "
+                f"({total:.1f}s if generated one after the other)")
+
+    def _run_output(self, output):
+        start = time.perf_counter()
+
+        def on_token(text):
+            if output.first_token is None:
+                output.first_token = time.perf_counter() - start
+            if self.on_token is not None:
+                self.on_token(output, text)
+
+        try:
+            if self.cancel_token.cancelled:
+                self._set_status(output, STATUS_CANCELLED)
+                return
+
+            self._set_status(output, STATUS_GENERATING)
+            output.note = self.generate(output.prompt_type, on_token, self.cancel_token)
+
+            output.elapsed = time.perf_counter() - start
+            self._set_status(output, STATUS_DONE)
+        except OperationCancelledError:
+            output.elapsed = time.perf_counter() - start
+            self._set_status(output, STATUS_CANCELLED)
+        except Exception as e:
+            output.error = str(e)
+            output.elapsed = time.perf_counter() - start
+            print(f"Generating the {output.prompt_type} note failed: {e}")
+            self._set_status(output, STATUS_FAILED)
+        finally:
+            self._output_finished()
+
+    def _set_status(self, output, status):
+        output.status = status
+        if self.on_update is not None:
+            try:
+                self.on_update(output)
+            except Exception as e:
+                print(f"Note fan-out update failed: {e}")
+
+    def _output_finished(self):
+        with self._lock:
+            self._remaining -= 1
+            done = self._remaining <= 0
+        if done:
+            self._finish()
+
+    def _finish(self):
+        self.end_time = time.perf_counter()
+        print(f"Note fan-out finished: {self.summary()}")
+        self.finished_event.set()
@@ -0,0 +1,346 @@
+"""
+phi_scrubber.py
+
+Removes personal health information from transcripts and documents before they are
+sent to the LLM.
+
+Every scrub used to build a new ``scrubadub`` scrubber through ``scrubadub.clean``,
+recompile the OHIP, postal code and address patterns and run one ``re.sub`` pass per
+pattern over the text. Here the detectors are created once and the patterns are
+compiled into a single regular expression at import. The text is searched by
+scrubadub and by the combined pattern. The matches are merged into one list of
+spans, and the scrubbed text is built in a single pass. The spans are also returned,
+so the review popup can highlight what was replaced.
+
+Scrubbing is safe from several threads at once. Each thread gets its own scrubadub
+scrubber, created on first use, because scrubadub does not document its scrubbers as
+thread-safe.
+
+``IncrementalScrubber`` scrubs a realtime transcript while it is being recorded. When
+recording stops the scrubbed transcript is ready, and it is the same as a full scrub.
+"""
+
+import re
+import threading
+
+import scrubadub
+
+from utils.cancellation import check_cancelled
+
+
+# Checked in order, the first alternative matching at a position wins
+PHI_PATTERNS = [
+    ("OHIP", r'\b\d{10}\b'),  # 10 digit OHIP
+    ("OHIP", r'\b\d{4}-\d{3}-\d{3}(?:[- ]?[A-Za-z]{2})?\b'),  # OHIP with dashes
+    ("POSTAL_CODE", r'\b[ABCEGHJ-NPRSTVXY]\d[ABCEGHJ-NPRSTV-Z][ -]?\d[ABCEGHJ-NPRSTV-Z]\d\b'),  # Canadian postal codes
+    ("ADDRESS", r'\b\d+ [A-Z][a-z]+ (?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr)\b'),  # Street addresses
+]
+
+_GROUP_KINDS = {f"p{index}": kind for index, (kind, _) in enumerate(PHI_PATTERNS)}
+PHI_REGEX = re.compile(
+    "|".join(f"(?P<p{index}>{pattern})" for index, (_, pattern) in enumerate(PHI_PATTERNS)),
+    re.IGNORECASE,
+)
+
+
+def placeholder(kind):
+    """
+    Get the text that replaces PHI of a kind, e.g. ``{{OHIP}}``.
+
+    :param kind: The kind of PHI, e.g. ``OHIP``.
+    :type kind: str
+    :rtype: str
+    """
+    return "{{" + kind.upper() + "}}"
+
+
+class PhiSpan:
+    """
+    A piece of PHI found in a text.
+
+    :ivar start: Start offset in the original text.
+    :ivar end: End offset in the original text.
+    :ivar kind: The kind of PHI, e.g. ``PHONE`` or ``OHIP``.
+    :ivar replacement: The placeholder it is replaced with.
+    :ivar out_start: Start offset of the placeholder in the scrubbed text.
+    :ivar out_end: End offset of the placeholder in the scrubbed text.
+    """
+
+    __slots__ = ("start", "end", "kind", "replacement", "out_start", "out_end")
+
+    def __init__(self, start, end, kind, replacement):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.replacement = replacement
+        self.out_start = None
+        self.out_end = None
+
+    def __repr__(self):
+        return f"PhiSpan({self.start}, {self.end}, {self.kind!r})"
+
+
+class ScrubResult:
+    """
+    The scrubbed text and the spans that were replaced.
+
+    :ivar text: The scrubbed text.
+    :ivar spans: The replaced PHI, in text order.
+    """
+
+    def __init__(self, text, spans):
+        self.text = text
+        self.spans = spans
+
+
+def merge_spans(spans):
+    """
+    Drop spans that overlap an earlier span.
+
+    Spans are taken by start offset, the longer one first when two start together.
+
+    :param spans: Candidate spans in any order.
+    :type spans: list[PhiSpan]
+    :return: Non-overlapping spans in text order.
+    :rtype: list[PhiSpan]
+    """
+    merged = []
+    end = -1
+    for span in sorted(spans, key=lambda s: (s.start, -(s.end - s.start))):
+        if span.start >= end:
+            merged.append(span)
+            end = span.end
+    return merged
+
+
+def apply_spans(text, spans):
+    """
+    Replace the spans in one pass and record where each placeholder ended up.
+
+    :param text: The original text.
+    :type text: str
+    :param spans: Non-overlapping spans in text order, updated in place.
+    :type spans: list[PhiSpan]
+    :return: The scrubbed text.
+    :rtype: str
+    """
+    chunks = []
+    position = 0
+    length = 0
+    for span in spans:
+        chunk = text[position:span.start]
+        chunks.append(chunk)
+        length += len(chunk)
+        chunks.append(span.replacement)
+        span.out_start = length
+        length += len(span.replacement)
+        span.out_end = length
+        position = span.end
+    chunks.append(text[position:])
+    return "".join(chunks)
+
+
+class PhiScrubber:
+    """
+    Finds and replaces PHI with scrubadub and the Ontario specific patterns.
+
+    Create one with ``get_phi_scrubber`` and share it.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        # Build the detectors of the creating thread now rather than on the first scrub
+        self._get_scrubber()
+
+    def _get_scrubber(self):
+        scrubber = getattr(self._local, "scrubber", None)
+        if scrubber is None:
+            scrubber = scrubadub.Scrubber()
+            self._local.scrubber = scrubber
+        return scrubber
+
+    def find_spans(self, text):
+        """
+        Find the PHI in a text.
+
+        :param text: The text to search.
+        :type text: str
+        :return: Non-overlapping spans in text order.
+        :rtype: list[PhiSpan]
+        """
+        spans = []
+        for filth in self._get_scrubber().iter_filth(text):
+            kind = str(filth.type).upper()
+            replacement = filth.replacement_string if filth.replacement_string is not None else filth.replace_with()
+            spans.append(PhiSpan(filth.beg, filth.end, kind, replacement))
+
+        for match in PHI_REGEX.finditer(text):
+            kind = _GROUP_KINDS[match.lastgroup]
+            spans.append(PhiSpan(match.start(), match.end(), kind, placeholder(kind)))
+
+        return merge_spans(spans)
+
+    def scrub(self, text, cancel_token=None):
+        """
+        Replace the PHI in a text and return where it was.
+
+        :param text: The text to scrub.
+        :type text: str
+        :param cancel_token: Optional token, checked before the text is searched.
+        :type cancel_token: threading.Event or None
+        :rtype: ScrubResult
+        :raises OperationCancelledError: If the token was cancelled.
+        """
+        check_cancelled(cancel_token)
+        spans = self.find_spans(text)
+        return ScrubResult(apply_spans(text, spans), spans)
+
+    def clean(self, text, cancel_token=None):
+        """
+        Replace the PHI in a text.
+
+        :param text: The text to scrub.
+        :type text: str
+        :param cancel_token: Optional token, checked before the text is searched.
+        :type cancel_token: threading.Event or None
+        :return: The scrubbed text.
+        :rtype: str
+        :raises OperationCancelledError: If the token was cancelled.
+        """
+        return self.scrub(text, cancel_token).text
+
+
+_phi_scrubber = None
+_phi_scrubber_lock = threading.Lock()
+
+
+def get_phi_scrubber():
+    """
+    Get the shared PHI scrubber.
+
+    :rtype: PhiScrubber
+    """
+    global _phi_scrubber
+    with _phi_scrubber_lock:
+        if _phi_scrubber is None:
+            _phi_scrubber = PhiScrubber()
+        return _phi_scrubber
+
+
+def scrub_phi(text, cancel_token=None):
+    """
+    Remove personal health information from a transcript before it is sent to the LLM.
+
+    :param text: The transcript to scrub.
+    :type text: str
+    :param cancel_token: Optional token, checked before scrubbing.
+    :type cancel_token: threading.Event or None
+    :return: The scrubbed transcript.
+    :rtype: str
+    :raises OperationCancelledError: If the token was cancelled.
+    """
+    return get_phi_scrubber().clean(text, cancel_token)
+
+
+# Characters at the end of the transcript that are scanned again with the next segment
+DEFAULT_CARRY_CHARS = 200
+
+
+class IncrementalScrubber:
+    """
+    Scrubs a realtime transcript segment by segment while it is being recorded.
+
+    The transcript is split into a committed part, which is already scrubbed, and a
+    tail. Each new segment is appended to the tail and the tail is scanned again.
+    Text is committed only up to a space or line break that lies at least
+    ``carry_chars`` before the end and is not inside any PHI that was found. An entity
+    split across two segments therefore stays in the tail until it is complete. When
+    recording stops only the tail is left to scrub.
+
+    :param scrubber: The scrubber to use, defaults to the shared one.
+    :type scrubber: PhiScrubber or None
+    :param carry_chars: Characters kept in the tail, more than the longest PHI.
+    :type carry_chars: int
+    """
+
+    def __init__(self, scrubber=None, carry_chars=DEFAULT_CARRY_CHARS):
+        self.scrubber = scrubber or get_phi_scrubber()
+        self.carry_chars = carry_chars
+        self.text = ""
+        self.committed_chars = 0
+        self.committed_text = []
+        self.committed_length = 0
+        self.committed_spans = []
+        self.lock = threading.Lock()
+
+    def add_text(self, text):
+        """
+        Append text to the transcript and scrub what can no longer change.
+
+        :param text: The text exactly as it was added to the transcript box.
+        :type text: str
+        """
+        with self.lock:
+            self.text += text
+            tail = self.text[self.committed_chars:]
+            if len(tail) <= self.carry_chars:
+                return
+
+            spans = self.scrubber.find_spans(tail)
+            commit = self._commit_point(tail, spans)
+            if commit <= 0:
+                return
+
+            committed = [span for span in spans if span.end <= commit]
+            scrubbed = apply_spans(tail[:commit], committed)
+            for span in committed:
+                span.start += self.committed_chars
+                span.end += self.committed_chars
+                span.out_start += self.committed_length
+                span.out_end += self.committed_length
+            self.committed_spans.extend(committed)
+            self.committed_text.append(scrubbed)
+            self.committed_length += len(scrubbed)
+            self.committed_chars += commit
+
+    def _commit_point(self, tail, spans):
+        limit = len(tail) - self.carry_chars
+        for position in range(limit, 0, -1):
+            if tail[position - 1].isspace() and not any(span.start < position < span.end for span in spans):
+                return position
+        return 0
+
+    def result(self, transcript=None):
+        """
+        Get the scrubbed transcript.
+
+        :param transcript: The transcript about to be sent, checked against the text that
+            was added, ignoring surrounding whitespace.
+        :type transcript: str or None
+        :return: The same result as scrubbing the whole transcript at once, None if the
+            transcript was edited.
+        :rtype: ScrubResult or None
+        """
+        with self.lock:
+            text = self.text.strip()
+            if transcript is not None and transcript.strip() != text:
+                return None
+
+            tail = self.scrubber.scrub(self.text[self.committed_chars:])
+            spans = list(self.committed_spans)
+            for span in tail.spans:
+                moved = PhiSpan(span.start + self.committed_chars, span.end + self.committed_chars, span.kind, span.replacement)
+                moved.out_start = span.out_start + self.committed_length
+                moved.out_end = span.out_end + self.committed_length
+                spans.append(moved)
+            scrubbed = "".join(self.committed_text) + tail.text
+
+            # Report positions in the stripped transcript, like a scrub of the stripped text
+            lead = len(self.text) - len(self.text.lstrip())
+            result_spans = []
+            for span in spans:
+                stripped = PhiSpan(span.start - lead, span.end - lead, span.kind, span.replacement)
+                stripped.out_start = span.out_start - lead
+                stripped.out_end = span.out_end - lead
+                result_spans.append(stripped)
+            return ScrubResult(scrubbed.strip(), result_spans)
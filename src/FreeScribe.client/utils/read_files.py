@@ -7,8 +7,10 @@ import os
 import re
 import unicodedata
 
+from utils.cancellation import OperationCancelledError, check_cancelled
 
-def pdf_image_to_text(pdf_path=None, pdf_bytes=None, first_page=None, last_page=None, write_out_text=False, filename="output.txt"):
+
+def pdf_image_to_text(pdf_path=None, pdf_bytes=None, first_page=None, last_page=None, write_out_text=False, filename="output.txt", cancel_token=None):
     """
     Convert a PDF (or pdf bytes) file containing images to text using pytesseract OCR.
     
@@ -20,12 +22,17 @@ def pdf_image_to_text(pdf_path=None, pdf_bytes=None, first_page=None, last_page=
         last_page (int, optional): Last page to process.
         write_out_text (bool, optional): If True, saves the extracted text to a file.
         filename (str, optional): Filename for writing out text.
+        cancel_token (threading.Event, optional): Checked between pages, OCR stops once it is set.
     ** Either pdf_path or pdf_bytes must be provided, if both provided will use bytes **
         
         
     Returns:
     --------
         str: Extracted text from the PDF images.
+
+    Raises:
+    -------
+        OperationCancelledError: If ``cancel_token`` was set.
     """
 
     if not pdf_path and not pdf_bytes:
@@ -51,6 +58,8 @@ def pdf_image_to_text(pdf_path=None, pdf_bytes=None, first_page=None, last_page=
     # Extract text from each image using pytesseract
     text = ""
     for page in pages:
+        check_cancelled(cancel_token)
+
         # --- IMAGE PREPROCESSING BEFORE OCR ---
         # Convert PIL.Image to numpy array
         image = np.array(page)
@@ -92,7 +101,7 @@ def pdf_image_to_text(pdf_path=None, pdf_bytes=None, first_page=None, last_page=
 
 
 
-def file_reader(file_path):
+def file_reader(file_path, cancel_token=None):
     """
     Assumes passed file is either .txt or .pdf and will extract the text from the file.
     
@@ -110,14 +119,16 @@ def file_reader(file_path):
         elif file_path.lower().endswith(".pdf"):
             filename = os.path.basename(file_path)
             if detect_type(filename) == "HOLTER":
-                text = pdf_image_to_text(pdf_path=file_path, last_page=2)
+                text = pdf_image_to_text(pdf_path=file_path, last_page=2, cancel_token=cancel_token)
             else:
-                text = pdf_image_to_text(pdf_path=file_path) 
+                text = pdf_image_to_text(pdf_path=file_path, cancel_token=cancel_token)
             return text
 
         else:
             print("File type is not supported")
             return ''
+    except OperationCancelledError:
+        raise
     except Exception as e:
         print(f"An unexpected error occurred when trying to extract file text: {e}")
 
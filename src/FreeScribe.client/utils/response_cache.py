@@ -0,0 +1,390 @@
+"""
+response_cache.py
+
+Persistent, encrypted cache of LLM responses.
+
+Identical requests (same endpoint, model, prompt and sampling parameters) are answered
+from a local SQLite database instead of the model. Entries expire after a TTL and the
+least recently used entries are evicted once the cache exceeds its size limit.
+
+Responses contain PHI, so entries are always encrypted at rest:
+
+- with ``cryptography`` (Fernet) when it is installed. The key is stored next to the
+  cache protected with Windows DPAPI when ``pywin32`` is available, otherwise in the OS
+  keyring through the optional ``keyring`` package.
+- otherwise with Windows DPAPI directly.
+
+If the key cannot be protected the cache stays disabled rather than keeping the key, or
+the responses, in plain text on disk.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    Fernet = None
+    InvalidToken = None
+    CRYPTOGRAPHY_AVAILABLE = False
+
+try:
+    import win32crypt
+    DPAPI_AVAILABLE = True
+except ImportError:
+    win32crypt = None
+    DPAPI_AVAILABLE = False
+
+try:
+    import keyring # optional, keeps the Fernet key off the disk without DPAPI
+    KEYRING_AVAILABLE = True
+except ImportError:
+    keyring = None
+    KEYRING_AVAILABLE = False
+
+
+KEYRING_SERVICE = "FreeScribe response cache"
+
+
+class CacheDecryptError(Exception):
+    """Raised when a cache entry cannot be decrypted, e.g. after the key changed."""
+
+
+class FernetCipher:
+    """
+    Fernet encryption with a protected key.
+
+    The key is stored in a file encrypted with DPAPI on Windows, otherwise in the OS
+    keyring. A new key is created if none exists yet.
+
+    :param key_path: Path of the DPAPI protected key file, also names the keyring entry.
+    :type key_path: str
+    """
+
+    name = "Fernet"
+
+    def __init__(self, key_path):
+        if DPAPI_AVAILABLE:
+            key = self._load_or_create_dpapi_key(key_path)
+        else:
+            key = self._load_or_create_keyring_key(key_path)
+            self.name = "Fernet (keyring)"
+        self.fernet = Fernet(key)
+
+    @staticmethod
+    def _load_or_create_dpapi_key(key_path):
+        if os.path.exists(key_path):
+            with open(key_path, 'rb') as f:
+                data = f.read()
+            return win32crypt.CryptUnprotectData(data, None, None, None, 0)[1]
+
+        key = Fernet.generate_key()
+        data = win32crypt.CryptProtectData(key, KEYRING_SERVICE, None, None, None, 0)
+        # Create the file readable by the current user only
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return key
+
+    @staticmethod
+    def _load_or_create_keyring_key(key_path):
+        username = os.path.abspath(key_path)
+        key = keyring.get_password(KEYRING_SERVICE, username)
+        if key is None:
+            key = Fernet.generate_key().decode("ascii")
+            keyring.set_password(KEYRING_SERVICE, username, key)
+        return key.encode("ascii")
+
+    def encrypt(self, data):
+        return self.fernet.encrypt(data)
+
+    def decrypt(self, data):
+        try:
+            return self.fernet.decrypt(data)
+        except InvalidToken as e:
+            raise CacheDecryptError(str(e))
+
+
+class DpapiCipher:
+    """Windows DPAPI encryption bound to the current user account."""
+
+    name = "DPAPI"
+
+    def encrypt(self, data):
+        return win32crypt.CryptProtectData(data, None, None, None, None, 0)
+
+    def decrypt(self, data):
+        try:
+            return win32crypt.CryptUnprotectData(data, None, None, None, 0)[1]
+        except Exception as e:
+            raise CacheDecryptError(str(e))
+
+
+def create_cipher(key_path):
+    """
+    Create the strongest available cipher for cache entries.
+
+    :param key_path: Path of the key file used by Fernet.
+    :type key_path: str
+    :return: A cipher, or None if no encryption is available.
+    """
+    if CRYPTOGRAPHY_AVAILABLE and (DPAPI_AVAILABLE or KEYRING_AVAILABLE):
+        return FernetCipher(key_path)
+    if DPAPI_AVAILABLE:
+        return DpapiCipher()
+    return None
+
+
+def make_cache_key(endpoint, model, prompt, params):
+    """
+    Hash everything that determines a response into a cache key.
+
+    :param endpoint: The API endpoint, or ``local`` for the built-in model.
+    :type endpoint: str
+    :param model: The model name or path.
+    :type model: str
+    :param prompt: The full prompt.
+    :type prompt: str
+    :param params: Sampling and request parameters.
+    :type params: dict
+    :return: Hex encoded SHA-256 digest.
+    :rtype: str
+    """
+    material = json.dumps(
+        {"endpoint": endpoint, "model": model, "prompt": prompt, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite backed LLM response cache with TTL expiry and LRU size eviction.
+
+    :param db_path: Path of the SQLite database.
+    :type db_path: str
+    :param key_path: Path of the encryption key file.
+    :type key_path: str
+    :param ttl_seconds: Time after which entries expire.
+    :type ttl_seconds: float
+    :param max_bytes: Maximum total size of the stored (encrypted) responses.
+    :type max_bytes: int
+    """
+
+    def __init__(self, db_path, key_path, ttl_seconds=24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = None
+        self.cipher = None
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+
+        try:
+            self.cipher = create_cipher(key_path)
+        except Exception as e:
+            print(f"Response cache: failed to set up encryption ({e.__class__.__name__}): {e}")
+
+        if self.cipher is None:
+            print("Response cache disabled: install 'cryptography' with pywin32 on Windows or 'keyring' elsewhere to encrypt cached responses.")
+            return
+
+        conn = None
+        try:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            # A corrupt or locked database must not keep the client from starting
+            print(f"Response cache disabled: could not open {db_path} ({e.__class__.__name__}): {e}")
+            if conn is not None:
+                conn.close()
+            return
+        self.conn = conn
+
+    @property
+    def enabled(self):
+        return self.conn is not None
+
+    def configure(self, ttl_seconds, max_bytes):
+        """
+        Update the expiry and size limits.
+
+        :param ttl_seconds: Time after which entries expire.
+        :type ttl_seconds: float
+        :param max_bytes: Maximum total size of the stored responses.
+        :type max_bytes: int
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """
+        Look up a response.
+
+        A database error counts as a miss and disables the cache.
+
+        :param key: Key from ``make_cache_key``.
+        :type key: str
+        :return: The cached response, or None on a miss.
+        :rtype: str or None
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self.lock:
+            if self.conn is None:
+                return None
+            try:
+                return self._get_locked(key, now)
+            except sqlite3.Error as e:
+                self._disable_locked("read", e)
+                self.misses += 1
+                return None
+
+    def _get_locked(self, key, now):
+        row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+
+        if row is None or now - row[1] > self.ttl_seconds:
+            if row is not None:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+            self.misses += 1
+            return None
+
+        try:
+            value = self.cipher.decrypt(row[0]).decode("utf-8")
+        except CacheDecryptError:
+            # Written with a different key, it can never be read again
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.conn.commit()
+            self.misses += 1
+            return None
+
+        self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Store a response and evict expired and least recently used entries.
+
+        A database error disables the cache, the response is simply not stored.
+
+        :param key: Key from ``make_cache_key``.
+        :type key: str
+        :param value: The response text.
+        :type value: str
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        blob = self.cipher.encrypt(value.encode("utf-8"))
+        with self.lock:
+            if self.conn is None:
+                return
+            try:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, blob, len(blob), now, now),
+                )
+                self._evict_locked(now)
+                self.conn.commit()
+                self.stores += 1
+            except sqlite3.Error as e:
+                self._disable_locked("write", e)
+
+    def record_bypass(self):
+        """Count a request that was not eligible for caching."""
+        self.bypassed += 1
+
+    def clear(self):
+        """Delete every cached response."""
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.conn is None:
+                return
+            try:
+                self.conn.execute("DELETE FROM responses")
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self._disable_locked("clear", e)
+
+    def _disable_locked(self, action, error):
+        """Close a database that failed, e.g. corrupt or locked, and run without the cache. Caller holds the lock."""
+        print(f"Response cache disabled: could not {action} {self.db_path} ({error.__class__.__name__}): {error}")
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+        self.conn = None
+
+    def _evict_locked(self, now):
+        cursor = self.conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        self.evictions += max(0, cursor.rowcount)
+
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # Drop least recently used entries until the cache fits
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+        Get cache statistics for the debug window.
+
+        :rtype: dict
+        """
+        entries, size = 0, 0
+        if self.enabled:
+            with self.lock:
+                try:
+                    if self.conn is not None:
+                        entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+                except sqlite3.Error as e:
+                    self._disable_locked("read", e)
+
+        lookups = self.hits + self.misses
+        return {
+            "encryption": self.cipher.name if self.cipher else "unavailable (disabled)",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit rate": f"{self.hits / lookups:.0%}" if lookups else "n/a",
+            "bypassed": self.bypassed,
+            "stored": self.stores,
+            "evicted": self.evictions,
+            "entries": entries,
+            "size": f"{size / (1024 * 1024):.1f} MB",
+        }
+
+    def close(self):
+        if self.conn is not None:
+            with self.lock:
+                self.conn.close()
+                self.conn = None
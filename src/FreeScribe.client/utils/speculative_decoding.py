@@ -0,0 +1,178 @@
+"""
+speculative_decoding.py
+
+Draft models for llama.cpp speculative decoding.
+
+The main model verifies several drafted tokens in one batch instead of producing them
+one at a time. This pays off when the output repeats the input, as in HL7 conversion
+where OBX segments copy values, dates and sentences straight from the OCR text.
+
+- ``Prompt Lookup``: drafts the continuation of the longest n-gram match found in the
+  prompt and the text generated so far. Free, no extra model.
+- ``Draft Model``: a small GGUF model with the same vocabulary as the main model
+  greedily drafts the next tokens.
+
+Every draft model is wrapped in ``DraftStatistics`` to measure the acceptance rate.
+"""
+
+import os
+import numpy as np
+
+try:
+    from llama_cpp import Llama
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+    LLAMA_AVAILABLE = True
+except ImportError:
+    Llama = None
+    LlamaDraftModel = object
+    LlamaPromptLookupDecoding = None
+    LLAMA_AVAILABLE = False
+
+
+SPECULATIVE_OFF = "Off"
+SPECULATIVE_PROMPT_LOOKUP = "Prompt Lookup"
+SPECULATIVE_DRAFT_MODEL = "Draft Model"
+SPECULATIVE_MODES = [SPECULATIVE_OFF, SPECULATIVE_PROMPT_LOOKUP, SPECULATIVE_DRAFT_MODEL]
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Drafts tokens greedily with a small GGUF model.
+
+    The draft model must use the same tokenizer as the main model, e.g. a 0.5B and a
+    7B model from the same family. Its KV cache is kept between calls, so only the
+    tokens that changed since the last draft are evaluated.
+
+    :param model_path: Path to the draft GGUF file.
+    :type model_path: str
+    :param num_pred_tokens: Number of tokens drafted per call.
+    :type num_pred_tokens: int
+    :param context_size: Context size, must match the main model.
+    :type context_size: int
+    :param n_threads: CPU threads for the draft model.
+    :type n_threads: int or None
+    """
+
+    def __init__(self, model_path, num_pred_tokens=10, context_size=4096, n_threads=None):
+        self.num_pred_tokens = num_pred_tokens
+        self.llama = Llama(
+            model_path=model_path,
+            n_ctx=context_size,
+            n_gpu_layers=0,
+            n_threads=n_threads,
+            verbose=False,
+        )
+
+    def __call__(self, input_ids, /, **kwargs):
+        tokens = input_ids.tolist()
+        room = self.llama.n_ctx() - len(tokens)
+        count = min(self.num_pred_tokens, room)
+        if count <= 0:
+            return np.array([], dtype=np.intc)
+
+        try:
+            # Keep the part of the KV cache that still matches the input, eval() drops
+            # everything after it. At least one token is evaluated for fresh logits.
+            prefix = Llama.longest_token_prefix(self.llama._input_ids.tolist(), tokens)
+            self.llama.n_tokens = min(prefix, len(tokens) - 1)
+            self.llama.eval(tokens[self.llama.n_tokens:])
+
+            draft = []
+            for _ in range(count):
+                token = self.llama.sample(top_k=1, temp=0.0)
+                if token == self.llama.token_eos():
+                    break
+                draft.append(token)
+                self.llama.eval([token])
+            return np.array(draft, dtype=np.intc)
+        except Exception as e:
+            # A failed draft only costs speed, the main model still generates
+            print(f"Draft model error ({e.__class__.__name__}): {str(e)}")
+            self.llama.n_tokens = 0
+            return np.array([], dtype=np.intc)
+
+    def close(self):
+        self.llama.close()
+
+
+class DraftStatistics(LlamaDraftModel):
+    """
+    Wraps a draft model and counts the drafted tokens.
+
+    llama.cpp calls the draft model once per verification round and every round
+    produces the accepted draft tokens plus one token from the main model, so with
+    ``n`` generated tokens and ``r`` draft calls roughly ``n - r - 1`` drafted tokens
+    were accepted.
+
+    :param draft_model: The draft model to wrap.
+    :type draft_model: LlamaDraftModel
+    """
+
+    def __init__(self, draft_model):
+        self.draft_model = draft_model
+        self.reset()
+
+    def reset(self):
+        """Start counting for a new request."""
+        self.calls = 0
+        self.drafted = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = self.draft_model(input_ids, **kwargs)
+        self.calls += 1
+        self.drafted += len(draft)
+        return draft
+
+    def acceptance_rate(self, generated_tokens):
+        """
+        Estimate the share of drafted tokens the main model accepted.
+
+        :param generated_tokens: Number of tokens generated in the request.
+        :type generated_tokens: int
+        :return: Acceptance rate between 0 and 1, or None if nothing was drafted.
+        :rtype: float or None
+        """
+        if self.drafted == 0:
+            return None
+        accepted = max(0, generated_tokens - self.calls - 1)
+        return min(1.0, accepted / self.drafted)
+
+    def close(self):
+        if hasattr(self.draft_model, "close"):
+            self.draft_model.close()
+
+
+def create_draft_model(mode, num_pred_tokens=10, draft_model_path=None, context_size=4096, n_threads=None):
+    """
+    Create the draft model for a speculative decoding mode.
+
+    :param mode: One of ``SPECULATIVE_MODES``.
+    :type mode: str
+    :param num_pred_tokens: Number of tokens drafted per round.
+    :type num_pred_tokens: int
+    :param draft_model_path: Path to the draft GGUF, required for ``Draft Model``.
+    :type draft_model_path: str or None
+    :param context_size: Context size of the main model.
+    :type context_size: int
+    :param n_threads: CPU threads for a draft GGUF model.
+    :type n_threads: int or None
+    :return: A wrapped draft model, or None when speculative decoding is off or the
+        draft model cannot be loaded.
+    :rtype: DraftStatistics or None
+    :raises ValueError: If the mode is unknown.
+    """
+    if mode == SPECULATIVE_OFF or not mode:
+        return None
+    if mode == SPECULATIVE_PROMPT_LOOKUP:
+        return DraftStatistics(LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens))
+    if mode == SPECULATIVE_DRAFT_MODEL:
+        # A bad draft model only costs speed, the main model still loads without it
+        if not draft_model_path or not os.path.isfile(draft_model_path):
+            print(f"Speculative decoding turned off: Draft Model Path '{draft_model_path or ''}' is not a file.")
+            return None
+        try:
+            return DraftStatistics(GGUFDraftModel(draft_model_path, num_pred_tokens, context_size, n_threads))
+        except Exception as e:
+            print(f"Speculative decoding turned off: could not load draft model {draft_model_path} ({e.__class__.__name__}): {str(e)}")
+            return None
+    raise ValueError(f"Unknown speculative decoding mode '{mode}'.")
@@ -0,0 +1,114 @@
+"""
+streaming.py
+
+Helpers for streaming LLM output into the GUI.
+
+- ``iter_sse_content`` parses an OpenAI style ``stream: true`` chat completion
+  (server-sent events) and yields the text deltas.
+- ``TokenBatcher`` collects tokens produced on a worker thread and hands them to the
+  Tk thread in batches, so the text widget is redrawn every ~50 ms instead of once
+  per token.
+"""
+
+import json
+import threading
+
+
+STREAM_FLUSH_INTERVAL_MS = 50
+
+
+def iter_sse_content(response):
+    """
+    Yield the content deltas of a streamed chat completion.
+
+    :param response: A ``requests`` response opened with ``stream=True``.
+    :type response: requests.Response
+    :return: Generator of text fragments in the order they were produced.
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            # Blank keep-alive lines, comments and event names carry no content
+            continue
+
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            print(f"Skipping malformed stream chunk: {data[:80]}")
+            continue
+
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+
+        content = (choices[0].get("delta") or {}).get("content")
+        if content:
+            yield content
+
+
+class TokenBatcher:
+    """
+    Batch streamed tokens and deliver them on the Tk thread.
+
+    ``push`` may be called from any thread. The first pushed token schedules a flush
+    ``interval_ms`` later; all tokens that arrive in the meantime are delivered together.
+
+    :param root: The Tk root used to schedule flushes.
+    :type root: tk.Tk
+    :param on_flush: Called on the Tk thread as ``on_flush(text, is_first)``.
+    :type on_flush: callable
+    :param interval_ms: Time between redraws in milliseconds.
+    :type interval_ms: int
+    """
+
+    def __init__(self, root, on_flush, interval_ms=STREAM_FLUSH_INTERVAL_MS):
+        self.root = root
+        self.on_flush = on_flush
+        self.interval_ms = interval_ms
+        self.pending = []
+        self.scheduled = False
+        self.closed = False
+        self.flushed_any = False
+        self.lock = threading.Lock()
+
+    def push(self, text):
+        """
+        Queue a fragment of text for display.
+
+        :param text: The streamed fragment.
+        :type text: str
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.pending.append(text)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.root.after(self.interval_ms, self._flush)
+
+    def close(self):
+        """
+        Stop the stream and drop any undelivered text.
+
+        Called once the full response is available and about to replace the streamed
+        text, so a late flush cannot append to the final note.
+        """
+        with self.lock:
+            self.closed = True
+            self.pending = []
+
+    def _flush(self):
+        with self.lock:
+            self.scheduled = False
+            if self.closed or not self.pending:
+                return
+            text = "".join(self.pending)
+            self.pending = []
+            is_first = not self.flushed_any
+            self.flushed_any = True
+
+        self.on_flush(text, is_first)
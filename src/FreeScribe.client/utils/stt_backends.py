@@ -0,0 +1,252 @@
+"""
+stt_backends.py
+
+Local speech to text backends for the Built-in Speech2Text mode.
+
+Two interchangeable backends are provided:
+
+- ``openai-whisper``: the reference PyTorch implementation.
+- ``faster-whisper``: CTranslate2 implementation, several times faster on CPU with int8 weights.
+
+A backend is created once from the application settings, loaded once and then reused
+for every realtime chunk and every uploaded file. Its real-time factor is measured on
+the audio it transcribes, so loading is not delayed by a benchmark.
+"""
+
+import os
+import threading
+import time
+import numpy as np
+
+from utils.cancellation import check_cancelled
+
+try:
+    import whisper # python package is named openai-whisper
+    WHISPER_AVAILABLE = True
+except ImportError:
+    whisper = None
+    WHISPER_AVAILABLE = False
+
+try:
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    WhisperModel = None
+    FASTER_WHISPER_AVAILABLE = False
+
+
+OPENAI_WHISPER = "openai-whisper"
+FASTER_WHISPER = "faster-whisper"
+STT_BACKENDS = [FASTER_WHISPER, OPENAI_WHISPER]
+COMPUTE_TYPES = ["int8", "int8_float32", "int8_float16", "float16", "float32"]
+
+SAMPLE_RATE = 16000
+
+
+class SpeechToTextBackend:
+    """
+    Base class for local speech to text backends.
+
+    Subclasses implement ``_load`` and ``_transcribe``. Transcription is serialized
+    with a lock because the underlying models are not safe for concurrent use.
+
+    :param model_name: The Whisper model size or path, e.g. ``small.en``.
+    :type model_name: str
+    """
+
+    name = None
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.model = None
+        self.audio_seconds = 0.0
+        self.processing_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load the model into memory. Raises if the model cannot be loaded."""
+        self._load()
+
+    def transcribe(self, audio, cancel_token=None):
+        """
+        Transcribe audio to text.
+
+        :param audio: Path to an audio file or a float32 NumPy array of 16 kHz mono samples.
+        :type audio: str or numpy.ndarray
+        :param cancel_token: Optional token, checked before decoding and, where the
+            backend allows it, between segments.
+        :type cancel_token: threading.Event or None
+        :return: The transcribed text.
+        :rtype: str
+        :raises OperationCancelledError: If the token was cancelled.
+        """
+        if self.model is None:
+            raise RuntimeError("Speech to text model is not loaded.")
+
+        check_cancelled(cancel_token)
+        with self.lock:
+            # Checked again, the token may have been cancelled while waiting for the lock
+            check_cancelled(cancel_token)
+            start = time.perf_counter()
+            text = self._transcribe(audio, cancel_token)
+            # Only sample arrays have a known duration, files are decoded by the backend
+            if isinstance(audio, np.ndarray) and audio.size:
+                self.processing_seconds += time.perf_counter() - start
+                self.audio_seconds += audio.size / SAMPLE_RATE
+            return text
+
+    @property
+    def real_time_factor(self):
+        """
+        Processing time / audio duration over everything transcribed so far.
+
+        A value below 1.0 means audio is transcribed faster than it is spoken.
+
+        :return: The real-time factor, or None before the first transcription.
+        :rtype: float or None
+        """
+        if not self.audio_seconds:
+            return None
+        return self.processing_seconds / self.audio_seconds
+
+    def get_stats(self):
+        """
+        Get backend statistics for the debug window.
+
+        :rtype: dict
+        """
+        rtf = self.real_time_factor
+        return {
+            "backend": self.describe(),
+            "transcribed": f"{self.audio_seconds:.0f}s",
+            "real-time factor": f"{rtf:.2f} ({1 / rtf if rtf > 0 else 0:.1f}x real time)" if rtf is not None else "n/a",
+        }
+
+    def describe(self):
+        """
+        Get a short human readable description of the backend configuration.
+
+        :rtype: str
+        """
+        return f"{self.name} ({self.model_name})"
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _transcribe(self, audio, cancel_token=None):
+        raise NotImplementedError
+
+
+class OpenAIWhisperBackend(SpeechToTextBackend):
+    """Backend using the openai-whisper package."""
+
+    name = OPENAI_WHISPER
+
+    def _load(self):
+        if not WHISPER_AVAILABLE:
+            raise ImportError("openai-whisper is not installed. Cannot use Local Whisper. Please install it or use Remote Whisper.")
+        self.model = whisper.load_model(self.model_name)
+
+    def _transcribe(self, audio, cancel_token=None):
+        # openai-whisper decodes the whole file in one call, so it can only be cancelled before
+        result = self.model.transcribe(audio, fp16=False)
+        return result["text"]
+
+
+class FasterWhisperBackend(SpeechToTextBackend):
+    """
+    Backend using faster-whisper (CTranslate2).
+
+    :param model_name: The Whisper model size or path, e.g. ``small.en``.
+    :type model_name: str
+    :param compute_type: CTranslate2 compute type, ``int8`` is the fastest on CPU.
+    :type compute_type: str
+    :param cpu_threads: Number of CPU threads, 0 lets CTranslate2 decide.
+    :type cpu_threads: int
+    :param device: ``cpu`` or ``cuda``.
+    :type device: str
+    """
+
+    name = FASTER_WHISPER
+
+    def __init__(self, model_name, compute_type="int8", cpu_threads=0, device="cpu"):
+        super().__init__(model_name)
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.device = device
+
+    def _load(self):
+        if not FASTER_WHISPER_AVAILABLE:
+            raise ImportError("faster-whisper is not installed. Please install it or select openai-whisper as the Speech2Text backend.")
+        self.model = WhisperModel(
+            self.model_name,
+            device=self.device,
+            compute_type=self.compute_type,
+            cpu_threads=self.cpu_threads,
+        )
+
+    def _transcribe(self, audio, cancel_token=None):
+        segments, _ = self.model.transcribe(audio, beam_size=5)
+        # segments is a lazy generator, iterating it runs the decoding, so stopping
+        # between segments skips the rest of the work
+        text = []
+        for segment in segments:
+            check_cancelled(cancel_token)
+            text.append(segment.text)
+        return "".join(text)
+
+    def describe(self):
+        threads = self.cpu_threads or "auto"
+        return f"{self.name} ({self.model_name}, {self.device}, {self.compute_type}, {threads} threads)"
+
+
+def create_stt_backend(app_settings):
+    """
+    Create the local speech to text backend selected in the settings.
+
+    Falls back to the other backend when the selected one is not installed.
+
+    :param app_settings: Application settings object.
+    :type app_settings: SettingsWindow
+    :return: An unloaded backend instance.
+    :rtype: SpeechToTextBackend
+    :raises ImportError: If no backend is installed.
+    """
+    settings = app_settings.editable_settings
+    model_name = settings["Whisper Model"].strip()
+    backend_name = settings.get("Whisper Backend", FASTER_WHISPER)
+
+    if backend_name == FASTER_WHISPER and not FASTER_WHISPER_AVAILABLE and WHISPER_AVAILABLE:
+        print("faster-whisper is not installed, falling back to openai-whisper.")
+        backend_name = OPENAI_WHISPER
+    elif backend_name == OPENAI_WHISPER and not WHISPER_AVAILABLE and FASTER_WHISPER_AVAILABLE:
+        print("openai-whisper is not installed, falling back to faster-whisper.")
+        backend_name = FASTER_WHISPER
+
+    if backend_name == FASTER_WHISPER:
+        try:
+            cpu_threads = int(settings.get("Whisper CPU Threads", 0))
+        except (TypeError, ValueError):
+            cpu_threads = 0
+        if cpu_threads <= 0:
+            cpu_threads = default_cpu_threads()
+        device = "cuda" if settings.get("Architecture") == "CUDA (Nvidia GPU)" else "cpu"
+        return FasterWhisperBackend(
+            model_name,
+            compute_type=str(settings.get("Whisper Compute Type", "int8")).strip() or "int8",
+            cpu_threads=cpu_threads,
+            device=device,
+        )
+
+    return OpenAIWhisperBackend(model_name)
+
+
+def default_cpu_threads():
+    """
+    Get a sensible default CPU thread count for CPU transcription.
+
+    Hyperthreads rarely help matrix heavy workloads, so half the logical cores is used.
+
+    :rtype: int
+    """
+    return max(1, (os.cpu_count() or 2) // 2)
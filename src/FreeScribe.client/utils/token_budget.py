@@ -0,0 +1,221 @@
+"""
+token_budget.py
+
+Token counting and pre-flight budget checks for LLM requests.
+
+Prompts are counted before they are sent:
+
+- with the llama.cpp tokenizer for the local model (exact),
+- with tiktoken's ``cl100k_base`` BPE for remote endpoints (a close approximation for
+  most current models),
+- with a character heuristic if tiktoken is not available.
+
+``plan_request`` then picks ``max_tokens`` so the prompt and the response fit in the
+context, and ``TokenUsageStats`` keeps per-request token counts for the debug window.
+"""
+
+import threading
+from collections import OrderedDict
+
+from utils.chunking import heuristic_token_count
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+
+REMOTE_ENCODING = "cl100k_base"
+
+# Tokens added by the chat template around the prompt
+CHAT_TEMPLATE_OVERHEAD = 32
+
+TEMPLATE_CACHE_SIZE = 64
+
+
+class PromptTooLongError(Exception):
+    """Raised before sending a prompt that does not fit in the model context."""
+
+
+class TokenCounter:
+    """
+    Counts tokens with a tokenizer function, caching the counts of prompt templates.
+
+    :param name: Name of the tokenizer, shown in log messages.
+    :type name: str
+    :param tokenize: Callable returning the token count of a string.
+    :type tokenize: callable
+    :param exact: Whether the counts match the model exactly.
+    :type exact: bool
+    """
+
+    def __init__(self, name, tokenize, exact=False):
+        self.name = name
+        self.tokenize = tokenize
+        self.exact = exact
+        self.template_counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count(self, text):
+        """
+        Count the tokens of a text.
+
+        :param text: The text to measure.
+        :type text: str
+        :rtype: int
+        """
+        return self.tokenize(text)
+
+    def count_template(self, template):
+        """
+        Count the tokens of a prompt template, cached because templates repeat on every request.
+
+        :param template: The template text, e.g. a prompt with the document left out.
+        :type template: str
+        :rtype: int
+        """
+        with self.lock:
+            if template in self.template_counts:
+                self.template_counts.move_to_end(template)
+                return self.template_counts[template]
+
+        tokens = self.tokenize(template)
+        with self.lock:
+            self.template_counts[template] = tokens
+            while len(self.template_counts) > TEMPLATE_CACHE_SIZE:
+                self.template_counts.popitem(last=False)
+        return tokens
+
+
+_remote_counter = None
+_remote_counter_lock = threading.Lock()
+
+
+def get_remote_token_counter():
+    """
+    Get the shared token counter for remote endpoints.
+
+    :rtype: TokenCounter
+    """
+    global _remote_counter
+    with _remote_counter_lock:
+        if _remote_counter is None:
+            _remote_counter = _create_remote_token_counter()
+        return _remote_counter
+
+
+def _create_remote_token_counter():
+    if TIKTOKEN_AVAILABLE:
+        try:
+            encoding = tiktoken.get_encoding(REMOTE_ENCODING)
+            return TokenCounter(f"tiktoken {REMOTE_ENCODING}", lambda text: len(encoding.encode(text, disallowed_special=())))
+        except Exception as e:
+            # The encoding file is downloaded on first use and may be unavailable offline
+            print(f"tiktoken unavailable ({e.__class__.__name__}): {str(e)}. Estimating token counts.")
+    return TokenCounter("estimate", heuristic_token_count)
+
+
+class RequestBudget:
+    """
+    Token budget of a single request.
+
+    Attributes:
+        prompt_tokens: Tokens in the prompt
+        max_tokens: Tokens the response may use
+        context_size: Context window of the model
+        clamped: True if ``max_tokens`` was lowered to fit the context
+    """
+
+    def __init__(self, prompt_tokens, max_tokens, context_size, clamped):
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.context_size = context_size
+        self.clamped = clamped
+
+
+def plan_request(prompt_tokens, context_size, requested_max_tokens, min_output_tokens=16):
+    """
+    Pick ``max_tokens`` so the prompt and the response fit in the context.
+
+    :param prompt_tokens: Tokens in the prompt.
+    :type prompt_tokens: int
+    :param context_size: Context window of the model.
+    :type context_size: int
+    :param requested_max_tokens: The response length asked for.
+    :type requested_max_tokens: int
+    :param min_output_tokens: Smallest useful response, a prompt leaving less room does not fit.
+    :type min_output_tokens: int
+    :return: The budget.
+    :rtype: RequestBudget
+    :raises PromptTooLongError: If the prompt leaves no room for a response.
+    """
+    available = context_size - prompt_tokens - CHAT_TEMPLATE_OVERHEAD
+    if available < min_output_tokens:
+        raise PromptTooLongError(
+            f"The prompt is {prompt_tokens} tokens, which does not fit in the {context_size} token context "
+            f"of the model. Shorten the text or use a model with a larger context."
+        )
+
+    max_tokens = min(requested_max_tokens, available)
+    return RequestBudget(prompt_tokens, max_tokens, context_size, max_tokens < requested_max_tokens)
+
+
+class TokenUsageStats:
+    """Per-request token counts and totals, for cost and latency tracking."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_time = 0.0
+        self.clamped = 0
+        self.rejected = 0
+
+    def record(self, label, budget, completion_tokens, elapsed):
+        """
+        Log and count a finished request.
+
+        :param label: Where the request went, e.g. ``local`` or the endpoint.
+        :type label: str
+        :param budget: The budget the request was sent with.
+        :type budget: RequestBudget
+        :param completion_tokens: Tokens in the response.
+        :type completion_tokens: int
+        :param elapsed: Request time in seconds.
+        :type elapsed: float
+        """
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += budget.prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.total_time += elapsed
+            if budget.clamped:
+                self.clamped += 1
+
+        print(f"LLM request ({label}): {budget.prompt_tokens} prompt + {completion_tokens} completion tokens "
+              f"of {budget.context_size} context, max_tokens {budget.max_tokens}, {elapsed:.1f}s")
+
+    def record_rejected(self):
+        """Count a request that was not sent because the prompt was too long."""
+        with self.lock:
+            self.rejected += 1
+
+    def get_stats(self):
+        """
+        Get token statistics for the debug window.
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "prompt tokens": self.prompt_tokens,
+                "completion tokens": self.completion_tokens,
+                "avg prompt": self.prompt_tokens // self.requests if self.requests else "n/a",
+                "avg time": f"{self.total_time / self.requests:.1f}s" if self.requests else "n/a",
+                "max_tokens clamped": self.clamped,
+                "rejected (too long)": self.rejected,
+            }